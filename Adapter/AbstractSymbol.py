@@ -1,7 +1,8 @@
 from enum import Enum, StrEnum, auto
 from typing import List, Optional
-import jsons
+import json
 import re
+import struct
 from TCP import FlagSet
 
 
@@ -13,36 +14,74 @@ class Value(StrEnum):
 
 validValues = list(map(lambda x: x.value, list(Value)))
 
-class AbstractSymbol:
-    flags: FlagSet = FlagSet()
-    seqNumber: Optional[Value] | int = None
-    ackNumber: Optional[Value] | int = None
-    payloadLength: Optional[int] = None
+# Binary form of a symbol: flags, kind and value of seq and ack, and payload length, 0xFFFF if unknown.
+# A kind is 0 for unknown, 1 for a number, or 2 plus the index of the Value.
+SYMBOL_STRUCT = struct.Struct("!BBIBIH")
+PAIR_STRUCT = struct.Struct("!HH")
+VALUES = list(Value)
 
-    def __init__(self, symbol: str | tuple[str, Optional[Value] | int, Optional[Value] | int, int]):
-        if isinstance(symbol, str):
-            pattern = re.compile(r"([A-Z+]+)\(([A-Z0-9?]+),([A-Z0-9?]+),([0-9?]+)\)")
-            capture = pattern.match(symbol)
 
-            if capture is None:
-                raise ValueError("Invalid abstract syntax:", symbol)
+def encodeNumber(number: Optional[Value] | int) -> tuple[int, int]:
+    if number is None:
+        return 0, 0
+    if isinstance(number, Value):
+        return 2 + VALUES.index(number), 0
+    return 1, number
 
-            self.flags = FlagSet("".join(map(lambda x: x[0], capture.group(1).split("+"))))
-            if capture.group(2) in validValues:
-                self.seqNumber = Value(capture.group(2))
-            elif  capture.group(2).isdigit():
-                self.seqNumber = int(capture.group(2))
-            else:
-                self.seqNumber = None
 
-            if capture.group(3) in validValues:
-                self.ackNumber = Value(capture.group(3))
-            elif  capture.group(3).isdigit():
-                self.ackNumber = int(capture.group(3))
-            else:
-                self.ackNumber = None
+def decodeNumber(kind: int, number: int) -> Optional[Value] | int:
+    if kind == 0:
+        return None
+    if kind == 1:
+        return number
+    return VALUES[kind - 2]
+
+
+def toValue(number: Optional[str | int]) -> Optional[Value] | int:
+    if isinstance(number, str):
+        return Value(number)
+    return number
+
+
+SYMBOL_PATTERN = re.compile(r"([A-Z+]+)\(([A-Z0-9?]+),([A-Z0-9?]+),([0-9?]+)\)")
+
+
+def parseNumber(number: str) -> Optional[Value] | int:
+    if number in validValues:
+        return Value(number)
+    elif number.isdigit():
+        return int(number)
+    return None
+
 
-            self.payloadLength = int(capture.group(4)) if capture.group(4) != "?" else None
+def parseSymbol(symbol: str) -> tuple[FlagSet, Optional[Value] | int, Optional[Value] | int, Optional[int]]:
+    capture = SYMBOL_PATTERN.match(symbol)
+    if capture is None:
+        raise ValueError("Invalid abstract syntax:", symbol)
+    flags = FlagSet("".join(map(lambda x: x[0], capture.group(1).split("+"))))
+    payloadLength = int(capture.group(4)) if capture.group(4) != "?" else None
+    return flags, parseNumber(capture.group(2)), parseNumber(capture.group(3)), payloadLength
+
+
+# Parsed symbols by their text. The abstract alphabet is small, so nearly every symbol is parsed once.
+PARSED_SYMBOLS: dict[str, tuple[FlagSet, Optional[Value] | int, Optional[Value] | int, Optional[int]]] = dict()
+
+
+class AbstractSymbol:
+    __slots__ = ("flags", "seqNumber", "ackNumber", "payloadLength")
+    flags: FlagSet
+    seqNumber: Optional[Value] | int
+    ackNumber: Optional[Value] | int
+    payloadLength: Optional[int]
+
+    def __init__(self, symbol: str | tuple[str, Optional[Value] | int, Optional[Value] | int, Optional[int]]):
+        if isinstance(symbol, str):
+            parsed = PARSED_SYMBOLS.get(symbol)
+            if parsed is None:
+                parsed = parseSymbol(symbol)
+                if len(PARSED_SYMBOLS) < 65536:
+                    PARSED_SYMBOLS[symbol] = parsed
+            self.flags, self.seqNumber, self.ackNumber, self.payloadLength = parsed
 
         else:
             self.flags = FlagSet(symbol[0])
@@ -57,13 +96,58 @@ class AbstractSymbol:
         payloadLenString = "?" if self.payloadLength is None else str(self.payloadLength)
         return flagsString + "(" + seqString + "," + ackString + "," + payloadLenString + ")"
 
+    # The form symbols have always been stored in, with every attribute by name.
+    def toDict(self) -> dict:
+        return {
+            "ackNumber": self.ackNumber,
+            "flags": self.flags.asDict(),
+            "payloadLength": self.payloadLength,
+            "seqNumber": self.seqNumber,
+        }
+
     def toJSON(self) -> str:
-        return jsons.dumps(self)
+        return json.dumps(self.toDict())
+
+    # Inverse of toJSON, after json.loads.
+    @staticmethod
+    def fromDict(data: dict) -> "AbstractSymbol":
+        flags = "".join(map(lambda flag: flag[0], filter(lambda flag: data["flags"][flag], data["flags"])))
+        return AbstractSymbol((flags, toValue(data["seqNumber"]), toValue(data["ackNumber"]), data["payloadLength"]))
+
+    # Compact form: flags byte, seq, ack and payload length.
+    def toList(self) -> list:
+        return [self.flags.bits, self.seqNumber, self.ackNumber, self.payloadLength]
+
+    @staticmethod
+    def fromList(data: list) -> "AbstractSymbol":
+        symbol = AbstractSymbol.__new__(AbstractSymbol)
+        symbol.flags = FlagSet.fromBits(data[0])
+        symbol.seqNumber = toValue(data[1])
+        symbol.ackNumber = toValue(data[2])
+        symbol.payloadLength = data[3]
+        return symbol
+
+    def toBytes(self) -> bytes:
+        seqKind, seq = encodeNumber(self.seqNumber)
+        ackKind, ack = encodeNumber(self.ackNumber)
+        payloadLength = self.payloadLength if self.payloadLength is not None else 0xFFFF
+        return SYMBOL_STRUCT.pack(self.flags.bits, seqKind, seq, ackKind, ack, payloadLength)
+
+    @staticmethod
+    def fromBytes(data: bytes | memoryview, offset: int = 0) -> "AbstractSymbol":
+        bits, seqKind, seq, ackKind, ack, payloadLength = SYMBOL_STRUCT.unpack_from(data, offset)
+        symbol = AbstractSymbol.__new__(AbstractSymbol)
+        symbol.flags = FlagSet.fromBits(bits)
+        symbol.seqNumber = decodeNumber(seqKind, seq)
+        symbol.ackNumber = decodeNumber(ackKind, ack)
+        symbol.payloadLength = payloadLength if payloadLength != 0xFFFF else None
+        return symbol
 
 
 class AbstractOrderedPair:
-    abstractInputs: List[Optional[AbstractSymbol]] = []
-    abstractOutputs: List[Optional[AbstractSymbol]] = []
+    __slots__ = ("abstractInputs", "abstractOutputs")
+    abstractInputs: List[Optional[AbstractSymbol]]
+    abstractOutputs: List[Optional[AbstractSymbol]]
 
     def __init__(self, inputs: List[Optional[AbstractSymbol]], outputs: List[Optional[AbstractSymbol]]):
         self.abstractInputs = inputs
@@ -77,5 +161,50 @@ class AbstractOrderedPair:
         aoString = "[{}]".format(", ".join(concreteInputStrings))
         return "({},{})".format(aiString, aoString)
 
+    def toDict(self) -> dict:
+        return {
+            "abstractInputs": [symbol.toDict() if symbol is not None else None for symbol in self.abstractInputs],
+            "abstractOutputs": [symbol.toDict() if symbol is not None else None for symbol in self.abstractOutputs],
+        }
+
     def toJSON(self) -> str:
-        return jsons.dumps(self)
+        return json.dumps(self.toDict())
+
+    # Symbols as lists, see AbstractSymbol.toList, under "i" and "o".
+    def toCompactJSON(self) -> str:
+        inputs = [symbol.toList() if symbol is not None else None for symbol in self.abstractInputs]
+        outputs = [symbol.toList() if symbol is not None else None for symbol in self.abstractOutputs]
+        return json.dumps({"i": inputs, "o": outputs}, separators=(",", ":"))
+
+    # Takes both the form of toJSON and that of toCompactJSON.
+    @staticmethod
+    def fromJSON(text: str | dict) -> "AbstractOrderedPair":
+        data = json.loads(text) if isinstance(text, str) else text
+        if "i" in data:
+            inputs = [AbstractSymbol.fromList(symbol) if symbol is not None else None for symbol in data["i"]]
+            outputs = [AbstractSymbol.fromList(symbol) if symbol is not None else None for symbol in data["o"]]
+            return AbstractOrderedPair(inputs, outputs)
+        inputs = [AbstractSymbol.fromDict(symbol) if symbol is not None else None for symbol in data["abstractInputs"]]
+        outputs = [AbstractSymbol.fromDict(symbol) if symbol is not None else None for symbol in data["abstractOutputs"]]
+        return AbstractOrderedPair(inputs, outputs)
+
+    # Counts of inputs and outputs, then every symbol after a byte that is 0 for None.
+    def toBytes(self) -> bytes:
+        parts = [PAIR_STRUCT.pack(len(self.abstractInputs), len(self.abstractOutputs))]
+        for symbol in self.abstractInputs + self.abstractOutputs:
+            parts.append(b"\x01" + symbol.toBytes() if symbol is not None else b"\x00")
+        return b"".join(parts)
+
+    @staticmethod
+    def fromBytes(data: bytes) -> "AbstractOrderedPair":
+        inputCount, outputCount = PAIR_STRUCT.unpack_from(data, 0)
+        offset = PAIR_STRUCT.size
+        symbols: list[Optional[AbstractSymbol]] = []
+        for _ in range(inputCount + outputCount):
+            if data[offset] == 0:
+                symbols.append(None)
+                offset += 1
+            else:
+                symbols.append(AbstractSymbol.fromBytes(data, offset + 1))
+                offset += 1 + SYMBOL_STRUCT.size
+        return AbstractOrderedPair(symbols[:inputCount], symbols[inputCount:])
@@ -1,20 +1,86 @@
+import asyncio
+import json
+import os
+import queue
 import socket
 import socketserver
 import sys
-from typing import Optional
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Generator, Iterator, Optional, TypeVar
 import yaml
-from scapy.all import send
-from scapy.layers.inet import IP, TCP
+from scapy.layers.inet import TCP
+from scapy.packet import Packet
 
 from AbstractSymbol import AbstractSymbol, AbstractOrderedPair
-from Mapper import Mapper
+from Mapper import AsyncMapper, Mapper, MapperError, MapperPool, SourcePorts
 from ConcreteSymbol import ConcreteSymbol, ConcreteOrderedPair
 from Tracker import Tracker
-from OracleTable import OracleTable
+from OracleTable import OracleTable, OracleWriterError
+from FastReset import FastReset
+from Invlang import DEFAULT_MAP
+from LatencyEstimator import LatencyEstimator
+from Metrics import Metrics
+from Tracing import SEGMENTS, Tracer
+from QueryCache import QueryCache, maximalWords, prefixAnswers
+from Transmitter import Transmitter
 
 import logging
 
-logging.basicConfig(level=logging.DEBUG, format="%(name)s: %(message)s")
+
+RESET_QUERY = "RST(?,?,?)"
+
+T = TypeVar("T")
+
+# The steps of a reset or query, which yield every wait on the mapper, the SUT or the oracle table as the name of a
+# method of AdapterIO and its arguments, and are sent its result or thrown its error. AdapterIO runs them blocking
+# and AsyncSession on an event loop, so both run the same queries and retries.
+Steps = Generator[tuple, Any, T]
+
+
+# A response showed up after the shrunk window of an earlier input of the same query expired, so the outputs of the
+# query so far are wrong.
+class LateResponseError(RuntimeError):
+    pass
+
+
+# The symbols of a query as it runs, for the oracle table, and its answer so far.
+class QueryTrace:
+    def __init__(self):
+        self.abstractSymbolsIn: list[Optional[AbstractSymbol]] = []
+        self.concreteSymbolsIn: list[Optional[ConcreteSymbol]] = []
+        self.abstractSymbolsOut: list[Optional[AbstractSymbol]] = []
+        self.concreteSymbolsOut: list[Optional[ConcreteSymbol]] = []
+        self.answers: list[str] = []
+        # Every query starts from a freshly reset connection.
+        self.state: str = "RESET"
+
+    def output(self, abstractSymbolOut: Optional[AbstractSymbol]) -> None:
+        self.answers.append(str(abstractSymbolOut))
+        self.state = str(abstractSymbolOut)
+        self.abstractSymbolsOut.append(abstractSymbolOut)
+
+    def step(
+        self, abstractSymbolIn: AbstractSymbol, concreteSymbolIn: Optional[ConcreteSymbol], concreteSymbolOut: Optional[ConcreteSymbol]
+    ) -> None:
+        self.abstractSymbolsIn.append(abstractSymbolIn)
+        self.concreteSymbolsIn.append(concreteSymbolIn)
+        self.concreteSymbolsOut.append(concreteSymbolOut)
+
+    def pairs(self) -> tuple[AbstractOrderedPair, ConcreteOrderedPair]:
+        return (
+            AbstractOrderedPair(self.abstractSymbolsIn, self.abstractSymbolsOut),
+            ConcreteOrderedPair(self.concreteSymbolsIn, self.concreteSymbolsOut),
+        )
+
+    def answer(self) -> str:
+        return " ".join(self.answers)
+
+
+# Spells every symbol the way the adapter prints it, e.g. ACK+SYN(?,?,0) becomes SYN+ACK(?,?,0).
+def normalizeQuery(query: str) -> str:
+    return " ".join(map(lambda symbol: str(AbstractSymbol(symbol)), query.split(" ")))
 
 
 class Adapter:
@@ -26,83 +92,512 @@ class Adapter:
         symbolic: bool,
         interface: str,
         oracleTableURL: str,
+        adaptiveTimeout: Optional[dict] = None,
+        tracker: Optional[Tracker] = None,
+        oracleTable: Optional[OracleTable] = None,
+        sourcePorts: Optional[SourcePorts] = None,
+        localAddress: Optional[str] = None,
+        cache: Optional[dict] = None,
+        queryCache: Optional[QueryCache] = None,
+        oracleWriter: Optional[dict] = None,
+        oracleSchema: str = "mapping",
+        oracleSamples: int = 1,
+        oracleEncoding: str = "json",
+        migrateOracleTable: bool = False,
+        mapperEngine: str = "java",
+        mapFile: str = DEFAULT_MAP,
+        mapperProtocol: str = "line",
+        mapperPool: Optional[dict] = None,
+        processPool: Optional[MapperPool] = None,
+        transmitter: str = "scapy",
+        capture: str = "pcap",
+        retransmissions: Optional[dict] = None,
+        metrics: Optional[dict] = None,
+        stageMetrics: Optional[Metrics] = None,
+        fastReset: Optional[dict] = None,
+        tracing: Optional[dict] = None,
+        tracer: Optional[Tracer] = None,
     ):
-        self.mapper = Mapper(impPort)
-        self.localAddr: str = socket.gethostbyname(socket.gethostname())
+        # Stage durations are shared by every adapter of a server, like the query cache.
+        self.ownsMetrics: bool = stageMetrics is None
+        self.metrics: Metrics = stageMetrics if stageMetrics is not None else Metrics(**(metrics or {}))
+        self.ownsTracer: bool = tracer is None
+        self.tracer: Tracer = tracer if tracer is not None else Tracer(**(tracing or {}))
+        self.ownsProcessPool: bool = processPool is None and mapperPool is not None and mapperEngine == "java"
+        self.processPool: Optional[MapperPool] = processPool
+        if self.ownsProcessPool:
+            self.processPool = MapperPool(mapperProtocol, **(mapperPool or {}))
+        self.mapper = Mapper(
+            impPort, sourcePorts, mapperEngine, mapFile=mapFile, protocol=mapperProtocol, pool=self.processPool, metrics=self.metrics
+        )
+        self.localAddr: str = localAddress if localAddress is not None else socket.gethostbyname(socket.gethostname())
         self.impAddress: str = socket.gethostbyname(impIp)
-        self.connection: IP = IP(src=self.localAddr, dst=self.impAddress, flags="DF", version=4)
-        self.oracleTable: OracleTable = OracleTable(oracleTableURL)
+        self.ownsOracleTable: bool = oracleTable is None
+        self.oracleTable: OracleTable = oracleTable if oracleTable is not None else OracleTable(
+            oracleTableURL, oracleWriter, oracleSchema, oracleSamples, oracleEncoding
+        )
         self.timeout: float = timeout
         self.symbolic: bool = symbolic
         self.interface: str = interface
-        self.tracker: Tracker = Tracker(interface, self.impAddress)
+        self.transmitter: Transmitter = Transmitter(self.localAddr, self.impAddress, interface, transmitter)
+        # Sessions of a threaded server share the tracker and oracle table of the first adapter, which is the only one that stops them.
+        self.ownsTracker: bool = tracker is None
+        self.tracker: Tracker = tracker if tracker is not None else Tracker(
+            interface, self.impAddress, capture=capture, retransmissions=retransmissions, tracer=self.tracer
+        )
+        self.stopped: bool = False
+        self.estimator: Optional[LatencyEstimator] = None
+        if adaptiveTimeout is not None:
+            self.estimator = LatencyEstimator(timeout, **adaptiveTimeout)
+        # Flow, input and state of the last symbol whose shrunk sniff window expired without a response.
+        self.pendingSilence: Optional[tuple[tuple[int, int], str, str]] = None
+        # Set while a query reruns after a late response, which every input then waits the full timeout for.
+        self.fullTimeout: bool = False
         self.logger: logging.Logger = logging.getLogger("Adapter")
+        if self.ownsOracleTable and migrateOracleTable and oracleSchema != "mapping":
+            self.logger.info("Migrating the mapping table to the " + oracleSchema + " table...")
+            self.logger.info("Migrated " + str(self.oracleTable.migrate()) + " traces.")
+        self.queryCache: Optional[QueryCache] = queryCache
+        if self.queryCache is None and cache is not None:
+            self.queryCache = QueryCache(**cache)
+            if self.queryCache.warm:
+                self.logger.info("Loading query cache from the oracle table...")
+                self.queryCache.load(self.storedTraces())
+        # Port pair of the connection in use, which the tracker lets through its capture filter.
+        self.flow: Optional[tuple[int, int]] = None
+        # Whether anything was sent to the SUT since the last reset.
+        self.dirty: bool = True
+        self.fastReset: Optional[FastReset] = FastReset(**fastReset) if fastReset is not None else None
+        self.io: AdapterIO = AdapterIO(self)
         return
 
+    # Traces the oracle writer still could not commit are lost by now, which is logged but must not keep the rest
+    # of the adapter from stopping.
+    def stopOracleTable(self) -> None:
+        try:
+            self.oracleTable.stop()
+        except OracleWriterError as e:
+            self.logger.error(str(e) + " (" + str(e.__cause__) + ")")
+
+    def storedTraces(self) -> Iterator[tuple[list[str], list[str]]]:
+        for inputs, outputs in self.oracleTable.words():
+            # Resets are logged as queries too, but do not start from a reset state.
+            if inputs != RESET_QUERY:
+                yield inputs.split(" "), outputs.split(" ")
+
     def stop(self) -> None:
-        self.tracker.stop()
+        if self.flow is not None:
+            self.tracker.unwatch(self.flow)
+        if self.ownsTracker:
+            self.tracker.stop()
+        if self.ownsOracleTable:
+            self.stopOracleTable()
         self.mapper.stop()
+        self.transmitter.stop()
+        if self.ownsProcessPool and self.processPool is not None:
+            self.processPool.stop()
+        if self.ownsMetrics:
+            self.metrics.stop()
+        if self.ownsTracer:
+            self.tracer.stop()
+        self.stopped = True
 
     def reset(self) -> None:
+        self.io.run(self.resetSteps())
+
+    def resetSteps(self) -> Steps[None]:
+        if not self.dirty:
+            self.logger.info("Nothing sent since the last RESET, skipping it.")
+            return
         self.logger.info("Sending RESET...")
-        self.handleQuery("RST(?,?,?)")
-        self.mapper.reset()
+        self.tracer.record("reset", *(self.flow or (0, 0)))
+        with self.metrics.time("reset"):
+            if self.fastReset is None:
+                yield from self.handleQuerySteps(RESET_QUERY)
+                yield ("resetMapper",)
+            else:
+                yield from self.resetFastSteps()
+        self.dirty = False
         self.logger.info("RESET finished.")
 
-    def handleQuery(self, query: str) -> str:
+    # See FastReset. The mapper reset and the port rotation happen while the SUT settles.
+    def resetFastSteps(self) -> Steps[None]:
+        try:
+            _, packet = yield ("step", None, AbstractSymbol(RESET_QUERY))
+        except MapperError as e:
+            # A fresh process on a new port is as clean as a reset one.
+            self.logger.warning("Mapper failed to concretize the RST (" + str(e) + "), replacing it.")
+            yield ("replaceMapper",)
+            return
+        sent = self.sendReset(packet)
+        yield ("resetMapper",)
+        if sent is None:
+            return
+        flow, start = sent
+        ready = False
+        while True:
+            wait = self.settleWait(flow, start, ready)
+            if wait is None:
+                break
+            yield ("sleep", wait)
+            ready = yield ("probeReady", start)
+        self.finishReset(flow)
+
+    # Sends the RST of a fast reset on the connection in use, without logging a query.
+    def sendReset(self, packet: Optional[Packet]) -> Optional[tuple[tuple[int, int], float]]:
+        if packet is None:
+            return None
+        flow = (packet[TCP].dport, packet[TCP].sport)
+        self.checkLateResponse()
+        self.watch(flow)
+        with self.metrics.time("send"):
+            self.transmitter.send(packet)
+        return flow, time.monotonic()
+
+    # How long to wait before checking again whether the SUT settled after the RST, or None once it did.
+    def settleWait(self, flow: tuple[int, int], start: float, ready: bool) -> Optional[float]:
+        assert self.fastReset is not None
+        remaining = start + self.timeout - time.monotonic()
+        if ready or remaining <= 0:
+            return None
+        if self.fastReset.probe is not None:
+            return min(self.fastReset.probeInterval, remaining)
+        wait = self.tracker.quietRemaining(flow, start, self.fastReset.quiet)
+        return min(wait, remaining) if wait > 0 else None
+
+    def probeReady(self, start: float) -> bool:
+        if self.fastReset is None or self.fastReset.probe is None:
+            return False
+        return self.fastReset.ready(self.impAddress, self.mapper.destinationPort, start + self.timeout - time.monotonic())
+
+    # The old connection is gone, and so are its responses.
+    def finishReset(self, flow: tuple[int, int]) -> None:
+        self.tracker.unwatch(flow)
+        self.flow = None
+
+    # Answers a query from the cache if possible, and from the SUT otherwise.
+    def answerQuery(self, query: str) -> str:
+        return self.io.run(self.answerQuerySteps(query))
+
+    def answerQuerySteps(self, query: str) -> Steps[str]:
+        key, cached, run = self.lookupQuery(query)
+        if not run:
+            self.logger.info("Answering from cache: %s", cached)
+            return str(cached)
+        return self.storeAnswer(query, key, cached, (yield from self.handleQuerySteps(query)))
+
+    # The cache key and cached answer of a query, and whether it has to run on the SUT anyway, to verify the answer.
+    def lookupQuery(self, query: str) -> tuple[Optional[str], Optional[str], bool]:
+        if self.queryCache is None:
+            return None, None, True
+        key = normalizeQuery(query)
+        cached = self.queryCache.get(key)
+        return key, cached, cached is None or self.queryCache.shouldVerify()
+
+    def storeAnswer(self, query: str, key: Optional[str], cached: Optional[str], answer: str) -> str:
+        if self.queryCache is None or key is None:
+            return answer
+        if cached is None:
+            self.queryCache.put(key, answer)
+            return answer
+        if answer != cached:
+            self.logger.warning("Cached answer " + cached + " to " + query + " differs from SUT answer " + answer)
+        self.queryCache.verified(key, cached, answer)
+        return answer
+
+    # Runs only the queries of the batch that are not a prefix of another one, each from a reset state,
+    # and answers the others from their outputs. Answers are in the order of the queries.
+    def handleBatch(self, queries: list[str]) -> list[str]:
+        return self.io.run(self.batchSteps(queries))
+
+    def batchSteps(self, queries: list[str]) -> Steps[list[str]]:
+        queries = list(map(normalizeQuery, queries))
+        words = maximalWords(queries)
+        self.logger.info("Running " + str(len(words)) + " words for a batch of " + str(len(queries)) + " queries.")
         answers = []
-        abstractSymbolsIn: list[Optional[AbstractSymbol]] = []
-        concreteSymbolsIn: list[Optional[ConcreteSymbol]] = []
-        abstractSymbolsOut: list[Optional[AbstractSymbol]] = []
-        concreteSymbolsOut: list[Optional[ConcreteSymbol]] = []
-        for symbol in query.split(" "):
-            self.logger.info("Processing Symbol: " + symbol)
+        for word in words:
+            yield from self.resetSteps()
+            answers.append((yield from self.answerQuerySteps(word)))
+        return prefixAnswers(queries, words, answers)
+
+    # A mapper that fails mid-query is replaced by a fresh one on a new connection, and the query is run again from there.
+    # A query that got a late response is run again from a reset, with the full timeout for every input.
+    def handleQuery(self, query: str) -> str:
+        return self.io.run(self.handleQuerySteps(query))
+
+    def handleQuerySteps(self, query: str) -> Steps[str]:
+        start = time.perf_counter()
+        try:
+            return (yield from self.runQuerySteps(query))
+        except MapperError as e:
+            self.logger.warning("Mapper failed (" + str(e) + "), replacing it and rerunning the query.")
+            yield ("replaceMapper",)
+            return (yield from self.runQuerySteps(query))
+        except LateResponseError:
+            self.fullTimeout = True
+            try:
+                yield from self.resetSteps()
+                return (yield from self.runQuerySteps(query))
+            finally:
+                self.fullTimeout = False
+        finally:
+            self.recordQuery(query, start)
+
+    # The RST query of a reset is timed as part of the reset.
+    def recordQuery(self, query: str, start: float) -> None:
+        if query != RESET_QUERY:
+            self.metrics.record("query", time.perf_counter() - start)
+
+    def runQuery(self, query: str) -> str:
+        return self.io.run(self.runQuerySteps(query))
+
+    def runQuerySteps(self, query: str) -> Steps[str]:
+        self.tracer.record("query", query)
+        # A silence left over from the previous query, whose later inputs were not sent, only tells the estimator.
+        self.checkLateResponse()
+        self.dirty = True
+        trace = QueryTrace()
+        symbols = query.split(" ")
+        # The response to each input is abstracted in the same mapper step that concretizes the next input.
+        concreteSymbolOut: Optional[ConcreteSymbol] = None
+        for index in range(len(symbols) + 1):
+            abstractSymbolIn = self.readInput(symbols[index]) if index < len(symbols) else None
+
+            abstractSymbolOut, packetIn = yield ("step", concreteSymbolOut, abstractSymbolIn)
 
-            abstractSymbolIn: AbstractSymbol = AbstractSymbol(symbol)
-            self.logger.info("Abstract Symbol In: " + str(abstractSymbolIn))
+            if index > 0:
+                self.recordOutput(trace, abstractSymbolOut)
 
-            packetIn = self.mapper.abstractToConcrete(abstractSymbolIn)
+            if abstractSymbolIn is None:
+                break
 
             if packetIn is None:
                 concreteSymbolIn: Optional[ConcreteSymbol] = None
-                concreteSymbolOut: Optional[ConcreteSymbol] = None
-                abstractSymbolOut: Optional[AbstractSymbol] = None
+                concreteSymbolOut = None
             else:
-                concreteSymbolIn: Optional[ConcreteSymbol] = ConcreteSymbol(packet=packetIn)
-                self.logger.info("Concrete Symbol In: " + concreteSymbolIn.toJSON())
+                # The last output goes to the cache and oracle table as it is, so it is never the silence of a shrunk window.
+                last = index == len(symbols) - 1
+                concreteSymbolIn, flow, waitTime = self.sendInput(packetIn, str(abstractSymbolIn), trace.state, last)
+                sent = time.monotonic()
+                concreteSymbolOut = yield ("sniff", flow, waitTime)
+                self.receiveOutput(flow, str(abstractSymbolIn), trace.state, waitTime, time.monotonic() - sent, concreteSymbolOut)
 
-                self.tracker.clearLastResponse()
-                send([self.connection / packetIn], iface=self.interface, verbose=True)
-                concreteSymbolOut: Optional[ConcreteSymbol] = self.tracker.sniffForResponse(
-                    packetIn[TCP].dport, packetIn[TCP].sport, self.timeout
-                )
+            trace.step(abstractSymbolIn, concreteSymbolIn, concreteSymbolOut)
+
+        yield ("writeTrace", trace)
+        return self.finishQuery(trace)
+
+    def finishQuery(self, trace: "QueryTrace") -> str:
+        answer = trace.answer()
+        self.tracer.record("answer", answer)
+        return answer
+
+    def writeTrace(self, trace: "QueryTrace") -> None:
+        with self.metrics.time("oracleWrite"):
+            self.oracleTable.add(*trace.pairs())
+
+    def readInput(self, symbol: str) -> AbstractSymbol:
+        abstractSymbolIn = AbstractSymbol(symbol)
+        self.logger.debug("Abstract Symbol In: %s", abstractSymbolIn)
+        return abstractSymbolIn
 
-                self.logger.info("Concrete Symbol Out: " + concreteSymbolOut.toJSON() if concreteSymbolOut is not None else "null")
+    def recordOutput(self, trace: "QueryTrace", abstractSymbolOut: Optional[AbstractSymbol]) -> None:
+        # Match abstraction level.
+        if abstractSymbolOut is not None and not self.symbolic:
+            abstractSymbolOut.seqNumber = None
+            abstractSymbolOut.ackNumber = None
+        self.logger.debug("Abstract Symbol Out: %s", abstractSymbolOut)
+        trace.output(abstractSymbolOut)
 
-                if concreteSymbolOut is not None:
-                    abstractSymbolOut: Optional[AbstractSymbol] = self.mapper.concreteToAbstract(concreteSymbolOut)
-                    # Match abstraction level.
-                    if abstractSymbolOut is not None and not self.symbolic:
-                        abstractSymbolOut.seqNumber = None
-                        abstractSymbolOut.ackNumber = None
+    # Sends the input and returns it, with its flow and how long to wait for the response.
+    def sendInput(self, packetIn: Packet, input: str, state: str, full: bool = False) -> tuple[ConcreteSymbol, tuple[int, int], float]:
+        concreteSymbolIn = ConcreteSymbol(packet=packetIn)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Concrete Symbol In: %s", concreteSymbolIn.toJSON())
+        flow = (packetIn[TCP].dport, packetIn[TCP].sport)
+        if self.checkLateResponse():
+            raise LateResponseError("Late response to " + input + ".")
+        self.watch(flow)
+        waitTime = self.timeout if full else self.responseTimeout(input, state)
+        self.tracker.clearLastResponse(flow)
+        with self.metrics.time("send"):
+            self.transmitter.send(packetIn)
+        if self.tracer.enabled(SEGMENTS):
+            self.tracer.recordSegment("sent", concreteSymbolIn)
+        return concreteSymbolIn, flow, waitTime
+
+    def receiveOutput(
+        self, flow: tuple[int, int], input: str, state: str, waitTime: float, latency: float, concreteSymbolOut: Optional[ConcreteSymbol]
+    ) -> None:
+        self.metrics.record("sniffHit" if concreteSymbolOut is not None else "sniffTimeout", latency)
+        self.recordLatency(flow, input, state, waitTime, latency, concreteSymbolOut)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Concrete Symbol Out: %s", concreteSymbolOut.toJSON() if concreteSymbolOut is not None else "null")
+
+    # The source port changes on every reset, the capture filter follows it before the first segment on the new one is sent.
+    def watch(self, flow: tuple[int, int]) -> None:
+        if flow == self.flow:
+            return
+        self.tracker.watch(flow)
+        if self.flow is not None:
+            self.tracker.unwatch(self.flow)
+        self.flow = flow
+
+    def timeoutReport(self) -> dict:
+        if self.estimator is None:
+            return {"ceiling": self.timeout}
+        return self.estimator.report()
+
+    def responseTimeout(self, input: str, state: str) -> float:
+        if self.estimator is None or self.fullTimeout:
+            return self.timeout
+        return self.estimator.timeoutFor(input, state)
+
+    def recordLatency(
+        self, flow: tuple[int, int], input: str, state: str, waitTime: float, latency: float, response: Optional[ConcreteSymbol]
+    ) -> None:
+        if self.estimator is None:
+            return
+        if response is not None:
+            self.estimator.record(input, state, latency)
+        elif waitTime < self.timeout:
+            self.pendingSilence = (flow, input, state)
+
+    # A response that arrives after a shrunk window expired is only visible once the next symbol is about to be sent.
+    def checkLateResponse(self) -> bool:
+        if self.estimator is None or self.pendingSilence is None:
+            return False
+        flow, input, state = self.pendingSilence
+        self.pendingSilence = None
+        if self.tracker.getLastResponse(flow[0], flow[1]) is None:
+            return False
+        self.logger.warning("Late response for " + input + " after " + state + ", falling back to the full timeout.")
+        self.estimator.recordLate(input, state)
+        return True
+
+
+# Runs the steps of an adapter on the thread of the caller, blocking on every wait.
+class AdapterIO:
+    def __init__(self, adapter: Adapter):
+        self.adapter: Adapter = adapter
+
+    def run(self, steps: Steps[T]) -> T:
+        try:
+            wait = next(steps)
+            while True:
+                try:
+                    result = getattr(self, wait[0])(*wait[1:])
+                except Exception as e:
+                    wait = steps.throw(e)
                 else:
-                    concreteSymbolOut = None
-                    abstractSymbolOut = None
+                    wait = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
 
-                self.logger.info("Abstract Symbol Out: " + str(abstractSymbolOut))
+    def step(
+        self, concreteSymbolOut: Optional[ConcreteSymbol], abstractSymbolIn: Optional[AbstractSymbol]
+    ) -> tuple[Optional[AbstractSymbol], Optional[Packet]]:
+        return self.adapter.mapper.step(concreteSymbolOut, abstractSymbolIn)
 
-            answers.append(str(abstractSymbolOut))
+    def resetMapper(self) -> None:
+        self.adapter.mapper.reset()
 
-            abstractSymbolsIn.append(abstractSymbolIn)
-            concreteSymbolsIn.append(concreteSymbolIn)
-            abstractSymbolsOut.append(abstractSymbolOut)
-            concreteSymbolsOut.append(concreteSymbolOut)
+    def replaceMapper(self) -> None:
+        self.adapter.mapper.replace()
+
+    def sniff(self, flow: tuple[int, int], waitTime: float) -> Optional[ConcreteSymbol]:
+        return self.adapter.tracker.sniffForResponse(flow[0], flow[1], waitTime)
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def probeReady(self, start: float) -> bool:
+        return self.adapter.probeReady(start)
+
+    def writeTrace(self, trace: QueryTrace) -> None:
+        self.adapter.writeTrace(trace)
+
+
+# An endpoint overrides the SUT settings of the config, see FarmAdapterServer.
+def createAdapter(config: dict, endpoint: Optional[dict] = None, **shared) -> Adapter:
+    config = config if endpoint is None else {**config, **endpoint}
+    return Adapter(
+        str(config["impAddress"]),
+        config["impPort"],
+        config["timeout"],
+        config["symbolic"],
+        config["interface"],
+        config["oracleTableURL"],
+        config.get("adaptiveTimeout"),
+        localAddress=config.get("localAddress"),
+        cache=config.get("cache"),
+        oracleWriter=config.get("oracleWriter"),
+        oracleSchema=config.get("oracleSchema", "mapping"),
+        oracleSamples=config.get("oracleSamples", 1),
+        oracleEncoding=config.get("oracleEncoding", "json"),
+        migrateOracleTable=config.get("migrateOracleTable", False),
+        mapperEngine=config.get("mapperEngine", "java"),
+        mapFile=config.get("mapFile", DEFAULT_MAP),
+        mapperProtocol=config.get("mapperProtocol", "line"),
+        mapperPool=config.get("mapperPool"),
+        transmitter=config.get("transmitter", "scapy"),
+        capture=config.get("capture", "pcap"),
+        retransmissions=config.get("retransmissions"),
+        metrics=config.get("metrics"),
+        fastReset=config.get("fastReset"),
+        tracing=config.get("tracing"),
+        **shared,
+    )
+
+
+def optionalStats(component: Any) -> dict:
+    return component.stats() if component is not None else {}
+
+
+# A command that answers one line of JSON about the adapter of the session.
+def reportCommand(report: Callable[[Any], object]) -> Callable[[Any, str], Any]:
+    return lambda session, argument: session.answer([json.dumps(report(session))])
+
+
+# The query count of a BATCH <n> header, or None if n is not one.
+def batchCount(argument: str) -> Optional[int]:
+    return int(argument) if argument.isdecimal() else None
 
-        self.oracleTable.add(
-            AbstractOrderedPair(abstractSymbolsIn, abstractSymbolsOut),
-            ConcreteOrderedPair(concreteSymbolsIn, concreteSymbolsOut),
-        )
-        return " ".join(answers)
+
+# A batch is a BATCH <n> line followed by n queries, one per line, and is answered with n lines. A header without a
+# count is answered with an error line instead, and the connection goes on.
+def batchCommand(session: Any, argument: str) -> Any:
+    count = batchCount(argument)
+    if count is None:
+        session.logger.warning("Invalid batch header: %s", ("BATCH " + argument).strip())
+        return session.answer(["ERROR Invalid batch header, expected BATCH <n>."])
+    return session.batch(count)
+
+
+# The commands of the learner, by the first word of their line; every other line is a query. A command runs on the
+# session of the connection, which does the reading and answering the way its server does: QueryRequestHandler
+# answers lists of lines, AsyncSession coroutines of them and PipelinedQueryRequestHandler futures of them joined.
+# Reports on the workers of a farm are per worker.
+COMMANDS: dict[str, Callable[[Any, str], Any]] = {
+    "STOP": lambda session, argument: session.stop(),
+    "RESET": lambda session, argument: session.reset(),
+    "BATCH": batchCommand,
+    "TIMEOUTS": reportCommand(lambda session: session.perWorker(Adapter.timeoutReport)),
+    "CACHE": reportCommand(lambda session: optionalStats(session.adapter.queryCache)),
+    "ORACLE": reportCommand(lambda session: session.adapter.oracleTable.stats()),
+    "TRACKER": reportCommand(lambda session: session.perWorker(lambda adapter: adapter.tracker.stats())),
+    "MAPPERS": reportCommand(lambda session: optionalStats(session.adapter.processPool)),
+    "STATS": reportCommand(lambda session: session.adapter.metrics.stats()),
+    "TRACE": reportCommand(lambda session: session.adapter.tracer.lines()),
+}
+
+
+# Runs a line of the learner on the session, see COMMANDS, and returns its answer.
+def dispatch(session: Any, line: str) -> Any:
+    session.logger.info("Received query: %s", line)
+    name, _, argument = line.partition(" ")
+    command = COMMANDS.get(name)
+    return command(session, argument) if command is not None else session.query(line)
 
 
 class QueryRequestHandler(socketserver.StreamRequestHandler):
@@ -111,47 +606,91 @@ class QueryRequestHandler(socketserver.StreamRequestHandler):
         socketserver.BaseRequestHandler.__init__(self, request, client_address, server)
         return
 
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        self.failed: bool = False
+        if isinstance(self.server, AdapterServer):
+            self.adapter: Adapter = self.server.openSession()
+
+    def finish(self):
+        if isinstance(self.server, AdapterServer):
+            self.server.closeSession(self.adapter, self.failed)
+        socketserver.StreamRequestHandler.finish(self)
+
     def handle(self):
+        try:
+            self.serveQueries()
+        except Exception:
+            # A session that raised is in an unknown state, finish() must not hand it to another learner.
+            self.failed = True
+            raise
+
+    def serveQueries(self):
         while True:
-            query = self.rfile.readline().strip().decode("utf-8").rstrip("\n")
-            if query != "":
-                self.logger.info("Received query: " + query)
-                if query == "STOP":
-                    if isinstance(self.server, AdapterServer):
-                        self.server.adapter.stop()
-                        self.wfile.write(bytearray("STOP" + "\n", "utf-8"))
-                        break
-                elif query == "RESET":
-                    if isinstance(self.server, AdapterServer):
-                        self.server.adapter.reset()
-                        self.wfile.write(bytearray("RESET" + "\n", "utf-8"))
-                else:
-                    if isinstance(self.server, AdapterServer):
-                        answer = self.server.adapter.handleQuery(query)
-                        self.logger.info("Sending answer: " + answer)
-                        self.wfile.write(bytearray(answer + "\n", "utf-8"))
-            else:
+            query = self.rfile.readline().strip().decode("utf-8")
+            if query == "":
                 return
+            answers = dispatch(self, query)
+            self.wfile.write(bytearray("".join(map(lambda answer: answer + "\n", answers)), "utf-8"))
+            if query == "STOP":
+                break
         sys.exit(0)
 
+    # The handler is the session of its connection, see COMMANDS.
+    def perWorker(self, report: Callable[[Adapter], object]) -> object:
+        return report(self.adapter)
+
+    def answer(self, lines: list[str]) -> list[str]:
+        return lines
+
+    def stop(self) -> list[str]:
+        self.adapter.stop()
+        return ["STOP"]
+
+    def reset(self) -> list[str]:
+        self.adapter.reset()
+        return ["RESET"]
+
+    def batch(self, count: int) -> list[str]:
+        answers = self.adapter.handleBatch([self.rfile.readline().strip().decode("utf-8") for _ in range(count)])
+        self.logger.info("Sending " + str(len(answers)) + " answers.")
+        return answers
+
+    def query(self, query: str) -> list[str]:
+        answer = self.adapter.answerQuery(query)
+        self.logger.info("Sending answer: %s", answer)
+        return [answer]
+
 
 class AdapterServer(socketserver.TCPServer):
     def __init__(self, config, handler_class=QueryRequestHandler):
-        self.adapter = Adapter(
-            str(config["impAddress"]),
-            config["impPort"],
-            config["timeout"],
-            config["symbolic"],
-            config["interface"],
-            config["oracleTableURL"],
-        )
+        self.config = config
+        self.adapter = self.createAdapter()
         self.adapter.tracker.start()
         self.logger = logging.getLogger("Server")
         self.logger.info("Initialising server...")
         socketserver.TCPServer.__init__(self, ("0.0.0.0", config["port"]), handler_class)
         return
 
-    def handle_error(self, request, client_address):
+    def createAdapter(self, endpoint: Optional[dict] = None, **shared) -> Adapter:
+        return createAdapter(self.config, endpoint, **shared)
+
+    # A single-threaded server serves every learner connection with the same adapter.
+    def openSession(self) -> Adapter:
+        return self.adapter
+
+    def closeSession(self, adapter: Adapter, failed: bool = False) -> None:
+        return
+
+    def handle_error(self, request, client_address) -> None:
+        self.reportError(client_address)
+        print("Crashing...")
+        # Traces queued for the background writer would otherwise be lost.
+        self.adapter.stopOracleTable()
+        self.adapter.metrics.stop()
+        sys.exit(1)
+
+    def reportError(self, client_address) -> None:
         print("-" * 40, file=sys.stderr)
         print(
             "Exception occurred during processing of request from",
@@ -162,17 +701,435 @@ class AdapterServer(socketserver.TCPServer):
 
         traceback.print_exc()
         print("-" * 40, file=sys.stderr)
+        print("Last events:", file=sys.stderr)
+        self.adapter.tracer.dump(sys.stderr)
+
+
+# Serves every learner connection on its own thread with its own session: an adapter with its own mapper process
+# and source port. Sessions share the tracker, which tells their segments apart by port pair, and the oracle table.
+class ThreadedAdapterServer(socketserver.ThreadingMixIn, AdapterServer):
+    daemon_threads = True
+
+    def __init__(self, config, handler_class=QueryRequestHandler):
+        self.sessionLock = threading.Lock()
+        AdapterServer.__init__(self, config, handler_class)
+        # The tracker, oracle table and mapper pool outlive any single session, STOP only ends the session that sent it.
+        self.adapter.ownsTracker = False
+        self.adapter.ownsOracleTable = False
+        self.adapter.ownsProcessPool = False
+        self.adapter.ownsMetrics = False
+        self.adapter.ownsTracer = False
+        self.idleSessions: list[Adapter] = [self.adapter]
+
+    def openSession(self) -> Adapter:
+        with self.sessionLock:
+            if len(self.idleSessions) > 0:
+                return self.idleSessions.pop()
+        self.logger.info("Opening new session...")
+        return self.createAdapter(
+            tracker=self.adapter.tracker,
+            oracleTable=self.adapter.oracleTable,
+            sourcePorts=self.adapter.mapper.sourcePorts,
+            queryCache=self.adapter.queryCache,
+            processPool=self.adapter.processPool,
+            stageMetrics=self.adapter.metrics,
+            tracer=self.adapter.tracer,
+        )
+
+    # Sessions whose learner disconnected without STOP are kept for the next connection, saving a mapper start.
+    # A session that raised is stopped instead, as its mapper and connection to the SUT are in an unknown state.
+    def closeSession(self, adapter: Adapter, failed: bool = False) -> None:
+        if adapter.stopped:
+            return
+        if failed:
+            try:
+                adapter.stop()
+            except Exception as e:
+                self.logger.warning("Failed to stop session (" + str(e) + ").")
+            return
+        with self.sessionLock:
+            self.idleSessions.append(adapter)
+
+    # Only the failed session is dropped, by closeSession(). The other sessions go on, and with them the tracker,
+    # oracle table, metrics and tracer they share, which exiting from this handler thread would not stop anyway.
+    def handle_error(self, request, client_address) -> None:
+        self.reportError(client_address)
+        self.logger.warning("Dropped the session of " + str(client_address) + ".")
+
+    def server_close(self) -> None:
+        socketserver.TCPServer.server_close(self)
+        with self.sessionLock:
+            for adapter in self.idleSessions:
+                adapter.stop()
+            self.idleSessions.clear()
+        self.adapter.tracker.stop()
+        self.adapter.stopOracleTable()
+        if self.adapter.processPool is not None:
+            self.adapter.processPool.stop()
+        self.adapter.metrics.stop()
+        self.adapter.tracer.stop()
+
+
+# Runs queries on a set of adapters, each driving its own SUT instance, on whichever adapter is idle.
+# Every query is preceded by a reset of the adapter that runs it, since consecutive queries of a learner
+# generally end up on different SUTs.
+class Farm:
+    def __init__(self, workers: list[Adapter]):
+        self.workers: list[Adapter] = workers
+        self.idle: queue.Queue[Adapter] = queue.Queue()
+        for worker in workers:
+            self.idle.put(worker)
+        self.executor = ThreadPoolExecutor(max_workers=len(workers), thread_name_prefix="Farm")
+
+    def submit(self, query: str) -> Future[str]:
+        return self.executor.submit(self.run, query)
+
+    # Runs the maximal words of the batch in parallel, the answers come back as one line per query.
+    def submitBatch(self, queries: list[str]) -> Future[str]:
+        queries = list(map(normalizeQuery, queries))
+        words = maximalWords(queries)
+        futures = list(map(self.submit, words))
+        batch: Future[str] = Future()
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def done(_: Future[str]) -> None:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            try:
+                answers = prefixAnswers(queries, words, [future.result() for future in futures])
+                batch.set_result("\n".join(answers))
+            except Exception as e:
+                batch.set_exception(e)
+
+        for future in futures:
+            future.add_done_callback(done)
+        return batch
+
+    def run(self, query: str) -> str:
+        worker = self.idle.get()
+        try:
+            worker.reset()
+            return worker.answerQuery(query)
+        finally:
+            self.idle.put(worker)
+
+    def stop(self) -> None:
+        self.executor.shutdown(wait=True)
+        for worker in self.workers:
+            worker.stop()
+
+
+def answered(answer: str) -> Future[str]:
+    future: Future[str] = Future()
+    future.set_result(answer)
+    return future
+
+
+# Lets the learner pipeline queries: a reader thread hands every query to the farm as soon as it arrives,
+# while the handler thread writes the answers back in the order the queries were received.
+class PipelinedQueryRequestHandler(socketserver.StreamRequestHandler):
+    def __init__(self, request, client_address, server):
+        self.logger = logging.getLogger("Query Handler")
+        socketserver.BaseRequestHandler.__init__(self, request, client_address, server)
+        return
+
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        if isinstance(self.server, FarmAdapterServer):
+            self.adapter: Adapter = self.server.adapter
+            self.farm: Farm = self.server.farm
+
+    def read(self, pending: queue.Queue[Optional[Future[str]]]) -> None:
+        while True:
+            query = self.rfile.readline().strip().decode("utf-8")
+            if query == "":
+                pending.put(None)
+                return
+            answer = dispatch(self, query)
+            if answer is not None:
+                pending.put(answer)
+            if query == "STOP":
+                self.stopRequested = True
+                pending.put(None)
+                return
+
+    # The handler is the session of its connection, see COMMANDS. An answer of None has no line at all.
+    def perWorker(self, report: Callable[[Adapter], object]) -> object:
+        return [report(worker) for worker in self.farm.workers]
+
+    def answer(self, lines: list[str]) -> Optional[Future[str]]:
+        return answered("\n".join(lines)) if len(lines) > 0 else None
+
+    # Only answered once every earlier query is, see handle().
+    def stop(self) -> None:
+        return None
+
+    # Every query on the farm starts from a reset of its own.
+    def reset(self) -> Future[str]:
+        return answered("RESET")
+
+    def batch(self, count: int) -> Optional[Future[str]]:
+        queries = [self.rfile.readline().strip().decode("utf-8") for _ in range(count)]
+        return self.farm.submitBatch(queries) if len(queries) > 0 else None
+
+    def query(self, query: str) -> Future[str]:
+        return self.farm.submit(query)
+
+    def handle(self):
+        self.stopRequested = False
+        pending: queue.Queue[Optional[Future[str]]] = queue.Queue()
+        threading.Thread(target=self.read, args=(pending,), daemon=True).start()
+        while True:
+            future = pending.get()
+            if future is None:
+                if not self.stopRequested:
+                    return
+                self.farm.stop()
+                self.wfile.write(bytearray("STOP" + "\n", "utf-8"))
+                break
+            answer = future.result()
+            self.logger.info("Sending answer: %s", answer)
+            self.wfile.write(bytearray(answer + "\n", "utf-8"))
+        sys.exit(0)
+
+
+# Spreads the queries of a learner over several SUT instances, listed as endpoints under "suts" in the config.
+# Each endpoint may override impAddress, impPort, interface and localAddress, and gets its own adapter,
+# tracker and mapper. The oracle table is shared.
+class FarmAdapterServer(AdapterServer):
+    def __init__(self, config, handler_class=PipelinedQueryRequestHandler):
+        self.config = config
+        self.logger = logging.getLogger("Server")
+        self.logger.info("Initialising farm of " + str(len(config["suts"])) + " SUTs...")
+        self.adapter = self.createAdapter(config["suts"][0])
+        workers = [self.adapter]
+        for endpoint in config["suts"][1:]:
+            workers.append(
+                self.createAdapter(
+                    endpoint,
+                    oracleTable=self.adapter.oracleTable,
+                    queryCache=self.adapter.queryCache,
+                    processPool=self.adapter.processPool,
+                    stageMetrics=self.adapter.metrics,
+                    tracer=self.adapter.tracer,
+                )
+            )
+        for worker in workers:
+            worker.tracker.start()
+        self.farm = Farm(workers)
+        socketserver.TCPServer.__init__(self, ("0.0.0.0", config["port"]), handler_class)
+        return
+
+
+# Runs the queries of one learner connection on an event loop, with the adapter of the session. The mapper is talked
+# to over asyncio pipes, responses are awaited on futures the tracker thread resolves, and traces are written to the
+# oracle table on the executor of the server. The sessions of a loop overlap their waits without a thread each.
+class AsyncSession:
+    def __init__(self, adapter: Adapter, oracleExecutor: ThreadPoolExecutor):
+        self.adapter: Adapter = adapter
+        self.mapper: AsyncMapper = AsyncMapper(adapter.mapper)
+        self.oracleExecutor: ThreadPoolExecutor = oracleExecutor
+        self.logger: logging.Logger = adapter.logger
+        # The connection the session serves, which the queries of a batch are read from.
+        self.reader: Optional[asyncio.StreamReader] = None
+
+    async def open(self) -> None:
+        await self.mapper.open()
+
+    def close(self) -> None:
+        self.mapper.close()
+        self.adapter.stop()
+
+    # Runs the steps of the adapter like AdapterIO.run(), with every wait awaited.
+    async def run(self, steps: Steps[T]) -> T:
+        try:
+            wait = next(steps)
+            while True:
+                try:
+                    result = await getattr(self, wait[0])(*wait[1:])
+                except Exception as e:
+                    wait = steps.throw(e)
+                else:
+                    wait = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    async def step(
+        self, concreteSymbolOut: Optional[ConcreteSymbol], abstractSymbolIn: Optional[AbstractSymbol]
+    ) -> tuple[Optional[AbstractSymbol], Optional[Packet]]:
+        return await self.mapper.step(concreteSymbolOut, abstractSymbolIn)
+
+    async def resetMapper(self) -> None:
+        await self.mapper.reset()
+
+    async def replaceMapper(self) -> None:
+        await self.mapper.replace()
+
+    async def sniff(self, flow: tuple[int, int], waitTime: float) -> Optional[ConcreteSymbol]:
+        return await self.adapter.tracker.sniffForResponseAsync(flow[0], flow[1], waitTime)
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    # A probe blocks on its connection to the SUT.
+    async def probeReady(self, start: float) -> bool:
+        if self.adapter.fastReset is None or self.adapter.fastReset.probe is None:
+            return False
+        return await asyncio.to_thread(self.adapter.probeReady, start)
+
+    async def writeTrace(self, trace: QueryTrace) -> None:
+        await asyncio.get_running_loop().run_in_executor(self.oracleExecutor, self.adapter.writeTrace, trace)
+
+    # The session of the connection, see COMMANDS.
+    def perWorker(self, report: Callable[[Adapter], object]) -> object:
+        return report(self.adapter)
+
+    async def answer(self, lines: list[str]) -> list[str]:
+        return lines
+
+    async def stop(self) -> list[str]:
+        self.close()
+        return ["STOP"]
+
+    async def reset(self) -> list[str]:
+        await self.run(self.adapter.resetSteps())
+        return ["RESET"]
+
+    async def batch(self, count: int) -> list[str]:
+        assert self.reader is not None
+        queries = [(await self.reader.readline()).strip().decode("utf-8") for _ in range(count)]
+        answers = await self.run(self.adapter.batchSteps(queries))
+        self.logger.info("Sending " + str(len(answers)) + " answers.")
+        return answers
+
+    async def query(self, query: str) -> list[str]:
+        answer = await self.run(self.adapter.answerQuerySteps(query))
+        self.logger.info("Sending answer: %s", answer)
+        return [answer]
+
+
+# Serves every learner connection as a session on one event loop, in place of a thread per connection as with
+# ThreadedAdapterServer. Sessions share the tracker, oracle table, query cache and mapper pool, and are kept for
+# the next connection when their learner disconnects without STOP.
+class AsyncAdapterServer:
+    def __init__(self, config):
+        self.config = config
+        self.logger = logging.getLogger("Server")
+        self.logger.info("Initialising asyncio server...")
+        self.adapter = createAdapter(config)
+        # The tracker, oracle table and mapper pool outlive any single session, STOP only ends the session that sent it.
+        self.adapter.ownsTracker = False
+        self.adapter.ownsOracleTable = False
+        self.adapter.ownsProcessPool = False
+        self.adapter.ownsMetrics = False
+        self.adapter.ownsTracer = False
+        self.adapter.tracker.start()
+        # A single thread writes the traces of every session, in the order they ran.
+        self.oracleExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Oracle")
+        self.idleSessions: list[AsyncSession] = []
+        self.crashed = asyncio.Event()
+
+    async def openSession(self) -> AsyncSession:
+        if len(self.idleSessions) > 0:
+            return self.idleSessions.pop()
+        self.logger.info("Opening new session...")
+        # Taking a mapper process from the pool may wait for one to boot.
+        adapter = await asyncio.to_thread(
+            createAdapter,
+            self.config,
+            tracker=self.adapter.tracker,
+            oracleTable=self.adapter.oracleTable,
+            sourcePorts=self.adapter.mapper.sourcePorts,
+            queryCache=self.adapter.queryCache,
+            processPool=self.adapter.processPool,
+            stageMetrics=self.adapter.metrics,
+            tracer=self.adapter.tracer,
+        )
+        session = AsyncSession(adapter, self.oracleExecutor)
+        await session.open()
+        return session
+
+    def closeSession(self, session: AsyncSession) -> None:
+        if not session.adapter.stopped:
+            self.idleSessions.append(session)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = await self.openSession()
+        session.reader = reader
+        try:
+            while True:
+                query = (await reader.readline()).strip().decode("utf-8")
+                if query == "":
+                    return
+                answers = await dispatch(session, query)
+                writer.write(bytearray("".join(map(lambda answer: answer + "\n", answers)), "utf-8"))
+                await writer.drain()
+                if query == "STOP":
+                    return
+        except Exception:
+            self.handleError(writer.get_extra_info("peername"))
+        finally:
+            self.closeSession(session)
+            writer.close()
+
+    # Crashes the server like AdapterServer.handle_error().
+    def handleError(self, clientAddress) -> None:
+        print("-" * 40, file=sys.stderr)
+        print("Exception occurred during processing of request from", clientAddress, file=sys.stderr)
+        import traceback
+
+        traceback.print_exc()
+        print("-" * 40, file=sys.stderr)
+        print("Last events:", file=sys.stderr)
+        self.adapter.tracer.dump(sys.stderr)
         print("Crashing...")
+        self.crashed.set()
+
+    async def serve(self) -> None:
+        session = AsyncSession(self.adapter, self.oracleExecutor)
+        await session.open()
+        self.idleSessions.append(session)
+        server = await asyncio.start_server(self.handle, "0.0.0.0", self.config["port"])
+        async with server:
+            await self.crashed.wait()
+        self.stop()
         sys.exit(1)
 
+    def serve_forever(self) -> None:
+        asyncio.run(self.serve())
+
+    def stop(self) -> None:
+        for session in self.idleSessions:
+            session.close()
+        self.idleSessions.clear()
+        self.adapter.tracker.stop()
+        # Traces queued for the oracle table would otherwise be lost.
+        self.oracleExecutor.shutdown(wait=True)
+        self.adapter.stopOracleTable()
+        if self.adapter.processPool is not None:
+            self.adapter.processPool.stop()
+        self.adapter.metrics.stop()
+        self.adapter.tracer.stop()
+
 
 def loadConfig(path):
     with open(path, "r") as stream:
         return yaml.safe_load(stream)["adapter"]
 
 
-config = loadConfig("/root/config.yaml")
-server = AdapterServer(config, QueryRequestHandler)
+config = loadConfig(os.environ.get("ADAPTER_CONFIG", "/root/config.yaml"))
+logging.basicConfig(level=config.get("logLevel", "INFO"), format="%(name)s: %(message)s")
+if "suts" in config:
+    server = FarmAdapterServer(config, PipelinedQueryRequestHandler)
+elif config.get("asyncSessions", False):
+    server = AsyncAdapterServer(config)
+elif config.get("concurrentSessions", False):
+    server = ThreadedAdapterServer(config, QueryRequestHandler)
+else:
+    server = AdapterServer(config, QueryRequestHandler)
 
 if __name__ == "__main__":
     server.serve_forever()
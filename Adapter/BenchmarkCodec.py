@@ -0,0 +1,150 @@
+import argparse
+import random
+import string
+import sys
+import timeit
+from typing import Callable, Optional
+
+import jsons
+
+from AbstractSymbol import AbstractOrderedPair, AbstractSymbol, Value
+from ConcreteSymbol import ConcreteOrderedPair, ConcreteSymbol
+from OracleTable import ENCODINGS, SCHEMAS, OracleTable
+from TCP import FlagSet
+
+# Benchmark of the encodings of oracle traces: jsons reflection, which toJSON used to be, against the explicit
+# JSON, compact JSON and binary forms. Every form is checked to round-trip first, on its own and through an
+# in-memory OracleTable of every schema.
+
+FLAGS = ["S", "SA", "A", "AP", "AF", "R", "AR"]
+
+# The flags as jsons used to serialize them, every flag by name. Only this benchmark still goes through jsons.
+jsons.set_serializer(lambda flagSet, **kwargs: flagSet.asDict(), FlagSet)
+
+
+def number(generator: random.Random) -> Optional[Value] | int:
+    choice = generator.random()
+    if choice < 0.2:
+        return None
+    if choice < 0.3:
+        return generator.randrange(1 << 32)
+    return generator.choice(list(Value))
+
+
+def abstractSymbol(generator: random.Random) -> AbstractSymbol:
+    return AbstractSymbol((generator.choice(FLAGS), number(generator), number(generator), generator.choice([0, 1, None])))
+
+
+def concreteSymbol(generator: random.Random) -> ConcreteSymbol:
+    return ConcreteSymbol.fromFields(
+        generator.randrange(65536),
+        generator.randrange(65536),
+        generator.randrange(1 << 32),
+        generator.randrange(1 << 32),
+        generator.choice([None, 5]),
+        0,
+        FlagSet(generator.choice(FLAGS)),
+        8192,
+        generator.choice([None, generator.randrange(65536)]),
+        0,
+        "".join(generator.choice(string.ascii_letters) for _ in range(generator.choice([0, 0, 1, 10]))),
+    )
+
+
+def pairs(count: int, length: int, seed: int) -> list[tuple[AbstractOrderedPair, ConcreteOrderedPair]]:
+    generator = random.Random(seed)
+    result = []
+    for _ in range(count):
+        abstractInputs: list[Optional[AbstractSymbol]] = [abstractSymbol(generator) for _ in range(length)]
+        abstractOutputs = [abstractSymbol(generator) if generator.random() < 0.8 else None for _ in range(length)]
+        concreteInputs: list[Optional[ConcreteSymbol]] = [concreteSymbol(generator) for _ in range(length)]
+        concreteOutputs = [concreteSymbol(generator) if output is not None else None for output in abstractOutputs]
+        result.append((AbstractOrderedPair(abstractInputs, abstractOutputs), ConcreteOrderedPair(concreteInputs, concreteOutputs)))
+    return result
+
+
+def check(samples: list[tuple[AbstractOrderedPair, ConcreteOrderedPair]]) -> int:
+    mismatches = 0
+    for abstract, concrete in samples:
+        expected = (abstract.toJSON(), concrete.toJSON())
+        if expected != (jsons.dumps(abstract), jsons.dumps(concrete)):
+            mismatches += 1
+            print("toJSON differs from jsons: " + expected[0], file=sys.stderr)
+        decoded = [
+            (AbstractOrderedPair.fromJSON(abstract.toJSON()), ConcreteOrderedPair.fromJSON(concrete.toJSON())),
+            (AbstractOrderedPair.fromJSON(abstract.toCompactJSON()), ConcreteOrderedPair.fromJSON(concrete.toCompactJSON())),
+            (AbstractOrderedPair.fromBytes(abstract.toBytes()), ConcreteOrderedPair.fromBytes(concrete.toBytes())),
+        ]
+        for name, (decodedAbstract, decodedConcrete) in zip(["json", "compact", "binary"], decoded):
+            if (decodedAbstract.toJSON(), decodedConcrete.toJSON()) != expected:
+                mismatches += 1
+                print(name + " does not round-trip: " + expected[0], file=sys.stderr)
+    for schema in SCHEMAS:
+        for encoding in ENCODINGS:
+            table = OracleTable("sqlite://", schema=schema, encoding=encoding, maxSamples=len(samples))
+            for abstract, concrete in samples:
+                table.add(abstract, concrete)
+            stored = sorted(map(lambda pair: pair.toJSON(), table.abstractPairs()))
+            if stored != sorted(set(map(lambda sample: sample[0].toJSON(), samples))) and schema == "unique":
+                mismatches += 1
+                print("Abstract traces do not round-trip through " + schema + "/" + encoding, file=sys.stderr)
+            elif stored != sorted(map(lambda sample: sample[0].toJSON(), samples)) and schema != "unique":
+                mismatches += 1
+                print("Abstract traces do not round-trip through " + schema + "/" + encoding, file=sys.stderr)
+            storedConcrete = sorted(map(lambda pair: pair.toJSON(), table.concretePairs()))
+            if storedConcrete != sorted(map(lambda sample: sample[1].toJSON(), samples)):
+                mismatches += 1
+                print("Concrete traces do not round-trip through " + schema + "/" + encoding, file=sys.stderr)
+            table.stop()
+    return mismatches
+
+
+def measure(name: str, samples: list, encode: Callable, repeat: int) -> float:
+    def run() -> None:
+        for sample in samples:
+            encode(sample)
+
+    best = min(timeit.repeat(run, number=1, repeat=repeat)) / len(samples)
+    print(name.ljust(36) + ("%.1f" % (best * 1e6)).rjust(8) + " us/trace")
+    return best
+
+
+def main(arguments: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the encodings of oracle traces.")
+    parser.add_argument("--traces", type=int, default=2000)
+    parser.add_argument("--length", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args(arguments)
+    samples = pairs(options.traces, options.length, options.seed)
+    mismatches = check(samples[: min(len(samples), 200)])
+    print(str(len(samples)) + " traces of " + str(options.length) + " symbols, " + str(mismatches) + " round-trip failures.")
+
+    slow = measure("encode jsons.dumps", samples, lambda pair: (jsons.dumps(pair[0]), jsons.dumps(pair[1])), options.repeat)
+    fast = measure("encode toJSON", samples, lambda pair: (pair[0].toJSON(), pair[1].toJSON()), options.repeat)
+    compact = measure("encode toCompactJSON", samples, lambda pair: (pair[0].toCompactJSON(), pair[1].toCompactJSON()), options.repeat)
+    binary = measure("encode toBytes", samples, lambda pair: (pair[0].toBytes(), pair[1].toBytes()), options.repeat)
+    print(
+        "Encoding speedup over jsons: "
+        + ", ".join(map(lambda time: "%.1fx" % (slow / time), [fast, compact, binary]))
+        + " for JSON, compact JSON and binary."
+    )
+
+    decodeJSON = lambda pair: (AbstractOrderedPair.fromJSON(pair[0]), ConcreteOrderedPair.fromJSON(pair[1]))
+    measure("decode fromJSON", [(pair[0].toJSON(), pair[1].toJSON()) for pair in samples], decodeJSON, options.repeat)
+    compactJSON = [(pair[0].toCompactJSON(), pair[1].toCompactJSON()) for pair in samples]
+    measure("decode fromJSON, compact", compactJSON, decodeJSON, options.repeat)
+    decodeBytes = lambda pair: (AbstractOrderedPair.fromBytes(pair[0]), ConcreteOrderedPair.fromBytes(pair[1]))
+    measure("decode fromBytes", [(pair[0].toBytes(), pair[1].toBytes()) for pair in samples], decodeBytes, options.repeat)
+
+    sizes = [
+        sum(len(pair[0].toJSON()) + len(pair[1].toJSON()) for pair in samples),
+        sum(len(pair[0].toCompactJSON()) + len(pair[1].toCompactJSON()) for pair in samples),
+        sum(len(pair[0].toBytes()) + len(pair[1].toBytes()) for pair in samples),
+    ]
+    print("Bytes per trace: " + ", ".join(map(lambda size: str(size // len(samples)), sizes)) + " for JSON, compact JSON and binary.")
+    sys.exit(1 if mismatches > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import random
+import string
+import sys
+import timeit
+from typing import Optional
+
+from impacket.ImpactDecoder import EthDecoder
+from scapy.layers.inet import IP, TCP
+from scapy.layers.l2 import Ether
+from scapy.packet import Raw
+
+from ConcreteSymbol import ConcreteSymbol
+from FrameDecoder import decodeFrame
+
+# Micro-benchmark of the tracker's decoding of captured frames: impacket's object tree against FrameDecoder.
+# Both paths run on the same random frames, and their symbols are compared first.
+
+FIELDS = [
+    "sourcePort",
+    "destinationPort",
+    "seqNumber",
+    "ackNumber",
+    "dataOffset",
+    "reserved",
+    "window",
+    "checksum",
+    "urgentPointer",
+    "payload",
+]
+
+
+def frames(count: int, seed: int) -> list[bytes]:
+    generator = random.Random(seed)
+    result = []
+    for _ in range(count):
+        tcp = TCP(
+            sport=generator.randrange(65536),
+            dport=generator.randrange(65536),
+            seq=generator.randrange(1 << 32),
+            ack=generator.randrange(1 << 32),
+            flags=generator.choice(["S", "SA", "A", "PA", "FA", "R", "RA"]),
+        )
+        length = generator.choice([0, 0, 0, 1, 10, 100])
+        packet = Ether() / IP(src="10.0.0.2", dst="10.0.0.1") / tcp
+        if length > 0:
+            packet = packet / Raw(load="".join(generator.choice(string.ascii_letters) for _ in range(length)))
+        result.append(bytes(packet))
+    return result
+
+
+def impacketSymbol(decoder: EthDecoder, frame: bytes) -> ConcreteSymbol:
+    ip = decoder.decode(frame).child()
+    assert ip is not None
+    return ConcreteSymbol(ip.child())
+
+
+def fastSymbol(frame: bytes) -> Optional[ConcreteSymbol]:
+    segment = decodeFrame(frame)
+    return ConcreteSymbol(segment) if segment is not None else None
+
+
+def check(samples: list[bytes]) -> int:
+    decoder = EthDecoder()
+    mismatches = 0
+    for frame in samples:
+        expected = impacketSymbol(decoder, frame)
+        # Impacket symbols share their FlagSet, so flags are compared before decoding the next frame.
+        expectedFields = [getattr(expected, field) for field in FIELDS] + [expected.flags.asScapy()]
+        actual = fastSymbol(frame)
+        actualFields = [getattr(actual, field) for field in FIELDS] + [actual.flags.asScapy()] if actual is not None else None
+        if expectedFields != actualFields:
+            mismatches += 1
+            print("Mismatch on " + frame.hex() + ": " + str(expectedFields) + " != " + str(actualFields), file=sys.stderr)
+    return mismatches
+
+
+def measure(name: str, samples: list[bytes], decode, repeat: int) -> float:
+    def run() -> None:
+        for frame in samples:
+            decode(frame)
+
+    best = min(timeit.repeat(run, number=1, repeat=repeat)) / len(samples)
+    print(name.ljust(32) + ("%.2f" % (best * 1e6)).rjust(8) + " us/frame")
+    return best
+
+
+def main(arguments: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the tracker's frame decoding.")
+    parser.add_argument("--frames", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args(arguments)
+    samples = frames(options.frames, options.seed)
+    mismatches = check(samples)
+    print(str(len(samples)) + " frames, " + str(mismatches) + " decoded differently.")
+    decoder = EthDecoder()
+    slow = measure("impacket + ConcreteSymbol", samples, lambda frame: impacketSymbol(decoder, frame), options.repeat)
+    fast = measure("FrameDecoder + ConcreteSymbol", samples, fastSymbol, options.repeat)
+    ports = measure("FrameDecoder, ports only", samples, decodeFrame, options.repeat)
+    print("Speedup: " + ("%.1f" % (slow / fast)) + "x for awaited flows, " + ("%.1f" % (slow / ports)) + "x for others.")
+    sys.exit(1 if mismatches > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
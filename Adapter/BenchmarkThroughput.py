@@ -0,0 +1,195 @@
+import argparse
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Optional
+
+import yaml
+
+from LoopbackSUT import LoopbackSUT
+
+# Throughput benchmark of the adapter server against the loopback stand-in SUT, with a SQLite oracle table. Every
+# workload runs on a fresh server process, started with a config of its own, and is reported as queries per second,
+# the percentiles of the stages of STATS and the memory of the server. Needs the rights to open packet sockets.
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+MAP_FILE = os.path.join(DIRECTORY, os.pardir, "Mapper", "resources", "linux.map")
+HANDSHAKE = "SYN(?,?,0) ACK(?,?,0)"
+INPUTS = ["SYN(?,?,0)", "ACK(?,?,0)", "ACK+PSH(?,?,1)", "FIN+ACK(?,?,0)", "RST(?,?,0)"]
+
+
+class Client:
+    def __init__(self, port: int, timeout: float = 30.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.socket = socket.create_connection(("127.0.0.1", port))
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        self.stream = self.socket.makefile("rw")
+
+    def ask(self, line: str, answers: int = 1) -> list[str]:
+        self.stream.write(line + "\n")
+        self.stream.flush()
+        return [self.stream.readline().strip() for _ in range(answers)]
+
+    def close(self) -> None:
+        self.stream.close()
+        self.socket.close()
+
+
+# Every workload runs count queries and returns how many it ran.
+def handshakes(client: Client, count: int) -> int:
+    for _ in range(count):
+        client.ask("RESET")
+        client.ask(HANDSHAKE)
+    return count
+
+
+def dataWords(client: Client, count: int, length: int) -> int:
+    word = " ".join([HANDSHAKE] + ["ACK+PSH(?,?,1)"] * length)
+    for _ in range(count):
+        client.ask("RESET")
+        client.ask(word)
+    return count
+
+
+# Batches of distinct words of up to three inputs, every one of which runs from a reset.
+def resetBatches(client: Client, count: int, size: int) -> int:
+    words = [" ".join(word) for length in (1, 2, 3) for word in itertools.product(INPUTS, repeat=length)]
+    ran = 0
+    while ran < count:
+        batch = words[ran % len(words) : ran % len(words) + min(size, count - ran)]
+        client.ask("BATCH " + str(len(batch)) + "\n" + "\n".join(batch), len(batch))
+        ran += len(batch)
+    return ran
+
+
+def memory(pid: int) -> dict:
+    result = {}
+    with open("/proc/" + str(pid) + "/status") as stream:
+        for line in stream:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                result[key] = int(value.split()[0])
+    return result
+
+
+# A port that nothing listens on, as the server of an earlier run may have left its own in TIME_WAIT.
+def freePort() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def configFor(options: argparse.Namespace, directory: str, name: str, port: int) -> dict:
+    config = {
+        "port": port,
+        "impAddress": options.address,
+        "impPort": options.sut_port,
+        "localAddress": options.address,
+        "interface": options.interface,
+        "timeout": options.timeout,
+        "symbolic": False,
+        "oracleTableURL": "sqlite:///" + os.path.join(directory, name + ".db"),
+        "mapperEngine": options.mapper,
+        "mapFile": os.path.abspath(options.map),
+        "transmitter": options.transmitter,
+        "capture": options.capture,
+        "logLevel": "WARNING",
+    }
+    if options.fast_reset:
+        config["fastReset"] = {}
+    return config
+
+
+def run(options: argparse.Namespace, name: str, workload: Callable[[Client], int]) -> dict:
+    port = freePort()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "config.yaml")
+        with open(path, "w") as stream:
+            yaml.safe_dump({"adapter": configFor(options, directory, name, port)}, stream)
+        environment = dict(os.environ, ADAPTER_CONFIG=path)
+        server = subprocess.Popen([sys.executable, os.path.join(DIRECTORY, "Adapter.py")], env=environment, cwd=DIRECTORY)
+        try:
+            client = Client(port)
+            start = time.perf_counter()
+            queries = workload(client)
+            elapsed = time.perf_counter() - start
+            stages = json.loads(client.ask("STATS")[0])
+            result = {"workload": name, "queries": queries, "seconds": elapsed, "queriesPerSecond": queries / elapsed}
+            result["stages"] = stages
+            result["memory"] = memory(server.pid)
+            client.ask("STOP")
+            client.close()
+            server.wait(10)
+        finally:
+            if server.poll() is None:
+                server.terminate()
+                server.wait()
+        return result
+
+
+def report(result: dict) -> None:
+    summary = (result["workload"], result["queries"], result["seconds"], result["queriesPerSecond"])
+    print("%s: %d queries in %.2fs, %.1f queries/s" % summary)
+    for stage, stats in result["stages"].items():
+        if stats["count"] > 0:
+            line = "  %-15s %7d  p50 %8.1fus  p99 %8.1fus"
+            print(line % (stage, stats["count"], stats["p50"] * 1e6, stats["p99"] * 1e6))
+    memory = result["memory"]
+    print("  memory: %d kB resident, %d kB peak" % (memory.get("VmRSS", 0), memory.get("VmHWM", 0)))
+
+
+def main(arguments: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the adapter server against a loopback stand-in SUT.")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--length", type=int, default=10, help="Data segments per long data word.")
+    parser.add_argument("--batch", type=int, default=20, help="Queries per batch of the reset-heavy workload.")
+    parser.add_argument("--workloads", default="handshake,data,batch")
+    parser.add_argument("--mapper", default="python", choices=["python", "java"])
+    parser.add_argument("--map", default=MAP_FILE)
+    # Segments that scapy sends on loopback also reach the kernel, whose RSTs the adapter would take for the stand-in's.
+    parser.add_argument(
+        "--transmitter", default="raw", choices=["raw", "scapy"], help="Transmitter engine of the adapter, raw unless on a real interface."
+    )
+    parser.add_argument("--capture", default="pcap", choices=["pcap", "socket"], help="Capture backend of the adapter.")
+    parser.add_argument("--timeout", type=float, default=0.05, help="Response timeout of the adapter in seconds.")
+    parser.add_argument("--fast-reset", action="store_true")
+    parser.add_argument("--interface", default="lo")
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--sut-port", type=int, default=4444)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file.")
+    options = parser.parse_args(arguments)
+
+    workloads: dict[str, Callable[[Client], int]] = {
+        "handshake": lambda client: handshakes(client, options.queries),
+        "data": lambda client: dataWords(client, options.queries, options.length),
+        "batch": lambda client: resetBatches(client, options.queries, options.batch),
+    }
+    sut = LoopbackSUT(options.address, options.sut_port, options.interface, options.seed)
+    sut.start()
+    results = []
+    try:
+        for name in options.workloads.split(","):
+            result = run(options, name, workloads[name])
+            report(result)
+            results.append(result)
+    finally:
+        sut.stop()
+    if options.json is not None:
+        with open(options.json, "w") as stream:
+            json.dump(results, stream, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import random
+import shlex
+import subprocess
+import sys
+from typing import Optional
+
+from Invlang import DEFAULT_MAP, ERROR, InvlangMapper, unsigned, wrap
+from Mapper import JAVA_MAPPER
+
+# Differential check of the in-process invlang engine against the Java mapper. Both are driven through the same
+# random walks of the pipe protocol, and their answers and states are compared after every command. Outgoing symbols
+# are sent with CONCRETIZE, so both mappers start their search from the same random draws.
+
+INPUT_FLAGS = ["SYN", "ACK", "SYN+ACK", "RST", "ACK+RST", "ACK+FIN", "ACK+PSH", "FIN", "PSH"]
+OUTPUT_FLAGS = ["SYN", "ACK", "ACK+SYN", "RST", "ACK+RST", "ACK+FIN", "ACK+PSH", "ACK+FIN+PSH"]
+
+
+class JavaMapper:
+    def __init__(self, command: str):
+        self.command: str = command
+        self.start()
+
+    def start(self) -> None:
+        self.process = subprocess.Popen(shlex.split(self.command), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def handle(self, command: str) -> str:
+        if self.process.poll() is not None:
+            self.start()
+        assert self.process.stdin is not None and self.process.stdout is not None
+        try:
+            self.process.stdin.write(bytearray(command + "\n", "utf-8"))
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            self.process.wait()
+            return ERROR
+        line = self.process.stdout.readline().decode("utf-8")
+        if line == "":
+            # The mapper died, e.g. on an input it cannot concretize. Wait for it, or the next walk may start on it.
+            self.process.wait()
+            return ERROR
+        return line.rstrip("\n")
+
+    def stop(self) -> None:
+        self.process.kill()
+
+
+def handle(mapper: InvlangMapper, command: str) -> str:
+    try:
+        lines = mapper.handle(command)
+    except ValueError:
+        mapper.sendReset()
+        return ERROR
+    return lines[0] if len(lines) > 0 else ERROR
+
+
+# Numbers close to what the mapper tracks, so that both valid and invalid branches are taken.
+def number(generator: random.Random, mapper: InvlangMapper) -> int:
+    known = [value for value in mapper.state.values() if isinstance(value, int) and not isinstance(value, bool)]
+    choice = generator.random()
+    if choice < 0.6 and len(known) > 0:
+        return unsigned(generator.choice(known) + generator.choice([-1, 0, 0, 1, 1, 2]))
+    elif choice < 0.7:
+        return 0
+    return generator.randrange(0, 0x100000000)
+
+
+def command(generator: random.Random, mapper: InvlangMapper) -> str:
+    choice = generator.random()
+    if choice < 0.05:
+        return "RESET"
+    elif choice < 0.5:
+        seq = wrap(number(generator, mapper))
+        ack = wrap(number(generator, mapper))
+        flags = generator.choice(INPUT_FLAGS + ["RST"])
+        length = generator.choice(["0", "0", "1", "?"])
+        return "CONCRETIZE " + str(seq) + " " + str(ack) + " " + flags + "(?,?," + length + ")"
+    flags = generator.choice(OUTPUT_FLAGS)
+    length = generator.choice([0, 0, 0, 1, 5])
+    return "CONCRETE " + flags + "(" + str(number(generator, mapper)) + "," + str(number(generator, mapper)) + "," + str(length) + ")"
+
+
+def check(walks: int, steps: int, seed: int, mapFile: str, javaCommand: str) -> int:
+    generator = random.Random(seed)
+    java = JavaMapper(javaCommand)
+    mismatches = 0
+    try:
+        for walk in range(walks):
+            python = InvlangMapper(mapFile)
+            java.handle("RESET")
+            history: list[str] = []
+            for _ in range(steps):
+                request = command(generator, python)
+                history.append(request)
+                expected = java.handle(request)
+                actual = handle(python, request)
+                expectedState = java.handle("STATE") if expected != ERROR else ""
+                actualState = handle(python, "STATE") if expected != ERROR else ""
+                if expected != actual or expectedState != actualState:
+                    mismatches += 1
+                    print("Walk " + str(walk) + " diverged after:", file=sys.stderr)
+                    for line in history:
+                        print("  " + line, file=sys.stderr)
+                    print("  java:   " + expected + " / " + expectedState, file=sys.stderr)
+                    print("  python: " + actual + " / " + actualState, file=sys.stderr)
+                    break
+                if expected == ERROR:
+                    break
+    finally:
+        java.stop()
+    print(str(walks) + " walks of up to " + str(steps) + " commands, " + str(mismatches) + " diverged.")
+    return mismatches
+
+
+def main(arguments: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Check the Python invlang engine against the Java mapper.")
+    parser.add_argument("--walks", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--map", default=DEFAULT_MAP)
+    parser.add_argument("--java", default=JAVA_MAPPER)
+    options = parser.parse_args(arguments)
+    sys.exit(1 if check(options.walks, options.steps, options.seed, options.map, options.java) > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,73 @@
 from enum import Flag
 from typing import List, Optional
-import jsons
+import json
 import re
+import struct
 
 import scapy.layers.inet
-from scapy.packet import Raw
+from scapy.packet import Packet, Raw
 import impacket.ImpactPacket
 
+from FrameDecoder import Segment
 from TCP import FlagSet
 
 
+SYMBOL_PATTERN = re.compile(r"([A-Z+]+)\(([0-9]+),([0-9]+),([0-9]+)\)")
+
+# Binary form of a symbol: a mask of unknown fields (1 for the data offset, 2 for the checksum), ports, seq, ack,
+# data offset, reserved bits, flags, window, checksum, urgent pointer and payload length, followed by the payload.
+SYMBOL_STRUCT = struct.Struct("!BHHIIBBBHHHH")
+PAIR_STRUCT = struct.Struct("!HH")
+
+
 class ConcreteSymbol:
-    sourcePort: int = 20
-    destinationPort: int = 80
-    seqNumber: int = 0
-    ackNumber: int = 0
-    dataOffset: Optional[int] = None
-    reserved: int = 0
-    flags: FlagSet = FlagSet()
-    window: int = 8192
-    checksum: Optional[str] = None
-    urgentPointer: int = 0
-    payload: str = ""
-
-    def __init__(self, packet: impacket.ImpactPacket.TCP | scapy.layers.inet.TCP | str):
-        # Scapy object
-        if isinstance(packet, scapy.layers.inet.TCP):
+    __slots__ = (
+        "sourcePort",
+        "destinationPort",
+        "seqNumber",
+        "ackNumber",
+        "dataOffset",
+        "reserved",
+        "flags",
+        "window",
+        "checksum",
+        "urgentPointer",
+        "payload",
+    )
+    sourcePort: int
+    destinationPort: int
+    seqNumber: int
+    ackNumber: int
+    dataOffset: Optional[int]
+    reserved: int
+    flags: FlagSet
+    window: int
+    checksum: Optional[int]
+    urgentPointer: int
+    payload: str
+
+    def __init__(self, packet: impacket.ImpactPacket.TCP | Packet | Segment | str):
+        self.sourcePort = 20
+        self.destinationPort = 80
+        self.seqNumber = 0
+        self.ackNumber = 0
+        self.dataOffset = None
+        self.reserved = 0
+        self.flags = FlagSet()
+        self.window = 8192
+        self.checksum = None
+        self.urgentPointer = 0
+        self.payload = ""
+
+        # Scapy object, with a TCP layer.
+        if isinstance(packet, Packet):
             self.sourcePort = packet[scapy.layers.inet.TCP].sport
             self.destinationPort = packet[scapy.layers.inet.TCP].dport
             self.seqNumber = packet[scapy.layers.inet.TCP].seq
             self.ackNumber = packet[scapy.layers.inet.TCP].ack
             self.dataOffset = packet[scapy.layers.inet.TCP].dataofs
             self.reserved = packet[scapy.layers.inet.TCP].reserved
-            self.flags = FlagSet(str(packet[scapy.layers.inet.TCP].flags))
+            self.flags = FlagSet.fromBits(int(packet[scapy.layers.inet.TCP].flags))
             self.window = packet[scapy.layers.inet.TCP].window
             self.checksum = packet[scapy.layers.inet.TCP].chksum
             self.urgentPointer = packet[scapy.layers.inet.TCP].urgptr
@@ -48,14 +83,7 @@ class ConcreteSymbol:
             self.dataOffset = packet.get_th_off()
             self.reserved = packet.get_th_reserved()
 
-            self.flags.SYN = bool(packet.get_SYN())
-            self.flags.ACK = bool(packet.get_ACK())
-            self.flags.RST = bool(packet.get_RST())
-            self.flags.FIN = bool(packet.get_FIN())
-            self.flags.PSH = bool(packet.get_PSH())
-            self.flags.URG = bool(packet.get_URG())
-            self.flags.ECE = bool(packet.get_ECE())
-            self.flags.CWR = bool(packet.get_CWR())
+            self.flags = FlagSet.fromBits(packet.get_th_flags())
 
             self.window = packet.get_th_win()
             self.checksum = packet.get_th_sum()
@@ -65,17 +93,29 @@ class ConcreteSymbol:
             if inData is not None:
                 self.payload = inData.decode("utf-8")
 
+        # Segment of a captured frame.
+        elif isinstance(packet, Segment):
+            self.sourcePort = packet.sourcePort
+            self.destinationPort = packet.destinationPort
+            seq, ack, dataOffset, reserved, flags, window, checksum, urgentPointer = packet.fields()
+            self.seqNumber = seq
+            self.ackNumber = ack
+            self.dataOffset = dataOffset
+            self.reserved = reserved
+            self.flags = FlagSet.fromBits(flags)
+            self.window = window
+            self.checksum = checksum
+            self.urgentPointer = urgentPointer
+            self.payload = packet.payload().decode("utf-8")
+
         # Generic string object.
         else:
-            pattern = re.compile(r"([A-Z+]+)\(([0-9]+),([0-9]+),([0-9]+)\)")
-            capture = pattern.match(packet)
+            capture = SYMBOL_PATTERN.match(packet)
             if capture is None:
                 raise ValueError("Invalid concrete syntax:", packet)
 
-            inFlags = capture.group(1)
-            if "+" in inFlags:
-                inFlags = "".join(map(lambda x: x[0], inFlags.split("+")))
-            self.flags = FlagSet(inFlags)
+            # By initials of the flag names, as the letters of RST would otherwise include the S of SYN.
+            self.flags = FlagSet("".join(map(lambda x: x[0], capture.group(1).split("+"))))
 
             self.seqNumber = int(capture.group(2))
             self.ackNumber = int(capture.group(3))
@@ -88,17 +128,187 @@ class ConcreteSymbol:
         payloadLenString = str(len(self.payload))
         return flagsString + "(" + seqString + "," + ackString + "," + payloadLenString + ")"
 
+    # The form symbols have always been stored in, with every attribute by name.
+    def toDict(self) -> dict:
+        return {
+            "ackNumber": self.ackNumber,
+            "checksum": self.checksum,
+            "dataOffset": self.dataOffset,
+            "destinationPort": self.destinationPort,
+            "flags": self.flags.asDict(),
+            "payload": self.payload,
+            "reserved": self.reserved,
+            "seqNumber": self.seqNumber,
+            "sourcePort": self.sourcePort,
+            "urgentPointer": self.urgentPointer,
+            "window": self.window,
+        }
+
     def toJSON(self) -> str:
-        return jsons.dumps(self)
+        return json.dumps(self.toDict())
+
+    @staticmethod
+    def fromDict(data: dict) -> "ConcreteSymbol":
+        flags = "".join(map(lambda flag: flag[0], filter(lambda flag: data["flags"][flag], data["flags"])))
+        return ConcreteSymbol.fromFields(
+            data["sourcePort"],
+            data["destinationPort"],
+            data["seqNumber"],
+            data["ackNumber"],
+            data["dataOffset"],
+            data["reserved"],
+            FlagSet(flags),
+            data["window"],
+            data["checksum"],
+            data["urgentPointer"],
+            data["payload"],
+        )
+
+    @staticmethod
+    def fromFields(
+        sourcePort: int,
+        destinationPort: int,
+        seqNumber: int,
+        ackNumber: int,
+        dataOffset: Optional[int],
+        reserved: int,
+        flags: FlagSet,
+        window: int,
+        checksum: Optional[int],
+        urgentPointer: int,
+        payload: str,
+    ) -> "ConcreteSymbol":
+        symbol = ConcreteSymbol.__new__(ConcreteSymbol)
+        symbol.sourcePort = sourcePort
+        symbol.destinationPort = destinationPort
+        symbol.seqNumber = seqNumber
+        symbol.ackNumber = ackNumber
+        symbol.dataOffset = dataOffset
+        symbol.reserved = reserved
+        symbol.flags = flags
+        symbol.window = window
+        symbol.checksum = checksum
+        symbol.urgentPointer = urgentPointer
+        symbol.payload = payload
+        return symbol
+
+    # Compact form: the attributes in the order of the binary form, with the flags byte.
+    def toList(self) -> list:
+        return [
+            self.sourcePort,
+            self.destinationPort,
+            self.seqNumber,
+            self.ackNumber,
+            self.dataOffset,
+            self.reserved,
+            self.flags.bits,
+            self.window,
+            self.checksum,
+            self.urgentPointer,
+            self.payload,
+        ]
+
+    @staticmethod
+    def fromList(data: list) -> "ConcreteSymbol":
+        sourcePort, destinationPort, seq, ack, dataOffset, reserved, bits, window, checksum, urgentPointer, payload = data
+        return ConcreteSymbol.fromFields(
+            sourcePort, destinationPort, seq, ack, dataOffset, reserved, FlagSet.fromBits(bits), window, checksum, urgentPointer, payload
+        )
+
+    def toBytes(self) -> bytes:
+        payload = self.payload.encode("utf-8")
+        unknown = (1 if self.dataOffset is None else 0) | (2 if self.checksum is None else 0)
+        header = SYMBOL_STRUCT.pack(
+            unknown,
+            self.sourcePort,
+            self.destinationPort,
+            self.seqNumber,
+            self.ackNumber,
+            self.dataOffset or 0,
+            self.reserved,
+            self.flags.bits,
+            self.window,
+            self.checksum or 0,
+            self.urgentPointer,
+            len(payload),
+        )
+        return header + payload
+
+    # The symbol at offset, and the offset right after it.
+    @staticmethod
+    def fromBytes(data: bytes, offset: int = 0) -> tuple["ConcreteSymbol", int]:
+        fields = SYMBOL_STRUCT.unpack_from(data, offset)
+        unknown, sourcePort, destinationPort, seq, ack, dataOffset, reserved, bits, window, checksum, urgentPointer, length = fields
+        start = offset + SYMBOL_STRUCT.size
+        symbol = ConcreteSymbol.fromFields(
+            sourcePort,
+            destinationPort,
+            seq,
+            ack,
+            dataOffset if unknown & 1 == 0 else None,
+            reserved,
+            FlagSet.fromBits(bits),
+            window,
+            checksum if unknown & 2 == 0 else None,
+            urgentPointer,
+            data[start : start + length].decode("utf-8"),
+        )
+        return symbol, start + length
 
 
 class ConcreteOrderedPair:
-    concreteInputs: List[Optional[ConcreteSymbol]] = []
-    concreteOutputs: List[Optional[ConcreteSymbol]] = []
+    __slots__ = ("concreteInputs", "concreteOutputs")
+    concreteInputs: List[Optional[ConcreteSymbol]]
+    concreteOutputs: List[Optional[ConcreteSymbol]]
 
     def __init__(self, inputs: List[Optional[ConcreteSymbol]], outputs: List[Optional[ConcreteSymbol]]):
         self.concreteInputs = inputs
         self.concreteOutputs = outputs
 
+    def toDict(self) -> dict:
+        return {
+            "concreteInputs": [symbol.toDict() if symbol is not None else None for symbol in self.concreteInputs],
+            "concreteOutputs": [symbol.toDict() if symbol is not None else None for symbol in self.concreteOutputs],
+        }
+
     def toJSON(self) -> str:
-        return jsons.dumps(self)
+        return json.dumps(self.toDict())
+
+    # Symbols as lists, see ConcreteSymbol.toList, under "i" and "o".
+    def toCompactJSON(self) -> str:
+        inputs = [symbol.toList() if symbol is not None else None for symbol in self.concreteInputs]
+        outputs = [symbol.toList() if symbol is not None else None for symbol in self.concreteOutputs]
+        return json.dumps({"i": inputs, "o": outputs}, separators=(",", ":"))
+
+    # Takes both the form of toJSON and that of toCompactJSON.
+    @staticmethod
+    def fromJSON(text: str | dict) -> "ConcreteOrderedPair":
+        data = json.loads(text) if isinstance(text, str) else text
+        if "i" in data:
+            inputs = [ConcreteSymbol.fromList(symbol) if symbol is not None else None for symbol in data["i"]]
+            outputs = [ConcreteSymbol.fromList(symbol) if symbol is not None else None for symbol in data["o"]]
+            return ConcreteOrderedPair(inputs, outputs)
+        inputs = [ConcreteSymbol.fromDict(symbol) if symbol is not None else None for symbol in data["concreteInputs"]]
+        outputs = [ConcreteSymbol.fromDict(symbol) if symbol is not None else None for symbol in data["concreteOutputs"]]
+        return ConcreteOrderedPair(inputs, outputs)
+
+    # Counts of inputs and outputs, then every symbol after a byte that is 0 for None.
+    def toBytes(self) -> bytes:
+        parts = [PAIR_STRUCT.pack(len(self.concreteInputs), len(self.concreteOutputs))]
+        for symbol in self.concreteInputs + self.concreteOutputs:
+            parts.append(b"\x01" + symbol.toBytes() if symbol is not None else b"\x00")
+        return b"".join(parts)
+
+    @staticmethod
+    def fromBytes(data: bytes) -> "ConcreteOrderedPair":
+        inputCount, outputCount = PAIR_STRUCT.unpack_from(data, 0)
+        offset = PAIR_STRUCT.size
+        symbols: list[Optional[ConcreteSymbol]] = []
+        for _ in range(inputCount + outputCount):
+            if data[offset] == 0:
+                symbols.append(None)
+                offset += 1
+            else:
+                symbol, offset = ConcreteSymbol.fromBytes(data, offset + 1)
+                symbols.append(symbol)
+        return ConcreteOrderedPair(symbols[:inputCount], symbols[inputCount:])
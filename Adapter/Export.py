@@ -0,0 +1,177 @@
+import argparse
+import json
+import sys
+from datetime import datetime, timezone
+from typing import IO, Iterator, Optional
+
+from AbstractSymbol import AbstractOrderedPair
+from ConcreteSymbol import ConcreteOrderedPair, ConcreteSymbol
+from OracleTable import SCHEMAS, OracleTable
+
+# Export of an oracle table for analysis, with one row per step of every trace: the abstract input and output and the
+# fields of the concrete segments. Traces are streamed from the table and written out as they come, to JSON lines or
+# Parquet files of at most chunkRows rows each, so memory stays the same however large the table is. Parquet needs
+# pyarrow, which the adapter itself does not.
+
+COLUMNS: list[tuple[str, str]] = [
+    ("id", "string"),
+    ("created", "timestamp"),
+    ("step", "int"),
+    ("input", "string"),
+    ("output", "string"),
+    ("inputFlags", "string"),
+    ("inputSeq", "int"),
+    ("inputAck", "int"),
+    ("inputLength", "int"),
+    ("outputFlags", "string"),
+    ("outputSeq", "int"),
+    ("outputAck", "int"),
+    ("outputLength", "int"),
+    ("outputWindow", "int"),
+]
+
+Row = dict[str, object]
+
+
+def segmentFields(prefix: str, symbol: Optional[ConcreteSymbol]) -> Row:
+    if symbol is None:
+        return {prefix + "Flags": None, prefix + "Seq": None, prefix + "Ack": None, prefix + "Length": None}
+    return {
+        prefix + "Flags": symbol.flags.asHuman(),
+        prefix + "Seq": symbol.seqNumber,
+        prefix + "Ack": symbol.ackNumber,
+        prefix + "Length": len(symbol.payload),
+    }
+
+
+def steps(id: str, created: Optional[datetime], abstract: str, concrete: str) -> Iterator[Row]:
+    abstractPair = AbstractOrderedPair.fromJSON(abstract)
+    concretePair = ConcreteOrderedPair.fromJSON(concrete)
+    for step, (input, output) in enumerate(zip(abstractPair.abstractInputs, abstractPair.abstractOutputs)):
+        concreteIn = concretePair.concreteInputs[step] if step < len(concretePair.concreteInputs) else None
+        concreteOut = concretePair.concreteOutputs[step] if step < len(concretePair.concreteOutputs) else None
+        row: Row = {"id": id, "created": created, "step": step, "input": str(input), "output": str(output) if output is not None else None}
+        row.update(segmentFields("input", concreteIn))
+        row.update(segmentFields("output", concreteOut))
+        row["outputWindow"] = concreteOut.window if concreteOut is not None else None
+        yield row
+
+
+# Writes rows to <path>-00000.jsonl, <path>-00001.jsonl and so on, or all of them to standard output for path "-".
+class JSONLinesWriter:
+    def __init__(self, path: str, chunkRows: int):
+        self.path: str = path
+        self.chunkRows: int = chunkRows
+        self.files: list[str] = []
+        self.stream: Optional[IO[str]] = sys.stdout if path == "-" else None
+        self.rows: int = 0
+
+    def write(self, row: Row) -> None:
+        if self.stream is None or (self.path != "-" and self.rows >= self.chunkRows):
+            self.close()
+            name = self.path + "-%05d.jsonl" % len(self.files)
+            self.files.append(name)
+            self.stream = open(name, "w")
+            self.rows = 0
+        created = row["created"]
+        if isinstance(created, datetime):
+            row["created"] = created.isoformat()
+        self.stream.write(json.dumps(row) + "\n")
+        self.rows += 1
+
+    def close(self) -> None:
+        if self.stream is not None and self.stream is not sys.stdout:
+            self.stream.close()
+        self.stream = None
+
+
+# Writes every chunkRows rows as a Parquet file <path>-00000.parquet and so on, from columns built up in lists.
+class ParquetWriter:
+    def __init__(self, path: str, chunkRows: int):
+        import pyarrow  # pyright: ignore[reportMissingImports]
+        import pyarrow.parquet  # pyright: ignore[reportMissingImports]
+
+        self.pyarrow = pyarrow
+        self.parquet = pyarrow.parquet
+        types = {"string": pyarrow.string(), "int": pyarrow.int64(), "timestamp": pyarrow.timestamp("us", tz="UTC")}
+        # Given explicitly, or a chunk without any responses would have a column of nulls and a schema of its own.
+        self.schema = pyarrow.schema([(name, types[kind]) for name, kind in COLUMNS])
+        self.path: str = path
+        self.chunkRows: int = chunkRows
+        self.files: list[str] = []
+        self.columns: dict[str, list] = {name: [] for name, _ in COLUMNS}
+        self.rows: int = 0
+
+    def write(self, row: Row) -> None:
+        for name, values in self.columns.items():
+            values.append(row[name])
+        self.rows += 1
+        if self.rows >= self.chunkRows:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.rows == 0:
+            return
+        name = self.path + "-%05d.parquet" % len(self.files)
+        self.parquet.write_table(self.pyarrow.table(self.columns, schema=self.schema), name)
+        self.files.append(name)
+        self.columns = {name: [] for name, _ in COLUMNS}
+        self.rows = 0
+
+    def close(self) -> None:
+        self.flush()
+
+
+WRITERS = {"jsonl": JSONLinesWriter, "parquet": ParquetWriter}
+
+
+# Times without a zone are taken as UTC, like the times in the table.
+def parseTime(text: Optional[str]) -> Optional[datetime]:
+    if text is None:
+        return None
+    time = datetime.fromisoformat(text)
+    return time if time.tzinfo is not None else time.replace(tzinfo=timezone.utc)
+
+
+def export(table: OracleTable, writer: JSONLinesWriter | ParquetWriter, options: argparse.Namespace) -> dict:
+    counts = {"traces": 0, "rows": 0}
+    since, until = parseTime(options.since), parseTime(options.until)
+    try:
+        for id, created, abstract, concrete in table.selectTraces(since, until, options.prefix, options.batch):
+            counts["traces"] += 1
+            for row in steps(id, created, abstract, concrete):
+                writer.write(row)
+                counts["rows"] += 1
+    finally:
+        writer.close()
+    return counts
+
+
+def main(arguments: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export the traces of an oracle table with one row per step.")
+    parser.add_argument("url", help="Database URL of the oracle table.")
+    parser.add_argument("output", help="Path of the files without the chunk number and extension, - for JSON lines on standard output.")
+    parser.add_argument("--schema", default="mapping", choices=SCHEMAS)
+    parser.add_argument("--format", default="jsonl", choices=list(WRITERS))
+    parser.add_argument("--chunk-rows", type=int, default=100000, help="Rows per file.")
+    parser.add_argument("--batch", type=int, default=1000, help="Traces per fetch from the database.")
+    parser.add_argument("--since", help="Only traces created at or after this ISO 8601 time.")
+    parser.add_argument("--until", help="Only traces created before this ISO 8601 time.")
+    parser.add_argument("--prefix", help="Only traces whose input word is this word or extends it.")
+    options = parser.parse_args(arguments)
+    if options.output == "-" and options.format != "jsonl":
+        parser.error("Only JSON lines can be written to standard output.")
+    if options.schema == "mapping" and (options.since is not None or options.until is not None):
+        parser.error("The mapping table has no creation times, filter the trace or unique schema instead.")
+
+    try:
+        writer = WRITERS[options.format](options.output, options.chunk_rows)
+    except ImportError:
+        parser.error("Parquet export needs pyarrow.")
+    counts = export(OracleTable(options.url, schema=options.schema), writer, options)
+    counts["files"] = writer.files
+    print(json.dumps(counts), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
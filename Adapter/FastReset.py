@@ -0,0 +1,29 @@
+import shlex
+import socket
+import subprocess
+from typing import Optional
+
+
+# Settings of the fast reset path: the RST is sent on its own instead of as a logged query, and the wait for the SUT
+# to settle ends once the flow was quiet for quiet seconds, or, with a probe, once the probe passes. Either way it
+# never takes longer than the response timeout. The probe is "connect", a TCP connect to the SUT port from the
+# kernel's stack, or a shell command that exits with 0 once the SUT is ready.
+class FastReset:
+    def __init__(self, quiet: float = 0.05, probe: Optional[str] = None, probeTimeout: float = 1.0, probeInterval: float = 0.01):
+        self.quiet: float = quiet
+        self.probe: Optional[str] = probe
+        self.probeTimeout: float = probeTimeout
+        self.probeInterval: float = probeInterval
+
+    def ready(self, address: str, port: int, timeout: float) -> bool:
+        timeout = min(timeout, self.probeTimeout)
+        if timeout <= 0:
+            return False
+        try:
+            if self.probe == "connect":
+                socket.create_connection((address, port), timeout=timeout).close()
+                return True
+            assert self.probe is not None
+            return subprocess.run(shlex.split(self.probe), timeout=timeout, stdout=subprocess.DEVNULL).returncode == 0
+        except (OSError, subprocess.TimeoutExpired):
+            return False
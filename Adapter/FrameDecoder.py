@@ -0,0 +1,56 @@
+import struct
+from typing import Optional
+
+# Decodes Ethernet/IPv4/TCP frames straight from the capture buffer, in place of impacket's object tree.
+# Only the ports are read up front, so the tracker can drop segments of flows nobody waits for before decoding the rest.
+
+ETHERNET = struct.Struct("!H")
+IPV4 = struct.Struct("!BxH5xB")
+PORTS = struct.Struct("!HH")
+TCP_FIELDS = struct.Struct("!IIBBHHH")
+
+ETHERTYPE_IP = 0x0800
+ETHERTYPE_VLAN = 0x8100
+PROTOCOL_TCP = 6
+
+
+class Segment:
+    def __init__(self, frame: memoryview, tcp: int, end: int, sourcePort: int, destinationPort: int):
+        self.frame: memoryview = frame
+        self.tcp: int = tcp
+        self.end: int = end
+        self.sourcePort: int = sourcePort
+        self.destinationPort: int = destinationPort
+
+    # Seq, ack, data offset, reserved bits, flags byte, window, checksum and urgent pointer.
+    def fields(self) -> tuple[int, int, int, int, int, int, int, int]:
+        seq, ack, offset, flags, window, checksum, urgentPointer = TCP_FIELDS.unpack_from(self.frame, self.tcp + 4)
+        return seq, ack, offset >> 4, offset & 0x0F, flags, window, checksum, urgentPointer
+
+    def payload(self) -> bytes:
+        start = self.tcp + (self.frame[self.tcp + 12] >> 4) * 4
+        return self.frame[start : self.end].tobytes() if start < self.end else b""
+
+
+# The TCP segment of an Ethernet frame, or None if the frame carries none.
+def decodeFrame(data: bytes) -> Optional[Segment]:
+    frame = memoryview(data)
+    ip = 14
+    if len(frame) < ip + 20:
+        return None
+    (ethertype,) = ETHERNET.unpack_from(frame, 12)
+    if ethertype == ETHERTYPE_VLAN:
+        ip += 4
+        (ethertype,) = ETHERNET.unpack_from(frame, 16)
+    if ethertype != ETHERTYPE_IP or len(frame) < ip + 20:
+        return None
+    versionLength, totalLength, protocol = IPV4.unpack_from(frame, ip)
+    if versionLength >> 4 != 4 or protocol != PROTOCOL_TCP:
+        return None
+    tcp = ip + (versionLength & 0x0F) * 4
+    # A total length of 0 is left by TCP segmentation offload. Ethernet padding lies beyond the total length.
+    end = min(ip + totalLength, len(frame)) if totalLength != 0 else len(frame)
+    if end < tcp + 20:
+        return None
+    sourcePort, destinationPort = PORTS.unpack_from(frame, tcp)
+    return Segment(frame, tcp, end, sourcePort, destinationPort)
@@ -0,0 +1,498 @@
+import functools
+import random
+import re
+from typing import Any, Callable, Optional
+
+# In-process replacement for the Java mapper (Mapper/src/Mapper.java): an interpreter for the invlang .map format,
+# compiled to Python closures, and the concretization logic of the Java mapper on top of it.
+
+NOT_SET = -3
+
+DEFAULT_MAP = "/code/Mapper/resources/linux.map"
+
+# invlang flags by acronym, in the order of the invlang Flag enum.
+FLAGS = {"A": "ACK", "P": "PSH", "R": "RST", "S": "SYN", "F": "FIN"}
+FLAG_ORDER = {name: index for index, name in enumerate(FLAGS.values())}
+
+Flags = frozenset[str]
+# Enum values are (enum type, value) pairs.
+EnumValue = tuple[str, str]
+State = dict[str, Any]
+Expression = Callable[[State, dict[str, Any]], Any]
+Statement = Callable[[State, dict[str, Any], dict[str, Any]], None]
+
+
+class InvlangError(ValueError):
+    pass
+
+
+# Java int overflow.
+def wrap(value: int) -> int:
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+def unsigned(value: int) -> int:
+    return value & 0xFFFFFFFF
+
+
+def parseFlags(flags: str) -> Flags:
+    names = []
+    for name in flags.split("+") if flags != "" else []:
+        name = name.upper()
+        if name not in FLAG_ORDER:
+            raise InvlangError("cannot parse string '" + name + "' as flag")
+        if name in names:
+            raise InvlangError("duplicate flag in string '" + flags + "': '" + name + "'")
+        names.append(name)
+    return frozenset(names)
+
+
+def flagsFromAcronyms(acronyms: str) -> Flags:
+    names = []
+    for acronym in acronyms:
+        if acronym not in FLAGS:
+            raise InvlangError("No flag named '" + acronym + "'")
+        names.append(FLAGS[acronym])
+    return frozenset(names)
+
+
+# As printed by invlang, e.g. "ACK+SYN".
+def flagsToString(flags: Flags) -> str:
+    return "+".join(sorted(flags, key=FLAG_ORDER.__getitem__))
+
+
+# As printed by the serializer of the Java mapper, which sorts by name.
+def serializeFlags(flags: Flags) -> str:
+    return "+".join(sorted(flags))
+
+
+def javaDivide(left: int, right: int) -> int:
+    if right == 0:
+        raise ZeroDivisionError("/ by zero")
+    quotient = abs(left) // abs(right)
+    return wrap(quotient if (left >= 0) == (right >= 0) else -quotient)
+
+
+TOKEN = re.compile(
+    r"\s+|//[^\n]*|/\*.*?\*/|(?P<flags>\$[A-Za-z]*)|(?P<int>[0-9]+)|(?P<id>[A-Za-z_][A-Za-z0-9_]*)|(?P<op>->|==|!=|[;=(),{}.+\-*/|&!])",
+    re.DOTALL,
+)
+
+# Binary operators with their precedence and the minimum precedence of their right operand, as in the invlang grammar.
+# Higher binds tighter, so "+" binds tighter than "*", and "+" and "-" are right associative.
+BINARY = {
+    "+": (8, 8),
+    "-": (8, 8),
+    "*": (7, 8),
+    "/": (7, 8),
+    "has": (6, 7),
+    "|": (5, 6),
+    "&": (4, 5),
+    "==": (3, 4),
+    "!=": (3, 4),
+}
+
+TYPES = ["int", "bool", "flags"]
+
+
+class Mapping:
+    def __init__(self, name: str, arguments: dict[str, str], results: dict[str, str], body: Statement, update: Statement):
+        self.name: str = name
+        self.arguments: dict[str, str] = arguments
+        self.results: dict[str, str] = results
+        self.body: Statement = body
+        self.update: Statement = update
+
+
+class Program:
+    def __init__(self, enums: dict[str, list[str]], initialState: State, mappings: dict[str, Mapping]):
+        self.enums: dict[str, list[str]] = enums
+        self.initialState: State = initialState
+        self.mappings: dict[str, Mapping] = mappings
+
+    def initial(self) -> State:
+        return dict(self.initialState)
+
+    # Runs a mapping on the state, and by default its update too. Returns the results of the mapping.
+    def execute(self, state: State, name: str, arguments: dict[str, Any], update: bool = True) -> dict[str, Any]:
+        mapping = self.mappings.get(name)
+        if mapping is None:
+            raise InvlangError("Cannot find mapping " + name)
+        if arguments.keys() != mapping.arguments.keys():
+            raise InvlangError("Program executed with wrong arguments " + str(sorted(arguments)))
+        results: dict[str, Any] = dict()
+        mapping.body(state, arguments, results)
+        if update:
+            mapping.update(state, {**arguments, **results}, state)
+        return results
+
+
+class Parser:
+    def __init__(self, source: str):
+        self.tokens: list[tuple[str, str]] = []
+        position = 0
+        while position < len(source):
+            match = TOKEN.match(source, position)
+            if match is None:
+                raise InvlangError("Unexpected character " + repr(source[position]) + " at offset " + str(position))
+            if match.lastgroup is not None:
+                self.tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+        self.position = 0
+        self.enums: dict[str, list[str]] = dict()
+        self.stateTypes: dict[str, str] = dict()
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.position][1] if self.position < len(self.tokens) else None
+
+    def next(self) -> tuple[str, str]:
+        if self.position >= len(self.tokens):
+            raise InvlangError("Unexpected end of mapper")
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def expect(self, text: str) -> None:
+        kind, value = self.next()
+        if value != text:
+            raise InvlangError("Expected '" + text + "' but got '" + value + "'")
+
+    def identifier(self) -> str:
+        kind, value = self.next()
+        if kind != "id":
+            raise InvlangError("Expected an identifier but got '" + value + "'")
+        return value
+
+    def type(self) -> str:
+        name = self.identifier()
+        if name not in TYPES and name not in self.enums:
+            raise InvlangError("Unknown type '" + name + "'")
+        return name
+
+    def program(self) -> Program:
+        initialState: State = dict()
+        mappings: dict[str, Mapping] = dict()
+        while self.peek() is not None:
+            section = self.identifier()
+            if section == "ENUM":
+                name = self.identifier()
+                self.expect("{")
+                values = [self.identifier()]
+                while self.peek() == ",":
+                    self.next()
+                    values.append(self.identifier())
+                self.expect("}")
+                self.enums[name] = values
+            elif section == "STATE":
+                while self.peek() not in ["ENUM", "STATE", "MAP", None]:
+                    type = self.type()
+                    name = self.identifier()
+                    self.expect("=")
+                    value = self.expression(lambda variable: lambda state, parameters: initialState[variable])(initialState, dict())
+                    self.expect(";")
+                    self.stateTypes[name] = type
+                    initialState[name] = value
+            elif section == "MAP":
+                mapping = self.mapping()
+                mappings[mapping.name] = mapping
+            else:
+                raise InvlangError("Unexpected '" + section + "'")
+        return Program(self.enums, initialState, mappings)
+
+    def mapping(self) -> Mapping:
+        name = self.identifier()
+        self.expect("(")
+        arguments = self.declarations("->")
+        self.expect("->")
+        results = self.declarations(")")
+        self.expect(")")
+        parameters = set(arguments) | set(results)
+
+        # The body sees the state and the arguments, the state taking precedence.
+        def bodyVariable(variable: str) -> Expression:
+            if variable in self.stateTypes:
+                return lambda state, values: state[variable]
+            if variable in arguments:
+                return lambda state, values: values[variable]
+            raise InvlangError("variable '" + variable + "' not defined in " + name)
+
+        # The update also sees the results, and the parameters take precedence over the state.
+        def updateVariable(variable: str) -> Expression:
+            if variable in parameters:
+                return lambda state, parameters: parameters[variable]
+            if variable in self.stateTypes:
+                return lambda state, parameters: state[variable]
+            raise InvlangError("variable '" + variable + "' not defined in update of " + name)
+
+        body = self.statements(bodyVariable, ["UPDATE"])
+        self.expect("UPDATE")
+        update = self.statements(updateVariable, ["MAP", None])
+        return Mapping(name, arguments, results, body, update)
+
+    def declarations(self, end: str) -> dict[str, str]:
+        declarations: dict[str, str] = dict()
+        while self.peek() != end:
+            if len(declarations) > 0:
+                self.expect(",")
+            type = self.type()
+            declarations[self.identifier()] = type
+        return declarations
+
+    def statements(self, variable: Callable[[str], Expression], ends: list[Optional[str]]) -> Statement:
+        statements: list[Statement] = []
+        while self.peek() not in ends:
+            statements.append(self.statement(variable))
+
+        def run(state: State, parameters: dict[str, Any], target: dict[str, Any]) -> None:
+            for statement in statements:
+                statement(state, parameters, target)
+
+        return run
+
+    def statement(self, variable: Callable[[str], Expression]) -> Statement:
+        if self.peek() == "if":
+            self.next()
+            self.expect("(")
+            condition = self.expression(variable)
+            self.expect(")")
+            self.expect("{")
+            then = self.statements(variable, ["}"])
+            self.expect("}")
+            self.expect("else")
+            self.expect("{")
+            otherwise = self.statements(variable, ["}"])
+            self.expect("}")
+
+            def branch(state: State, parameters: dict[str, Any], target: dict[str, Any]) -> None:
+                if condition(state, parameters):
+                    then(state, parameters, target)
+                else:
+                    otherwise(state, parameters, target)
+
+            return branch
+        name = self.identifier()
+        self.expect("=")
+        value = self.expression(variable)
+        self.expect(";")
+
+        def assign(state: State, parameters: dict[str, Any], target: dict[str, Any]) -> None:
+            target[name] = value(state, parameters)
+
+        return assign
+
+    def expression(self, variable: Callable[[str], Expression], minimum: int = 0) -> Expression:
+        left = self.operand(variable)
+        while True:
+            operator = self.peek()
+            if operator not in BINARY or BINARY[operator][0] < minimum:
+                return left
+            self.next()
+            right = self.expression(variable, BINARY[operator][1])
+            left = binary(operator, left, right)
+
+    def operand(self, variable: Callable[[str], Expression]) -> Expression:
+        kind, value = self.next()
+        if value == "(":
+            inner = self.expression(variable)
+            self.expect(")")
+            return inner
+        if value == "!":
+            # The operand of a unary operator extends over all binary operators.
+            negated = self.expression(variable, 2)
+            return lambda state, parameters: not negated(state, parameters)
+        if value == "-":
+            minus = self.expression(variable, 2)
+            return lambda state, parameters: wrap(-minus(state, parameters))
+        if kind == "int":
+            number = wrap(int(value))
+            return lambda state, parameters: number
+        if kind == "flags":
+            flags = flagsFromAcronyms(value[1:])
+            return lambda state, parameters: flags
+        if kind == "id":
+            if value in ["true", "false"]:
+                boolean = value == "true"
+                return lambda state, parameters: boolean
+            if self.peek() == "." and value in self.enums:
+                self.next()
+                member = self.identifier()
+                if member not in self.enums[value]:
+                    raise InvlangError("Unknown enum '" + value + "." + member + "'")
+                enumValue: EnumValue = (value, member)
+                return lambda state, parameters: enumValue
+            return variable(value)
+        raise InvlangError("Unexpected '" + value + "' in expression")
+
+
+def binary(operator: str, left: Expression, right: Expression) -> Expression:
+    if operator == "+":
+        return lambda state, parameters: wrap(left(state, parameters) + right(state, parameters))
+    if operator == "-":
+        return lambda state, parameters: wrap(left(state, parameters) - right(state, parameters))
+    if operator == "*":
+        return lambda state, parameters: wrap(left(state, parameters) * right(state, parameters))
+    if operator == "/":
+        return lambda state, parameters: javaDivide(left(state, parameters), right(state, parameters))
+    if operator == "has":
+        return lambda state, parameters: left(state, parameters) >= right(state, parameters)
+    if operator == "|":
+        return lambda state, parameters: left(state, parameters) or right(state, parameters)
+    if operator == "&":
+        return lambda state, parameters: left(state, parameters) and right(state, parameters)
+    if operator == "==":
+        return lambda state, parameters: left(state, parameters) == right(state, parameters)
+    return lambda state, parameters: left(state, parameters) != right(state, parameters)
+
+
+def parse(source: str) -> Program:
+    return Parser(source).program()
+
+
+@functools.lru_cache(maxsize=None)
+def load(path: str) -> Program:
+    with open(path, "r") as stream:
+        return parse(stream.read())
+
+
+# Position of a key in the iteration order of a java.util.HashMap with 16 buckets, which is the order in which
+# the Java mapper visits state variables when looking for points of interest.
+def javaBucket(key: str) -> int:
+    hash = 0
+    for character in key:
+        hash = (31 * hash + ord(character)) & 0xFFFFFFFF
+    return (hash ^ (hash >> 16)) & 15
+
+
+def randWithinRange(low: int, high: int) -> int:
+    return (int(random.random() * (high - low) + 0.5) + low) % 0x100000000
+
+
+SYMBOL = re.compile(r"([A-Z+]+)\(([0-9?]+),([0-9?]+),([0-9?]+)\)")
+# The reply to a command without a valid symbol, as the Java mapper gives it.
+ERROR = "ERROR"
+
+VALID: EnumValue = ("absin", "VALID")
+
+
+# Mirrors Mapper.java, including its commands, with the state kept in Python.
+class InvlangMapper:
+    def __init__(self, path: str = DEFAULT_MAP):
+        self.program: Program = load(path)
+        self.state: State = self.program.initial()
+        # Stable, so variables in the same bucket stay in declaration order.
+        self.interestOrder: list[str] = sorted(self.program.initialState, key=javaBucket)
+
+    def processOutgoingReset(self) -> str:
+        return "RST(" + str(unsigned(self.state["learnerSeq"])) + ",0,0)"
+
+    def sendReset(self) -> None:
+        self.state = self.program.initial()
+
+    # Starts from the given signed draws for the sequence and acknowledgement numbers, or fresh random ones.
+    def processOutgoingRequest(self, flags: Flags, payloadLength: int, concSeq: Optional[int] = None, concAck: Optional[int] = None) -> str:
+        if concSeq is None:
+            lastLearnerSeq = self.state["lastLearnerSeq"]
+            if lastLearnerSeq == NOT_SET:
+                concSeq = wrap(randWithinRange(1000, 0xFFFF))
+            else:
+                concSeq = wrap(lastLearnerSeq + randWithinRange(70000, 100000))
+        if concAck is None:
+            concAck = wrap(randWithinRange(1000, 0xFFFF))
+        checked = False
+        if self.isValid(flags, concSeq, concAck, payloadLength):
+            checked = True
+        else:
+            pointsOfInterest = self.pointsOfInterest()
+            for possibleAck in pointsOfInterest:
+                if self.isValid(flags, concSeq, possibleAck, payloadLength):
+                    concAck = possibleAck
+                    checked = True
+                    break
+            for possibleSeq in pointsOfInterest:
+                if self.isValid(flags, possibleSeq, concAck, payloadLength):
+                    concSeq = possibleSeq
+                    checked = True
+                    break
+            # Only the inner loop breaks, so the last sequence number with a valid acknowledgement number wins.
+            for possibleSeq in pointsOfInterest:
+                for possibleAck in pointsOfInterest:
+                    if self.isValid(flags, possibleSeq, possibleAck, payloadLength):
+                        concSeq = possibleSeq
+                        concAck = possibleAck
+                        checked = True
+                        break
+        if not checked:
+            raise InvlangError("Cannot concretize the input for the windows mapper: " + str(self.state))
+        self.program.execute(self.state, "outgoingRequest", self.outgoingArguments(flags, concSeq, concAck, payloadLength))
+        return serializeFlags(flags) + "(" + str(unsigned(concSeq)) + "," + str(unsigned(concAck)) + "," + str(payloadLength) + ")"
+
+    def processIncomingResponse(self, flags: Flags, seq: int, ack: int, payloadLength: int) -> str:
+        arguments = {"flagsIn": flags, "concDataIn": payloadLength, "concSeqIn": wrap(seq), "concAckIn": wrap(ack)}
+        results = self.program.execute(self.state, "incomingResponse", arguments)
+        return serializeFlags(flags) + "(" + results["absSeqIn"][1] + "," + results["absAckIn"][1] + "," + str(payloadLength) + ")"
+
+    def outgoingArguments(self, flags: Flags, concSeq: int, concAck: int, payloadLength: int) -> dict[str, Any]:
+        return {"flagsOut": flags, "concSeqOut": concSeq, "concAckOut": concAck, "concDataOut": payloadLength}
+
+    def isValid(self, flags: Flags, concSeq: int, concAck: int, payloadLength: int) -> bool:
+        results = self.program.execute(self.state, "outgoingRequest", self.outgoingArguments(flags, concSeq, concAck, payloadLength), False)
+        return results["absSeqOut"] == VALID and results["absAckOut"] == VALID
+
+    # Every set integer of the state and its successor, as unsigned numbers without wrapping, then 0.
+    # Like the Java mapper, an integer that is already a point of interest is skipped, successor included.
+    def pointsOfInterest(self) -> list[int]:
+        values: list[int] = []
+        for name in self.interestOrder:
+            value = self.state[name]
+            if isinstance(value, int) and not isinstance(value, bool) and value != NOT_SET and value not in values:
+                for i in range(2):
+                    if unsigned(value) + i not in values:
+                        values.append(unsigned(value) + i)
+        values.append(0)
+        return list(map(wrap, values))
+
+    def stateToString(self) -> str:
+        pairs = []
+        for name in sorted(self.state):
+            value = self.state[name]
+            if isinstance(value, frozenset):
+                value = flagsToString(value)
+            elif isinstance(value, tuple):
+                value = value[0] + "." + value[1]
+            elif isinstance(value, bool):
+                value = "true" if value else "false"
+            pairs.append(name + "=" + str(value))
+        return " ".join(pairs)
+
+    # Answers a command of the Java mapper's pipe protocol with the lines it would print.
+    def handle(self, command: str) -> list[str]:
+        if command == "RESET":
+            lines = [self.processOutgoingReset()]
+            self.sendReset()
+            return lines
+        elif command == "STOP":
+            return []
+        elif command == "STATE":
+            return [self.stateToString()]
+        request = command.split(" ")
+        if request[0] == "CONCRETIZE":
+            match = SYMBOL.fullmatch(request[3]) if len(request) == 4 else None
+            if match is None:
+                return [ERROR]
+            return [self.concretize(match, wrap(int(request[1])), wrap(int(request[2])))]
+        lines = []
+        for match in SYMBOL.finditer(command):
+            if request[0] == "ABSTRACT":
+                lines.append(self.concretize(match))
+            elif request[0] == "CONCRETE":
+                flags = parseFlags(match.group(1))
+                lines.append(self.processIncomingResponse(flags, int(match.group(2)), int(match.group(3)), int(match.group(4))))
+            else:
+                raise InvlangError("Got invalid request type: " + request[0])
+        return lines if len(lines) > 0 else [ERROR]
+
+    def concretize(self, match: re.Match, concSeq: Optional[int] = None, concAck: Optional[int] = None) -> str:
+        if match.group(1) == "RST":
+            return self.processOutgoingReset()
+        payloadLength = int(match.group(4)) if match.group(4) != "?" else 0
+        return self.processOutgoingRequest(parseFlags(match.group(1)), payloadLength, concSeq, concAck)
@@ -0,0 +1,102 @@
+import math
+from collections import deque
+from typing import Optional
+
+# Keys are (abstract input, state) pairs. The state is the previous abstract output of the query,
+# so that e.g. an ACK after a SYN+ACK is tracked separately from an ACK in a closed connection.
+Key = tuple[Optional[str], Optional[str]]
+
+GLOBAL_KEY: Key = (None, None)
+
+
+class LatencyEstimator:
+    def __init__(
+        self,
+        ceiling: float,
+        window: int = 200,
+        percentile: float = 0.99,
+        factor: float = 2.0,
+        margin: float = 0.005,
+        minimum: float = 0.01,
+        minSamples: int = 20,
+        cooldown: int = 50,
+    ):
+        self.ceiling: float = ceiling
+        self.window: int = window
+        self.percentile: float = percentile
+        self.factor: float = factor
+        self.margin: float = margin
+        self.minimum: float = minimum
+        self.minSamples: int = minSamples
+        self.cooldown: int = cooldown
+        self.samples: dict[Key, deque[float]] = dict()
+        # Estimates by key, kept until the next sample of the key, so that a lookup does not sort the window.
+        self.estimates: dict[Key, Optional[float]] = dict()
+        # Number of remaining lookups for which a key falls back to the ceiling after an outlier.
+        self.fallbacks: dict[Key, int] = dict()
+        self.outliers: int = 0
+
+    def keysFor(self, input: str, state: Optional[str]) -> list[Key]:
+        return [(input, state), (input, None), GLOBAL_KEY]
+
+    def quantile(self, samples: deque[float]) -> float:
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, math.ceil(self.percentile * len(ordered)) - 1)]
+
+    def estimate(self, key: Key) -> Optional[float]:
+        if key in self.estimates:
+            return self.estimates[key]
+        samples = self.samples.get(key)
+        estimate = None
+        if samples is not None and len(samples) >= self.minSamples:
+            estimate = min(self.ceiling, max(self.minimum, self.quantile(samples) * self.factor + self.margin))
+        self.estimates[key] = estimate
+        return estimate
+
+    def timeoutFor(self, input: str, state: Optional[str]) -> float:
+        for key in self.keysFor(input, state):
+            remaining = self.fallbacks.get(key, 0)
+            if remaining > 0:
+                self.fallbacks[key] = remaining - 1
+                return self.ceiling
+            estimate = self.estimate(key)
+            if estimate is not None:
+                return estimate
+        return self.ceiling
+
+    def record(self, input: str, state: Optional[str], latency: float) -> None:
+        isOutlier = False
+        for key in self.keysFor(input, state):
+            estimate = self.estimate(key)
+            if estimate is not None and latency > estimate:
+                self.fallbacks[key] = self.cooldown
+                isOutlier = True
+            samples = self.samples.get(key)
+            if samples is None:
+                samples = deque(maxlen=self.window)
+                self.samples[key] = samples
+            samples.append(latency)
+            self.estimates.pop(key, None)
+        if isOutlier:
+            self.outliers += 1
+
+    # A response showed up after a shrunk window had already expired.
+    def recordLate(self, input: str, state: Optional[str]) -> None:
+        for key in self.keysFor(input, state):
+            self.fallbacks[key] = self.cooldown
+        self.outliers += 1
+
+    def report(self) -> dict:
+        estimates = []
+        for (input, state), samples in self.samples.items():
+            estimates.append(
+                {
+                    "input": input,
+                    "state": state,
+                    "samples": len(samples),
+                    "quantile": self.quantile(samples),
+                    "timeout": self.estimate((input, state)) or self.ceiling,
+                    "fallback": self.fallbacks.get((input, state), 0),
+                }
+            )
+        return {"ceiling": self.ceiling, "outliers": self.outliers, "estimates": estimates}
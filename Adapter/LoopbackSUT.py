@@ -0,0 +1,108 @@
+import random
+import threading
+from typing import Optional
+
+from FrameDecoder import decodeFrame
+from Tracker import SocketCapture
+from Transmitter import Transmitter
+
+# A stand-in TCP server for benchmarks, answering on a loopback interface from user space. Segments are sent as
+# Ethernet broadcasts, like those of the adapter's transmitter on loopback, which the kernel's TCP drops as not meant
+# for the host. So neither the kernel nor an iptables rule gets in the way of either side, and every run sees the
+# same SUT. The state machine covers what learning queries exercise: the handshake, data, FIN and RST.
+
+FIN = 0x01
+SYN = 0x02
+RST = 0x04
+ACK = 0x10
+
+SYN_RECEIVED = "SYN_RECEIVED"
+ESTABLISHED = "ESTABLISHED"
+LAST_ACK = "LAST_ACK"
+
+
+class Connection:
+    def __init__(self, sendNext: int, receiveNext: int):
+        self.state: str = SYN_RECEIVED
+        self.sendNext: int = sendNext
+        self.receiveNext: int = receiveNext
+
+
+class LoopbackSUT(threading.Thread):
+    def __init__(self, address: str = "127.0.0.1", port: int = 4444, interface: str = "lo", seed: Optional[int] = None):
+        super(LoopbackSUT, self).__init__(name="Loopback SUT", daemon=True)
+        self.port: int = port
+        self.random = random.Random(seed)
+        self.capture = SocketCapture(interface, 1024, 10)
+        self.capture.setfilter("tcp and dst host " + address + " and dst port " + str(port))
+        self.transmitter = Transmitter(address, address, interface, "raw")
+        # Connections by port of the peer.
+        self.connections: dict[int, Connection] = dict()
+        self.stopped = threading.Event()
+        self.received: int = 0
+        self.sent: int = 0
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            self.capture.dispatch(self.handle)
+        self.capture.close()
+        self.transmitter.stop()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+    def handle(self, _, data: bytes) -> None:
+        segment = decodeFrame(data)
+        if segment is None or segment.destinationPort != self.port:
+            return
+        self.received += 1
+        seq, ack, _, _, flags, _, _, _ = segment.fields()
+        reply = self.respond(segment.sourcePort, seq, ack, flags, len(segment.payload()))
+        if reply is not None:
+            replySeq, replyAck, replyFlags = reply
+            self.transmitter.sendSegment(self.port, segment.sourcePort, replySeq & 0xFFFFFFFF, replyAck & 0xFFFFFFFF, replyFlags, b"")
+            self.sent += 1
+
+    # The seq, ack and flags of the answer to a segment from the peer, if any.
+    def respond(self, peer: int, seq: int, ack: int, flags: int, length: int) -> Optional[tuple[int, int, int]]:
+        connection = self.connections.get(peer)
+        if flags & RST:
+            self.connections.pop(peer, None)
+            return None
+        if connection is None:
+            if flags & ACK:
+                return ack, 0, RST
+            if flags & SYN:
+                initial = self.random.randrange(1 << 32)
+                self.connections[peer] = Connection(initial + 1, seq + 1)
+                return initial, seq + 1, SYN | ACK
+            return None
+        if flags & SYN:
+            # A challenge ACK, as in RFC 5961.
+            return connection.sendNext, connection.receiveNext, ACK
+        if not flags & ACK:
+            return None
+        if connection.state == SYN_RECEIVED:
+            if ack != connection.sendNext & 0xFFFFFFFF:
+                return ack, 0, RST
+            connection.state = ESTABLISHED
+        if seq != connection.receiveNext & 0xFFFFFFFF:
+            return connection.sendNext, connection.receiveNext, ACK
+        if connection.state == LAST_ACK:
+            if ack == connection.sendNext & 0xFFFFFFFF:
+                del self.connections[peer]
+            return None
+        if length == 0 and not flags & FIN:
+            return None
+        connection.receiveNext += length
+        if not flags & FIN:
+            return connection.sendNext, connection.receiveNext, ACK
+        # The server application closes as soon as the peer does.
+        connection.receiveNext += 1
+        connection.state = LAST_ACK
+        connection.sendNext += 1
+        return connection.sendNext - 1, connection.receiveNext, ACK | FIN
+
+    def stats(self) -> dict:
+        return {"received": self.received, "sent": self.sent, "connections": len(self.connections)}
@@ -1,42 +1,405 @@
+import asyncio
+import os
+import queue
+import select
 import shlex
+import struct
 import subprocess
 import string
 import random
+import threading
+import time
 from typing import Optional
 
 from scapy.layers.inet import TCP
 from scapy.packet import Packet, Raw
 
-from AbstractSymbol import AbstractSymbol
+from AbstractSymbol import AbstractSymbol, toValue
 from ConcreteSymbol import ConcreteSymbol
+from Invlang import DEFAULT_MAP, ERROR, InvlangError, InvlangMapper
+from Metrics import Metrics
 
 import logging
 
-logging.basicConfig(level=logging.DEBUG, format="%(name)s: %(message)s")
 
+# Hands out source ports so that mappers sharing one SUT never use the same port pair at the same time.
+class SourcePorts:
+    def __init__(self, low: int = 1024, high: int = 65535):
+        self.low = low
+        self.high = high
+        self.inUse: set[int] = set()
+        self.lock = threading.Lock()
 
+    def acquire(self) -> int:
+        with self.lock:
+            while True:
+                port = random.randint(self.low, self.high)
+                if port not in self.inUse:
+                    self.inUse.add(port)
+                    return port
+
+    def release(self, port: int) -> None:
+        with self.lock:
+            self.inUse.discard(port)
+
+
+# Random letters that payloads are cut from, rather than drawing every letter of every payload.
+PAYLOAD_LETTERS: bytes = bytes(random.choice(string.ascii_letters.encode("ascii")) for _ in range(65536))
+
+JAVA_MAPPER = 'java -cp "/code/Mapper/dist/TCPMapper.jar:/code/Mapper/lib/*" Mapper'
+
+
+# Symbols of the framed protocol are comma separated fields: flag names and payload length for inputs,
+# flag names, seq, ack and payload length for responses, and flag initials, seq, ack and payload length in replies.
+def encodeInput(symbol: Optional[AbstractSymbol]) -> str:
+    if symbol is None:
+        return "-"
+    return symbol.flags.asHuman() + "," + (str(symbol.payloadLength) if symbol.payloadLength is not None else "?")
+
+
+def encodeResponse(symbol: Optional[ConcreteSymbol]) -> str:
+    if symbol is None:
+        return "-"
+    return symbol.flags.asHuman() + "," + str(symbol.seqNumber) + "," + str(symbol.ackNumber) + "," + str(len(symbol.payload))
+
+
+# Mapper requests are timed by their verb, e.g. ABSTRACT as mapperAbstract.
+def requestStage(request: str) -> str:
+    return "mapper" + request.split(" ", 1)[0].capitalize()
+
+
+def decodeSymbol(field: str) -> Optional[AbstractSymbol]:
+    if field == "-":
+        return None
+    flags, seq, ack, length = field.split(",")
+    return AbstractSymbol((flags, toValue(int(seq) if seq.isdigit() else seq), toValue(int(ack) if ack.isdigit() else ack), int(length)))
+
+
+class MapperError(RuntimeError):
+    pass
+
+
+# A JVM mapper process. Reads go straight to the pipe with a deadline, so a hung mapper raises a MapperError
+# instead of blocking its adapter forever.
+class MapperProcess:
+    def __init__(self, command: str, framed: bool, timeout: float):
+        self.framed: bool = framed
+        self.timeout: float = timeout
+        self.process: subprocess.Popen = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.buffer: bytes = b""
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def write(self, data: bytes) -> None:
+        assert self.process.stdin is not None
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError) as e:
+            raise MapperError("Could not write to the mapper process: " + str(e))
+
+    def fill(self, deadline: float) -> None:
+        assert self.process.stdout is not None
+        remaining = deadline - time.monotonic()
+        readable, _, _ = select.select([self.process.stdout], [], [], max(remaining, 0))
+        if len(readable) == 0:
+            raise MapperError("Mapper process did not answer within " + str(self.timeout) + "s.")
+        data = os.read(self.process.stdout.fileno(), 65536)
+        if data == b"":
+            raise MapperError("Mapper process closed its output.")
+        self.buffer += data
+
+    def request(self, line: str, timeout: Optional[float] = None) -> str:
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        self.write((line + "\n").encode("utf-8"))
+        while b"\n" not in self.buffer:
+            self.fill(deadline)
+        answer, _, self.buffer = self.buffer.partition(b"\n")
+        return answer.decode("utf-8")
+
+    def exchange(self, request: str, timeout: Optional[float] = None) -> str:
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        data = request.encode("utf-8")
+        self.write(struct.pack(">I", len(data)) + data)
+        while len(self.buffer) < 4:
+            self.fill(deadline)
+        (length,) = struct.unpack(">I", self.buffer[:4])
+        while len(self.buffer) < 4 + length:
+            self.fill(deadline)
+        answer, self.buffer = self.buffer[4 : 4 + length], self.buffer[4 + length :]
+        return answer.decode("utf-8")
+
+    # A command that leaves the mapper state untouched. The first one after start also waits out the JVM boot
+    # and the parse of the map file.
+    def ping(self, timeout: Optional[float] = None) -> bool:
+        try:
+            if self.framed:
+                return self.exchange("STEP - -", timeout) == "- -"
+            return self.request("STATE", timeout) != ""
+        except MapperError:
+            return False
+
+    def kill(self) -> None:
+        if self.alive():
+            self.process.kill()
+        self.process.wait()
+
+
+# Keeps size JVM mapper processes booted ahead of demand, so that adapters get a clean one instantly, both at startup
+# and when replacing a mapper that failed. Idle processes are pinged every checkInterval seconds, and replaced
+# when they do not answer. With size=0 processes are started on demand.
+class MapperPool:
+    def __init__(
+        self,
+        protocol: str = "line",
+        size: int = 2,
+        timeout: float = 5.0,
+        startTimeout: float = 60.0,
+        checkInterval: float = 10.0,
+        command: str = JAVA_MAPPER,
+    ):
+        self.framed: bool = protocol == "framed"
+        self.command: str = command + (" --framed" if self.framed else "")
+        self.size: int = size
+        self.timeout: float = timeout
+        self.startTimeout: float = startTimeout
+        self.checkInterval: float = checkInterval
+        self.ready: queue.Queue[MapperProcess] = queue.Queue()
+        self.wanted = threading.Event()
+        self.stopped = threading.Event()
+        self.logger = logging.getLogger("Mapper Pool")
+        self.started: int = 0
+        self.failed: int = 0
+        self.handedOut: int = 0
+        self.waited: int = 0
+        self.thread: Optional[threading.Thread] = None
+        if size > 0:
+            self.thread = threading.Thread(target=self.warm, name="Mapper Pool", daemon=True)
+            self.thread.start()
+
+    def spawn(self) -> Optional[MapperProcess]:
+        process = MapperProcess(self.command, self.framed, self.timeout)
+        self.started += 1
+        if process.ping(self.startTimeout):
+            return process
+        self.logger.warning("Mapper process did not come up, discarding it.")
+        self.failed += 1
+        process.kill()
+        return None
+
+    def warm(self) -> None:
+        while not self.stopped.is_set():
+            if self.ready.qsize() >= self.size:
+                if not self.wanted.wait(self.checkInterval):
+                    self.check()
+                self.wanted.clear()
+                continue
+            process = self.spawn()
+            if process is None:
+                # Do not spin on a mapper that cannot start at all.
+                self.stopped.wait(1.0)
+            elif self.stopped.is_set():
+                process.kill()
+            else:
+                self.ready.put(process)
+
+    def check(self) -> None:
+        for _ in range(self.ready.qsize()):
+            try:
+                process = self.ready.get_nowait()
+            except queue.Empty:
+                return
+            if process.ping():
+                self.ready.put(process)
+            else:
+                self.logger.warning("Idle mapper process failed its health check, replacing it.")
+                self.failed += 1
+                process.kill()
+
+    def acquire(self) -> MapperProcess:
+        while not self.stopped.is_set():
+            if self.size == 0:
+                process = self.spawn()
+                if process is None:
+                    raise MapperError("Could not start a mapper process.")
+                self.handedOut += 1
+                return process
+            try:
+                process = self.ready.get_nowait()
+            except queue.Empty:
+                self.waited += 1
+                self.wanted.set()
+                try:
+                    process = self.ready.get(timeout=self.startTimeout)
+                except queue.Empty:
+                    raise MapperError("No mapper process came up within " + str(self.startTimeout) + "s.")
+            self.wanted.set()
+            if process.alive():
+                self.handedOut += 1
+                return process
+            self.failed += 1
+            process.kill()
+        raise MapperError("Mapper pool is stopped.")
+
+    # Used processes are never handed out again, their state belongs to the adapter that used them.
+    def release(self, process: MapperProcess) -> None:
+        process.kill()
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "ready": self.ready.qsize(),
+            "started": self.started,
+            "failed": self.failed,
+            "handedOut": self.handedOut,
+            "waited": self.waited,
+        }
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.wanted.set()
+        if self.thread is not None:
+            self.thread.join()
+        while True:
+            try:
+                self.ready.get_nowait().kill()
+            except queue.Empty:
+                return
+
+
+# With engine="java" the mapper runs in a JVM and is talked to over pipes, with engine="python" the same
+# map file is interpreted in-process. With protocol="framed", the JVM is talked to in length-prefixed frames,
+# one per symbol, and resets are sent along with the first input after them. JVM processes come from the pool,
+# a private one without warm processes unless a shared one is given.
 class Mapper:
-    def __init__(self, impPort):
+    def __init__(
+        self,
+        impPort,
+        sourcePorts: Optional[SourcePorts] = None,
+        engine: str = "java",
+        mapFile: str = DEFAULT_MAP,
+        protocol: str = "line",
+        pool: Optional[MapperPool] = None,
+        metrics: Optional[Metrics] = None,
+    ):
         self.destinationPort = impPort
-        self.sourcePort: int = random.randint(1024, 65535)
+        self.metrics: Optional[Metrics] = metrics
+        self.sourcePorts: SourcePorts = sourcePorts if sourcePorts is not None else SourcePorts()
+        self.sourcePort: int = self.sourcePorts.acquire()
         self.logger = logging.getLogger("Mapper")
-        self.process: subprocess.Popen = subprocess.Popen(
-            shlex.split('java -cp "/code/Mapper/dist/TCPMapper.jar:/code/Mapper/lib/*" Mapper'),
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-        )
+        self.engine: Optional[InvlangMapper] = None
+        self.process: Optional[MapperProcess] = None
+        self.pool: Optional[MapperPool] = None
+        self.ownsPool: bool = False
+        if protocol not in ["line", "framed"]:
+            raise ValueError("Invalid mapper protocol:", protocol)
+        self.framed: bool = protocol == "framed" and engine == "java"
+        self.resetPending: bool = False
+        self.replaced: int = 0
+        if engine == "python":
+            self.engine = InvlangMapper(mapFile)
+        elif engine == "java":
+            if pool is not None and pool.framed != (protocol == "framed"):
+                raise ValueError("Mapper pool does not speak the", protocol, "protocol.")
+            self.ownsPool = pool is None
+            self.pool = pool if pool is not None else MapperPool(protocol, size=0)
+            self.process = self.pool.acquire()
+        else:
+            raise ValueError("Invalid mapper engine:", engine)
 
     def writeAndRead(self, input: str) -> str:
-        if self.process.stdin is not None and self.process.stdout is not None:
-            self.process.stdin.write(bytearray(input + "\n", "utf-8"))
-            self.process.stdin.flush()
-            return self.process.stdout.readline().decode("utf-8").rstrip("\n")
-        raise ValueError("Could not reach mapper process pipes.")
+        if self.engine is not None:
+            # Fails like a JVM whose mapper throws, so that the adapter replaces the engine and reruns the query.
+            try:
+                lines = self.engine.handle(input)
+            except InvlangError as e:
+                raise MapperError("Mapper engine failed: " + str(e))
+            reply = lines[0] if len(lines) > 0 else ERROR
+        elif self.process is not None:
+            reply = self.process.request(input)
+        else:
+            raise ValueError("Could not reach mapper process pipes.")
+        if reply == ERROR:
+            raise ValueError("Mapper has no answer to:", input)
+        return reply
+
+    def exchange(self, request: str) -> str:
+        if self.process is None:
+            raise ValueError("Could not reach mapper process pipes.")
+        return self.process.exchange(request)
+
+    # Swaps a failed or hung mapper process for a fresh one, on a new source port since the SUT still holds
+    # the connection of the old one. The state of the old process is lost, so the query has to be rerun.
+    def replace(self) -> None:
+        if self.engine is not None:
+            # The in-process engine is started over instead.
+            self.engine.sendReset()
+            self.replaced += 1
+            self.nextSourcePort()
+            return
+        if self.process is None or self.pool is None:
+            return
+        self.pool.release(self.process)
+        self.process = None
+        self.process = self.pool.acquire()
+        self.replaced += 1
+        self.resetPending = False
+        self.nextSourcePort()
+
+    def nextSourcePort(self) -> None:
+        previousPort = self.sourcePort
+        self.sourcePort = self.sourcePorts.acquire()
+        self.sourcePorts.release(previousPort)
+
+    # Abstracts the response to the previous input and concretizes the next input, either of which may be None.
+    # Over the framed protocol this is a single round trip.
+    def step(
+        self, response: Optional[ConcreteSymbol], input: Optional[AbstractSymbol]
+    ) -> tuple[Optional[AbstractSymbol], Optional[Packet]]:
+        return self.stepResult(response, input, [self.send(request) for request in self.stepRequests(response, input)])
+
+    def send(self, request: str) -> str:
+        start = time.perf_counter()
+        reply = self.exchange(request) if self.framed else self.writeAndRead(request)
+        if self.metrics is not None:
+            self.metrics.record(requestStage(request), time.perf_counter() - start)
+        return reply
+
+    # The requests of a step, which AsyncMapper sends without blocking.
+    def stepRequests(self, response: Optional[ConcreteSymbol], input: Optional[AbstractSymbol]) -> list[str]:
+        requests = []
+        if not self.framed:
+            if response is not None:
+                requests.append("CONCRETE " + str(response))
+            if input is not None:
+                requests.append("ABSTRACT " + str(input))
+        elif self.resetPending and response is None and input is not None:
+            requests.append("RESET " + encodeInput(input))
+        elif response is not None or input is not None:
+            if self.resetPending:
+                requests.append("RESET -")
+            requests.append("STEP " + encodeResponse(response) + " " + encodeInput(input))
+        return requests
+
+    def stepResult(
+        self, response: Optional[ConcreteSymbol], input: Optional[AbstractSymbol], replies: list[str]
+    ) -> tuple[Optional[AbstractSymbol], Optional[Packet]]:
+        if not self.framed:
+            abstract = AbstractSymbol(replies[0]) if response is not None else None
+            packet = self.toPacket(AbstractSymbol(replies[-1])) if input is not None else None
+            return abstract, packet
+        if len(replies) == 0:
+            return None, None
+        self.resetPending = False
+        abstract, concrete = replies[-1].split(" ")
+        concreteSymbol = decodeSymbol(concrete)
+        return decodeSymbol(abstract), self.toPacket(concreteSymbol) if concreteSymbol is not None else None
 
     def abstractToConcrete(self, symbol: AbstractSymbol) -> Optional[Packet]:
-        out = self.writeAndRead("ABSTRACT " + str(symbol))
-        abs = AbstractSymbol(out)
+        return self.toPacket(AbstractSymbol(self.writeAndRead("ABSTRACT " + str(symbol))))
 
+    def toPacket(self, abs: AbstractSymbol) -> Optional[Packet]:
         if abs.seqNumber is None or abs.ackNumber is None:
             return None
 
@@ -61,15 +424,138 @@ class Mapper:
         out = self.writeAndRead("CONCRETE " + str(symbol))
         return AbstractSymbol(out)
 
-    def randomPayload(self, size: int) -> str:
-        payload = ""
-        for _ in range(size):
-            payload += random.choice(string.ascii_letters)
-        return payload
+    def randomPayload(self, size: int) -> bytes:
+        if size > len(PAYLOAD_LETTERS):
+            return (PAYLOAD_LETTERS * (size // len(PAYLOAD_LETTERS) + 1))[:size]
+        start = random.randrange(len(PAYLOAD_LETTERS) - size + 1)
+        return PAYLOAD_LETTERS[start : start + size]
 
     def reset(self):
-        self.sourcePort = random.randint(1024, 65535)
-        self.writeAndRead("RESET")
+        self.nextSourcePort()
+        if self.framed:
+            self.resetPending = True
+        else:
+            try:
+                self.send("RESET")
+            except MapperError as e:
+                # A fresh process is as clean as a reset one.
+                self.logger.warning("Mapper failed to reset (" + str(e) + "), replacing it.")
+                self.replace()
 
     def stop(self) -> None:
-        self.process.kill()
+        self.sourcePorts.release(self.sourcePort)
+        if self.process is not None and self.pool is not None:
+            self.pool.release(self.process)
+        if self.ownsPool and self.pool is not None:
+            self.pool.stop()
+
+
+# The pipes of a mapper process as asyncio streams, so that one event loop waits on many mappers at once. The process
+# comes booted from the pool, and is only read through the streams from then on.
+class AsyncMapperProcess:
+    def __init__(self, process: MapperProcess):
+        self.process: MapperProcess = process
+        self.reader: asyncio.StreamReader = asyncio.StreamReader()
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.readTransport: Optional[asyncio.ReadTransport] = None
+
+    async def open(self) -> None:
+        loop = asyncio.get_running_loop()
+        # Whatever the reads of the ping left behind.
+        self.reader.feed_data(self.process.buffer)
+        self.process.buffer = b""
+        self.readTransport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(self.reader), self.process.process.stdout)
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, self.process.process.stdin)
+        self.writer = asyncio.StreamWriter(transport, protocol, self.reader, loop)
+
+    async def write(self, data: bytes) -> None:
+        if self.writer is None:
+            raise MapperError("Mapper process pipes are not open.")
+        try:
+            self.writer.write(data)
+            await self.writer.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise MapperError("Could not write to the mapper process: " + str(e))
+
+    async def read(self, read) -> bytes:
+        try:
+            return await asyncio.wait_for(read, timeout=self.process.timeout)
+        except asyncio.TimeoutError:
+            raise MapperError("Mapper process did not answer within " + str(self.process.timeout) + "s.")
+        except asyncio.IncompleteReadError:
+            raise MapperError("Mapper process closed its output.")
+
+    async def request(self, line: str) -> str:
+        await self.write((line + "\n").encode("utf-8"))
+        answer = await self.read(self.reader.readline())
+        if not answer.endswith(b"\n"):
+            raise MapperError("Mapper process closed its output.")
+        return answer[:-1].decode("utf-8")
+
+    async def exchange(self, request: str) -> str:
+        data = request.encode("utf-8")
+        await self.write(struct.pack(">I", len(data)) + data)
+        (length,) = struct.unpack(">I", await self.read(self.reader.readexactly(4)))
+        return (await self.read(self.reader.readexactly(length))).decode("utf-8")
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.readTransport is not None:
+            self.readTransport.close()
+            self.readTransport = None
+
+
+# Drives a Mapper from an event loop. Mapper requests are the same, but JVM processes are talked to through
+# AsyncMapperProcess. The python engine runs in-process and answers right away.
+class AsyncMapper:
+    def __init__(self, mapper: Mapper):
+        self.mapper: Mapper = mapper
+        self.process: Optional[AsyncMapperProcess] = None
+
+    async def open(self) -> None:
+        if self.mapper.process is not None:
+            self.process = AsyncMapperProcess(self.mapper.process)
+            await self.process.open()
+
+    async def send(self, request: str) -> str:
+        if self.process is None:
+            return self.mapper.send(request)
+        start = time.perf_counter()
+        if self.mapper.framed:
+            reply = await self.process.exchange(request)
+        else:
+            reply = await self.process.request(request)
+        if self.mapper.metrics is not None:
+            self.mapper.metrics.record(requestStage(request), time.perf_counter() - start)
+        return reply
+
+    async def step(
+        self, response: Optional[ConcreteSymbol], input: Optional[AbstractSymbol]
+    ) -> tuple[Optional[AbstractSymbol], Optional[Packet]]:
+        replies = [await self.send(request) for request in self.mapper.stepRequests(response, input)]
+        return self.mapper.stepResult(response, input, replies)
+
+    # See Mapper.replace(). Taking a process from the pool may wait for one to boot, so it runs off the loop.
+    async def replace(self) -> None:
+        self.close()
+        await asyncio.to_thread(self.mapper.replace)
+        await self.open()
+
+    async def reset(self) -> None:
+        self.mapper.nextSourcePort()
+        if self.mapper.framed:
+            self.mapper.resetPending = True
+            return
+        try:
+            await self.send("RESET")
+        except MapperError as e:
+            self.mapper.logger.warning("Mapper failed to reset (" + str(e) + "), replacing it.")
+            await self.replace()
+
+    # The Mapper itself is stopped by its adapter.
+    def close(self) -> None:
+        if self.process is not None:
+            self.process.close()
+            self.process = None
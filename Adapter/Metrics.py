@@ -0,0 +1,138 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# Upper bounds of the histogram buckets in seconds, doubling from 8us to about 134s. Anything slower lands in +Inf.
+BOUNDS: list[float] = [0.000008 * 2**exponent for exponent in range(25)]
+
+
+# Counts of durations by bucket. Recording is a bisect and three additions under a lock, cheap enough for every
+# segment of every query.
+class Histogram:
+    def __init__(self):
+        self.counts: list[int] = [0] * (len(BOUNDS) + 1)
+        self.count: int = 0
+        self.sum: float = 0.0
+        self.max: float = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        bucket = bisect.bisect_left(BOUNDS, seconds)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    # The upper bound of the bucket the quantile falls in, or the maximum if that is lower.
+    def quantile(self, fraction: float) -> float:
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return min(BOUNDS[bucket], self.max) if bucket < len(BOUNDS) else self.max
+        return self.max
+
+    def stats(self) -> dict:
+        with self.lock:
+            if self.count == 0:
+                return {"count": 0}
+            return {
+                "count": self.count,
+                "mean": self.sum / self.count,
+                "p50": self.quantile(0.5),
+                "p90": self.quantile(0.9),
+                "p99": self.quantile(0.99),
+                "max": self.max,
+            }
+
+    def prometheus(self, name: str, labels: str) -> list[str]:
+        with self.lock:
+            counts = list(self.counts)
+            count, total = self.count, self.sum
+        lines = []
+        cumulative = 0
+        for bound, bucketCount in zip(BOUNDS + [float("inf")], counts):
+            cumulative += bucketCount
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(name + "_bucket{" + labels + ',le="' + le + '"} ' + str(cumulative))
+        lines.append(name + "_sum{" + labels + "} " + repr(total))
+        lines.append(name + "_count{" + labels + "} " + str(count))
+        return lines
+
+
+# Durations of the stages of a query, shared by every adapter of a server. Stages are named where they are timed:
+# mapperAbstract, mapperConcrete, mapperStep and mapperReset for mapper requests, send, sniffHit and sniffTimeout
+# for the SUT, oracleWrite, reset and query. With a file, the histograms are written there in the Prometheus text
+# format every interval seconds, for a node exporter's textfile collector.
+class Metrics:
+    def __init__(self, file: Optional[str] = None, interval: float = 10.0):
+        self.histograms: dict[str, Histogram] = dict()
+        self.lock = threading.Lock()
+        self.file: Optional[str] = file
+        self.interval: float = interval
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        if file is not None:
+            self.thread = threading.Thread(target=self.export, name="Metrics", daemon=True)
+            self.thread.start()
+
+    def histogram(self, stage: str) -> Histogram:
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, Histogram())
+        return histogram
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.histogram(stage).record(seconds)
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    # The stages as they are now, as iterating the dict while histogram() adds a stage raises.
+    def stages(self) -> list[tuple[str, Histogram]]:
+        with self.lock:
+            return sorted(self.histograms.items())
+
+    def stats(self) -> dict:
+        return {stage: histogram.stats() for stage, histogram in self.stages()}
+
+    def prometheus(self) -> str:
+        lines = [
+            "# HELP adapter_stage_seconds Duration of the stages of adapter queries.",
+            "# TYPE adapter_stage_seconds histogram",
+        ]
+        for stage, histogram in self.stages():
+            lines += histogram.prometheus("adapter_stage_seconds", 'stage="' + stage + '"')
+        return "\n".join(lines) + "\n"
+
+    # Replaces the file in one rename, so a collector never reads half of it.
+    def write(self) -> None:
+        if self.file is None:
+            return
+        temporary = self.file + ".tmp"
+        with open(temporary, "w") as stream:
+            stream.write(self.prometheus())
+        os.replace(temporary, self.file)
+
+    def export(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            self.write()
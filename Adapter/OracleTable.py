@@ -1,13 +1,28 @@
+import hashlib
+import logging
+import queue
+import threading
+import time
 import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterator, Optional, Sequence
 from AbstractSymbol import AbstractOrderedPair
 from ConcreteSymbol import ConcreteOrderedPair
 
 from sqlalchemy import (
+    ColumnElement,
+    DateTime,
+    Index,
+    Integer,
+    Row,
+    Select,
     String,
     JSON,
     create_engine,
+    null,
+    select,
 )
-from sqlalchemy.orm import declarative_base, sessionmaker, Session, mapped_column
+from sqlalchemy.orm import declarative_base, sessionmaker, Mapped, Session, mapped_column
 
 Base = declarative_base()
 
@@ -18,17 +33,483 @@ class Mapping(Base):
     abstract = mapped_column(JSON)
     concrete = mapped_column(JSON)
 
+
+# Typed schema: the abstract words are stored as plain strings next to the JSON, so lookups by input word
+# or word prefix are index scans instead of full scans with JSON parsing. The index of the input words compares
+# bytes on PostgreSQL, as only such an index serves LIKE 'prefix%' under any other collation.
+class Trace(Base):
+    __tablename__ = "trace"
+    id = mapped_column(String, primary_key=True)
+    inputs = mapped_column(String, nullable=False)
+    outputs = mapped_column(String, nullable=False)
+    # First input symbol of the word.
+    prefix = mapped_column(String, nullable=False)
+    length = mapped_column(Integer, nullable=False)
+    # Flags of every output symbol, e.g. "ACK+SYN RST".
+    flags = mapped_column(String, nullable=False)
+    # Unknown for traces migrated from the mapping table.
+    created = mapped_column(DateTime(timezone=True), nullable=True)
+    abstract = mapped_column(JSON)
+    concrete = mapped_column(JSON)
+
+    __table_args__ = (
+        Index("ix_trace_prefix_length", "prefix", "length"),
+        Index("ix_trace_inputs_pattern", "inputs", postgresql_ops={"inputs": "text_pattern_ops"}),
+    )
+
+
+# Deduplicated schema: every distinct abstract trace is stored once under the hash of its words, with the number of
+# times it was seen. Only the first few concrete traces of each are kept, in the trace_sample table.
+class UniqueTrace(Base):
+    __tablename__ = "unique_trace"
+    hash = mapped_column(String, primary_key=True)
+    inputs = mapped_column(String, nullable=False)
+    outputs = mapped_column(String, nullable=False)
+    prefix = mapped_column(String, nullable=False)
+    length = mapped_column(Integer, nullable=False)
+    flags = mapped_column(String, nullable=False)
+    count: Mapped[int] = mapped_column(Integer, nullable=False)
+    samples: Mapped[int] = mapped_column(Integer, nullable=False)
+    firstSeen = mapped_column(DateTime(timezone=True), nullable=True)
+    lastSeen = mapped_column(DateTime(timezone=True), nullable=True)
+    abstract = mapped_column(JSON)
+
+    __table_args__ = (
+        Index("ix_unique_trace_prefix_length", "prefix", "length"),
+        Index("ix_unique_trace_inputs_pattern", "inputs", postgresql_ops={"inputs": "text_pattern_ops"}),
+    )
+
+
+class TraceSample(Base):
+    __tablename__ = "trace_sample"
+    id = mapped_column(String, primary_key=True)
+    hash = mapped_column(String, nullable=False, index=True)
+    created = mapped_column(DateTime(timezone=True), nullable=True)
+    concrete = mapped_column(JSON)
+
+
+SCHEMAS = ["mapping", "trace", "unique"]
+# With "json" pairs are stored with every attribute of every symbol by name, with "compact" as lists of values.
+# Readers take both.
+ENCODINGS = ["json", "compact"]
+
+
+# Pairs given as JSON are stored as they are.
+def encode(pair: AbstractOrderedPair | ConcreteOrderedPair | str, encoding: str) -> str:
+    if isinstance(pair, str):
+        return pair
+    return pair.toCompactJSON() if encoding == "compact" else pair.toJSON()
+
+
+def toMapping(abstract: AbstractOrderedPair, concrete: ConcreteOrderedPair | str, encoding: str = "json") -> Mapping:
+    mapping = Mapping()
+    mapping.id = str(uuid.uuid4())
+
+    mapping.abstract = encode(abstract, encoding)
+    mapping.concrete = encode(concrete, encoding)
+    return mapping
+
+
+def toTrace(abstract: AbstractOrderedPair, concrete: ConcreteOrderedPair | str, encoding: str = "json") -> Trace:
+    trace = fromAbstract(str(uuid.uuid4()), abstract)
+    trace.created = datetime.now(timezone.utc)
+    trace.abstract = encode(abstract, encoding)
+    trace.concrete = encode(concrete, encoding)
+    return trace
+
+
+def fromAbstract(id: str, abstract: AbstractOrderedPair) -> Trace:
+    trace = Trace()
+    trace.id = id
+    describe(trace, abstract)
+    return trace
+
+
+def describe(trace: Trace | UniqueTrace, abstract: AbstractOrderedPair) -> None:
+    trace.inputs = " ".join(map(str, abstract.abstractInputs))
+    trace.outputs = " ".join(map(str, abstract.abstractOutputs))
+    trace.prefix = str(abstract.abstractInputs[0]) if len(abstract.abstractInputs) > 0 else ""
+    trace.length = len(abstract.abstractInputs)
+    trace.flags = " ".join(map(lambda output: output.flags.asHuman() if output is not None else "None", abstract.abstractOutputs))
+
+
+def traceHash(inputs: str, outputs: str) -> str:
+    return hashlib.sha256((inputs + "\n" + outputs).encode("utf-8")).hexdigest()
+
+
+# Input words that are the word or extend it, as a LIKE on the pattern index. A range of strings between
+# prefix + " " and prefix + "!" is only right where the collation compares bytes.
+def extendsWord(inputs: Any, word: str) -> ColumnElement[bool]:
+    return (inputs == word) | inputs.startswith(word + " ", autoescape=True)
+
+
+class OracleWriterError(RuntimeError):
+    pass
+
+
+# Commits traces on a background thread, in one transaction per batchSize traces or per flushInterval milliseconds,
+# whichever comes first. add() blocks while maxQueue traces are waiting, so a slow database slows the learner down
+# instead of growing the queue without bound. A failed commit is rolled back and its traces are kept, to go along
+# with the next commit, which the writer makes on its own every retryDelay milliseconds until the database is back.
+# stats() counts the kept traces. Once maxQueue traces are kept no more are taken from the queue, so add() blocks as
+# it does for a slow database. stop() tries the kept traces once more and raises if they are lost after all.
+class OracleWriter(threading.Thread):
+    def __init__(
+        self,
+        session: Session,
+        write: Callable[[Session, list[tuple[AbstractOrderedPair, ConcreteOrderedPair]]], None],
+        batchSize: int = 100,
+        flushInterval: float = 50,
+        maxQueue: int = 10000,
+        retryDelay: float = 100,
+    ):
+        super(OracleWriter, self).__init__(name="OracleWriter", daemon=True)
+        self.session: Session = session
+        self.write = write
+        self.batchSize: int = batchSize
+        self.flushInterval: float = flushInterval / 1000
+        self.maxQueue: int = maxQueue
+        self.retryDelay: float = retryDelay / 1000
+        # Traces of the commits that failed, why the last one did, and when to try them again.
+        self.failed: list[tuple[AbstractOrderedPair, ConcreteOrderedPair]] = []
+        self.error: Optional[Exception] = None
+        self.retryAt: float = 0
+        self.stopping = threading.Event()
+        # Traces to write, threading.Events to set once everything before them is committed or kept, or None to stop.
+        self.queue: queue.Queue[Optional[tuple[AbstractOrderedPair, ConcreteOrderedPair] | threading.Event]] = queue.Queue(maxQueue)
+        self.commits: int = 0
+        self.rows: int = 0
+        self.lastCommitLatency: float = 0
+        self.maxCommitLatency: float = 0
+        self.totalCommitLatency: float = 0
+        self.failedCommits: int = 0
+        self.logger = logging.getLogger("Oracle Writer")
+
+    def add(self, abstract: AbstractOrderedPair, concrete: ConcreteOrderedPair) -> None:
+        self.queue.put((abstract, concrete))
+
+    def flush(self) -> None:
+        flushed = threading.Event()
+        self.queue.put(flushed)
+        flushed.wait()
+
+    def stop(self) -> None:
+        self.stopping.set()
+        self.queue.put(None)
+        self.join()
+        if len(self.failed) > 0:
+            raise OracleWriterError("Could not commit " + str(len(self.failed)) + " traces.") from self.error
+
+    def run(self) -> None:
+        while True:
+            # Kept traces hold the queue back once there are maxQueue of them, until the database is back or stop().
+            if len(self.failed) >= self.maxQueue and not self.stopping.is_set():
+                self.stopping.wait(max(0, self.retryAt - time.monotonic()))
+                self.commit([], [])
+                continue
+            try:
+                item = self.queue.get(timeout=max(0, self.retryAt - time.monotonic()) if len(self.failed) > 0 else None)
+            except queue.Empty:
+                # Nothing came in before the kept traces are due, so they are tried on their own.
+                self.commit([], [])
+                continue
+            batch: list[tuple[AbstractOrderedPair, ConcreteOrderedPair]] = []
+            waiting: list[threading.Event] = []
+            deadline = time.monotonic() + self.flushInterval
+            while True:
+                if item is None:
+                    self.commit(batch, waiting, last=True)
+                    return
+                elif isinstance(item, threading.Event):
+                    waiting.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.batchSize:
+                    break
+                try:
+                    item = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            self.commit(batch, waiting)
+
+    # Kept traces are only tried again once retryDelay has passed since the last failure, or on the way out.
+    def commit(
+        self, batch: list[tuple[AbstractOrderedPair, ConcreteOrderedPair]], waiting: list[threading.Event], last: bool = False
+    ) -> None:
+        batch = self.failed + batch
+        if len(batch) > 0 and (last or time.monotonic() >= self.retryAt) and self.tryCommit(batch):
+            batch = []
+        self.failed = batch
+        for flushed in waiting:
+            flushed.set()
+
+    # Keeps the writer alive whatever the database does, or add() would block the learner forever once the queue is full.
+    def tryCommit(self, batch: list[tuple[AbstractOrderedPair, ConcreteOrderedPair]]) -> bool:
+        start = time.monotonic()
+        try:
+            self.write(self.session, batch)
+            self.session.commit()
+        except Exception as e:
+            self.logger.warning("Could not commit " + str(len(batch)) + " traces, keeping them (" + str(e) + ").")
+            self.session.rollback()
+            self.failedCommits += 1
+            self.error = e
+            self.retryAt = time.monotonic() + self.retryDelay
+            return False
+        latency = time.monotonic() - start
+        self.commits += 1
+        self.rows += len(batch)
+        self.lastCommitLatency = latency
+        self.maxCommitLatency = max(self.maxCommitLatency, latency)
+        self.totalCommitLatency += latency
+        self.error = None
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "queueDepth": self.queue.qsize(),
+            "commits": self.commits,
+            "failedCommits": self.failedCommits,
+            "failedTraces": len(self.failed),
+            "lastError": str(self.error) if self.error is not None else None,
+            "rows": self.rows,
+            "lastCommitLatency": self.lastCommitLatency,
+            "meanCommitLatency": self.totalCommitLatency / self.commits if self.commits > 0 else 0,
+            "maxCommitLatency": self.maxCommitLatency,
+        }
+
+
+# Traces are stored in the mapping table as two JSON blobs, with schema="trace" in the typed trace table,
+# or with schema="unique" once per distinct abstract trace, keeping up to maxSamples concrete traces of each.
 class OracleTable:
-    def __init__(self, dbURL) -> None:
+    def __init__(self, dbURL, writer: Optional[dict] = None, schema: str = "mapping", maxSamples: int = 1, encoding: str = "json") -> None:
+        if schema not in SCHEMAS:
+            raise ValueError("Invalid oracle table schema:", schema)
+        if encoding not in ENCODINGS:
+            raise ValueError("Invalid oracle table encoding:", encoding)
+        self.encoding: str = encoding
         engine = create_engine(dbURL, echo=False)
-        self.session: Session = sessionmaker(bind=engine)()
-        Base.metadata.create_all(engine)
+        self.sessionMaker = sessionmaker(bind=engine)
+        self.session: Session = self.sessionMaker()
+        self.schema: str = schema
+        self.toRow = toTrace if schema == "trace" else toMapping
+        self.maxSamples: int = maxSamples
+        # Concurrent learner sessions share one table.
+        self.lock = threading.Lock()
+        # The mapping table is kept in the typed schema as the source of migrations.
+        tables = [Mapping.__table__]
+        if schema == "trace":
+            tables.append(Trace.__table__)
+        elif schema == "unique":
+            tables.extend([UniqueTrace.__table__, TraceSample.__table__])
+        Base.metadata.create_all(engine, tables=tables)
+        # Tables of an earlier version lack the indexes added since.
+        for table in tables:
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
+        self.model = UniqueTrace if schema == "unique" else Trace
+        self.writer: Optional[OracleWriter] = None
+        if writer is not None:
+            self.writer = OracleWriter(self.sessionMaker(), self.write, **writer)
+            self.writer.start()
 
     def add(self, abstract: AbstractOrderedPair, concrete: ConcreteOrderedPair) -> None:
-        mapping = Mapping()
-        mapping.id = str(uuid.uuid4())
+        if self.writer is not None:
+            self.writer.add(abstract, concrete)
+            return
+        with self.lock:
+            self.write(self.session, [(abstract, concrete)])
+            self.session.commit()
+
+    # Adds the rows for the given traces to the session, without committing. Concrete traces may be given as JSON.
+    def write(self, session: Session, traces: Sequence[tuple[AbstractOrderedPair, ConcreteOrderedPair | str]]) -> None:
+        if self.schema == "unique":
+            self.merge(session, traces)
+        else:
+            session.add_all([self.toRow(abstract, concrete, self.encoding) for abstract, concrete in traces])
+
+    # Counts traces that are already stored, and stores the others. Concrete traces may be given as JSON.
+    def merge(self, session: Session, traces: Sequence[tuple[AbstractOrderedPair, ConcreteOrderedPair | str]]) -> None:
+        now = datetime.now(timezone.utc)
+        hashed = []
+        for abstract, concrete in traces:
+            inputs = " ".join(map(str, abstract.abstractInputs))
+            outputs = " ".join(map(str, abstract.abstractOutputs))
+            hashed.append((traceHash(inputs, outputs), abstract, concrete))
+        hashes = set(map(lambda trace: trace[0], hashed))
+        stored = {row.hash: row for row in session.execute(select(UniqueTrace).where(UniqueTrace.hash.in_(hashes))).scalars()}
+        for hash, abstract, concrete in hashed:
+            row = stored.get(hash)
+            if row is None:
+                row = UniqueTrace()
+                row.hash = hash
+                describe(row, abstract)
+                row.count = 0
+                row.samples = 0
+                row.firstSeen = now
+                row.abstract = encode(abstract, self.encoding)
+                session.add(row)
+                stored[hash] = row
+            row.count += 1
+            row.lastSeen = now
+            if row.samples < self.maxSamples:
+                sample = TraceSample()
+                sample.id = str(uuid.uuid4())
+                sample.hash = hash
+                sample.created = now
+                sample.concrete = concrete if isinstance(concrete, str) else encode(concrete, self.encoding)
+                session.add(sample)
+                row.samples += 1
+
+    def flush(self) -> None:
+        if self.writer is not None:
+            self.writer.flush()
+
+    def stop(self) -> None:
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.stop()
+
+    def stats(self) -> dict:
+        if self.writer is None:
+            return {}
+        return self.writer.stats()
+
+    # Rows of the query in batches of batchSize, ordered by the key, which must be the first column. Every batch is
+    # fetched whole with the lock held, and handed out after releasing it, so a slow reader does not hold up the
+    # sessions that share the table.
+    def batches(self, query: Select, key: Any, batchSize: int) -> Iterator[Sequence[Row]]:
+        last = None
+        while True:
+            page = query.order_by(key).limit(batchSize)
+            if last is not None:
+                page = page.where(key > last)
+            with self.lock:
+                rows = self.session.execute(page).all()
+            if len(rows) == 0:
+                return
+            yield rows
+            if len(rows) < batchSize:
+                return
+            last = rows[-1][0]
+
+    def concretePairs(self, batchSize: int = 1000) -> Iterator[ConcreteOrderedPair]:
+        model = {"mapping": Mapping, "trace": Trace, "unique": TraceSample}[self.schema]
+        for rows in self.batches(select(model.id, model.concrete), model.id, batchSize):
+            for _, concrete in rows:
+                yield ConcreteOrderedPair.fromJSON(concrete)
+
+    def abstractPairs(self, batchSize: int = 1000) -> Iterator[AbstractOrderedPair]:
+        if self.schema == "mapping":
+            key, column = Mapping.id, Mapping.abstract
+        else:
+            key, column = self.key(), self.model.abstract
+        for rows in self.batches(select(key, column), key, batchSize):
+            for _, abstract in rows:
+                yield AbstractOrderedPair.fromJSON(abstract)
+
+    def key(self) -> Any:
+        return UniqueTrace.hash if self.schema == "unique" else Trace.id
+
+    # Id, abstract and concrete JSON of every stored trace, as stored. In the unique schema every sample is a trace.
+    def storedTraces(self, batchSize: int = 1000) -> Iterator[tuple[str, str, str]]:
+        for id, _, abstract, concrete in self.selectTraces(batchSize=batchSize):
+            yield id, abstract, concrete
+
+    # Id, creation time, abstract and concrete JSON of the stored traces created in [since, until) whose input word
+    # is prefix or extends it, read in batches of batchSize. The mapping table has no creation times, and is filtered
+    # by prefix only after decoding every abstract trace.
+    def selectTraces(
+        self, since: Optional[datetime] = None, until: Optional[datetime] = None, prefix: Optional[str] = None, batchSize: int = 1000
+    ) -> Iterator[tuple[str, Optional[datetime], str, str]]:
+        if self.schema == "mapping":
+            if since is not None or until is not None:
+                raise ValueError("The mapping table has no creation times.")
+            key = Mapping.id
+            query = select(Mapping.id, null(), Mapping.abstract, Mapping.concrete)
+        else:
+            if self.schema == "unique":
+                model = UniqueTrace
+                created = TraceSample.created
+                key = TraceSample.id
+                query = select(TraceSample.id, created, UniqueTrace.abstract, TraceSample.concrete)
+                query = query.join(UniqueTrace, UniqueTrace.hash == TraceSample.hash)
+            else:
+                model = Trace
+                created = Trace.created
+                key = Trace.id
+                query = select(Trace.id, created, Trace.abstract, Trace.concrete)
+            if since is not None:
+                query = query.where(created >= since)
+            if until is not None:
+                query = query.where(created < until)
+            if prefix is not None:
+                query = query.where(extendsWord(model.inputs, prefix))
+        for rows in self.batches(query, key, batchSize):
+            for id, created, abstract, concrete in rows:
+                if prefix is not None and self.schema == "mapping":
+                    inputs = " ".join(map(str, AbstractOrderedPair.fromJSON(abstract).abstractInputs))
+                    if inputs != prefix and not inputs.startswith(prefix + " "):
+                        continue
+                yield id, created, abstract, concrete
+
+    # Input and output words of every stored trace.
+    def words(self, batchSize: int = 1000) -> Iterator[tuple[str, str]]:
+        if self.schema == "mapping":
+            for pair in self.abstractPairs(batchSize):
+                yield " ".join(map(str, pair.abstractInputs)), " ".join(map(str, pair.abstractOutputs))
+            return
+        key = self.key()
+        for rows in self.batches(select(key, self.model.inputs, self.model.outputs), key, batchSize):
+            for _, inputs, outputs in rows:
+                yield inputs, outputs
+
+    # Input and output words of the stored traces whose input word is the given word or extends it.
+    def wordsWithPrefix(self, prefix: str) -> list[tuple[str, str]]:
+        if self.schema == "mapping":
+            return [(inputs, outputs) for inputs, outputs in self.words() if inputs == prefix or inputs.startswith(prefix + " ")]
+        model = self.model
+        query = select(model.inputs, model.outputs).where(extendsWord(model.inputs, prefix))
+        with self.lock:
+            return [(inputs, outputs) for inputs, outputs in self.session.execute(query)]
+
+    # Copies the rows of the mapping table that are not in the trace table yet, keeping their ids.
+    # Safe to interrupt and run again. Returns the number of copied rows.
+    # Rows are read in batches, as SQLite does not commit the writer while a reader is still in the middle of a scan.
+    def migrate(self, batchSize: int = 1000) -> int:
+        if self.schema == "unique":
+            return self.migrateUnique(batchSize)
+        writer = self.sessionMaker()
+        copied = 0
+        query = select(Mapping.id, Mapping.abstract, Mapping.concrete).where(Mapping.id.not_in(select(Trace.id)))
+        try:
+            for rows in self.batches(query, Mapping.id, batchSize):
+                batch: list[Trace] = []
+                for id, abstract, concrete in rows:
+                    trace = fromAbstract(id, AbstractOrderedPair.fromJSON(abstract))
+                    trace.abstract = abstract
+                    trace.concrete = concrete
+                    batch.append(trace)
+                writer.add_all(batch)
+                writer.commit()
+                copied += len(batch)
+        finally:
+            writer.close()
+        return copied
 
-        mapping.abstract = abstract.toJSON()
-        mapping.concrete = concrete.toJSON()
-        self.session.add(mapping)
-        self.session.commit()
+    # Counts the rows of the mapping table into the unique_trace table. Rows carry no marker of having been counted,
+    # so this only runs while the unique_trace table is empty.
+    def migrateUnique(self, batchSize: int = 1000) -> int:
+        writer = self.sessionMaker()
+        copied = 0
+        try:
+            if writer.execute(select(UniqueTrace.hash).limit(1)).first() is not None:
+                return 0
+            query = select(Mapping.id, Mapping.abstract, Mapping.concrete)
+            for rows in self.batches(query, Mapping.id, batchSize):
+                self.merge(writer, [(AbstractOrderedPair.fromJSON(abstract), concrete) for _, abstract, concrete in rows])
+                writer.commit()
+                copied += len(rows)
+        finally:
+            writer.close()
+        return copied
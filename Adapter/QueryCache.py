@@ -0,0 +1,179 @@
+import random
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+
+class TrieNode:
+    __slots__ = ("output", "children")
+
+    def __init__(self, output: Optional[str] = None):
+        self.output: Optional[str] = output
+        self.children: dict[str, TrieNode] = dict()
+
+
+# Maps input words to output words. Every node stores the output for the input symbol leading to it,
+# so the answer to any prefix of a stored word can be read off the path to that word.
+class QueryTrie:
+    def __init__(self):
+        self.root: TrieNode = TrieNode()
+        self.size: int = 0
+        self.conflicts: int = 0
+        # Length of the prefix whose output the last insert changed, if it changed one.
+        self.conflictLength: Optional[int] = None
+
+    def insert(self, inputs: list[str], outputs: list[str], maxSize: Optional[int] = None) -> bool:
+        self.conflictLength = None
+        node = self.root
+        for index, (input, output) in enumerate(zip(inputs, outputs)):
+            child = node.children.get(input)
+            if child is None:
+                if maxSize is not None and self.size >= maxSize:
+                    return False
+                child = TrieNode(output)
+                node.children[input] = child
+                self.size += 1
+            elif child.output != output:
+                # The SUT answered differently than before, keep the most recent answer. The outputs stored below
+                # it followed the old one, so they go too.
+                self.conflicts += 1
+                self.conflictLength = index + 1
+                child.output = output
+                self.size -= self.prune(child)
+            node = child
+        return True
+
+    # Drops the descendants of the node, returning how many there were.
+    def prune(self, node: TrieNode) -> int:
+        count = 0
+        stack = list(node.children.values())
+        while len(stack) > 0:
+            descendant = stack.pop()
+            count += 1
+            stack.extend(descendant.children.values())
+        node.children = dict()
+        return count
+
+    # Input words of the leaves, i.e. the stored words that are not a prefix of another stored word.
+    def leaves(self) -> list[list[str]]:
+        words = []
+        stack: list[tuple[TrieNode, list[str]]] = [(self.root, [])]
+        while len(stack) > 0:
+            node, word = stack.pop()
+            if len(node.children) == 0 and len(word) > 0:
+                words.append(word)
+            for input, child in node.children.items():
+                stack.append((child, word + [input]))
+        return words
+
+    def lookup(self, inputs: list[str]) -> Optional[list[str]]:
+        node = self.root
+        outputs = []
+        for input in inputs:
+            child = node.children.get(input)
+            if child is None:
+                return None
+            outputs.append(child.output)
+            node = child
+        return outputs
+
+
+# The words of a batch that have to be run: those that are not a prefix of another query in the batch.
+def maximalWords(queries: list[str]) -> list[str]:
+    trie = QueryTrie()
+    for query in queries:
+        inputs = query.split(" ")
+        trie.insert(inputs, [""] * len(inputs))
+    return list(map(" ".join, trie.leaves()))
+
+
+# Answers every query of a batch from the outputs of a maximal word it is a prefix of. All outputs of a query come
+# from the same word, even when the SUT answered a shared prefix differently in two words.
+def prefixAnswers(queries: list[str], words: list[str], answers: list[str]) -> list[str]:
+    outputs: dict[str, list[str]] = dict()
+    for word, answer in zip(words, answers):
+        inputs = word.split(" ")
+        wordOutputs = answer.split(" ")
+        for length in range(1, len(inputs) + 1):
+            outputs[" ".join(inputs[:length])] = wordOutputs
+    return [" ".join(outputs[query][: len(query.split(" "))]) if query in outputs else "" for query in queries]
+
+
+class QueryCache:
+    def __init__(self, maxEntries: int = 100000, maxTrieNodes: int = 100000, verifyRate: float = 0.0, warm: bool = True):
+        self.maxEntries: int = maxEntries
+        self.maxTrieNodes: int = maxTrieNodes
+        self.verifyRate: float = verifyRate
+        self.warm: bool = warm
+        self.trie: QueryTrie = QueryTrie()
+        # Most recently used answers, evicted least recently used first.
+        self.recent: OrderedDict[str, str] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.verifications: int = 0
+        self.mismatches: int = 0
+
+    def load(self, traces: Iterable[tuple[list[str], list[str]]]) -> None:
+        with self.lock:
+            for inputs, outputs in traces:
+                if not self.trie.insert(inputs, outputs, self.maxTrieNodes):
+                    break
+
+    def get(self, query: str) -> Optional[str]:
+        with self.lock:
+            answer = self.recent.get(query)
+            if answer is not None:
+                self.recent.move_to_end(query)
+                self.hits += 1
+                return answer
+            outputs = self.trie.lookup(query.split(" "))
+            if outputs is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            answer = " ".join(outputs)
+            self.remember(query, answer)
+            return answer
+
+    def put(self, query: str, answer: str) -> None:
+        inputs = query.split(" ")
+        with self.lock:
+            self.trie.insert(inputs, answer.split(" "), self.maxTrieNodes)
+            if self.trie.conflictLength is not None:
+                self.forget(" ".join(inputs[: self.trie.conflictLength]))
+            self.remember(query, answer)
+
+    # Drops the remembered answers to the prefix and its extensions, which the trie dropped on a conflict.
+    def forget(self, prefix: str) -> None:
+        for query in [query for query in self.recent if query == prefix or query.startswith(prefix + " ")]:
+            del self.recent[query]
+
+    def remember(self, query: str, answer: str) -> None:
+        self.recent[query] = answer
+        self.recent.move_to_end(query)
+        while len(self.recent) > self.maxEntries:
+            self.recent.popitem(last=False)
+
+    def shouldVerify(self) -> bool:
+        return self.verifyRate > 0 and random.random() < self.verifyRate
+
+    def verified(self, query: str, cached: str, answer: str) -> None:
+        with self.lock:
+            self.verifications += 1
+            if cached != answer:
+                self.mismatches += 1
+        if cached != answer:
+            self.put(query, answer)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "verifications": self.verifications,
+                "mismatches": self.mismatches,
+                "conflicts": self.trie.conflicts,
+                "entries": len(self.recent),
+                "trieNodes": self.trie.size,
+            }
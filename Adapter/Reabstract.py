@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import IO, Iterator, Optional
+
+from AbstractSymbol import AbstractOrderedPair, AbstractSymbol
+from ConcreteSymbol import ConcreteOrderedPair
+from Invlang import DEFAULT_MAP, wrap
+from Mapper import Mapper, MapperError
+from OracleTable import ENCODINGS, SCHEMAS, OracleTable
+
+# Offline re-abstraction of the traces of an oracle table, for when the map file or the mapper changed. Every stored
+# concrete trace is replayed through a fresh mapper: each input is concretized to the seq and ack that were actually
+# sent, and each stored response is abstracted, so the new abstract trace is the one the learner would see now.
+# Traces are replayed in chunks on a pool of worker processes with a mapper each, and written to another oracle table
+# or to a JSON lines file, in the order they were read. Nothing is sent on the network.
+
+# The mapper of a worker process.
+workerMapper: Optional[Mapper] = None
+workerSymbolic: bool = False
+
+
+def startWorker(engine: str, mapFile: str, symbolic: bool) -> None:
+    global workerMapper, workerSymbolic
+    workerMapper = Mapper(0, engine=engine, mapFile=mapFile)
+    workerSymbolic = symbolic
+
+
+# Replays one trace from a reset mapper, returning its new abstract trace.
+def replay(mapper: Mapper, abstract: AbstractOrderedPair, concrete: ConcreteOrderedPair, symbolic: bool) -> AbstractOrderedPair:
+    mapper.send("RESET")
+    inputs: list[Optional[AbstractSymbol]] = []
+    outputs: list[Optional[AbstractSymbol]] = []
+    for abstractIn, concreteIn, concreteOut in zip(abstract.abstractInputs, concrete.concreteInputs, concrete.concreteOutputs):
+        assert abstractIn is not None
+        # Inputs that could not be concretized were never sent, and drew nothing from the mapper's search either.
+        if concreteIn is None:
+            mapper.send("ABSTRACT " + str(abstractIn))
+        else:
+            mapper.send("CONCRETIZE " + str(wrap(concreteIn.seqNumber)) + " " + str(wrap(concreteIn.ackNumber)) + " " + str(abstractIn))
+        abstractOut = AbstractSymbol(mapper.send("CONCRETE " + str(concreteOut))) if concreteOut is not None else None
+        # Match abstraction level.
+        if abstractOut is not None and not symbolic:
+            abstractOut.seqNumber = None
+            abstractOut.ackNumber = None
+        inputs.append(abstractIn)
+        outputs.append(abstractOut)
+    return AbstractOrderedPair(inputs, outputs)
+
+
+def words(abstract: AbstractOrderedPair) -> tuple[str, str]:
+    return " ".join(map(str, abstract.abstractInputs)), " ".join(map(str, abstract.abstractOutputs))
+
+
+# Id, stored concrete JSON, previous output word and new abstract JSON of a trace. The latter is None if the mapper
+# failed on the trace.
+Result = tuple[str, str, str, Optional[str]]
+
+
+# Re-abstracts a chunk of stored traces. Results go back to the main process as JSON, which is cheaper to pickle.
+def replayChunk(chunk: list[tuple[str, str, str]]) -> list[Result]:
+    assert workerMapper is not None
+    results: list[Result] = []
+    for id, abstract, concrete in chunk:
+        previous = AbstractOrderedPair.fromJSON(abstract)
+        try:
+            pair = replay(workerMapper, previous, ConcreteOrderedPair.fromJSON(concrete), workerSymbolic)
+            results.append((id, concrete, words(previous)[1], pair.toCompactJSON()))
+        except (ValueError, MapperError):
+            # A mapper in an unknown state is no use for the next trace.
+            workerMapper.replace()
+            results.append((id, concrete, words(previous)[1], None))
+    return results
+
+
+def chunks(traces: Iterator[tuple[str, str, str]], size: int) -> Iterator[list[tuple[str, str, str]]]:
+    chunk = []
+    for trace in traces:
+        chunk.append(trace)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+# Results of the chunks in order, with at most window chunks read ahead, so memory does not grow with the table.
+def replayAll(executor: ProcessPoolExecutor, traces: Iterator[tuple[str, str, str]], size: int, window: int) -> Iterator[Result]:
+    pending: deque[Future[list[Result]]] = deque()
+    for chunk in chunks(traces, size):
+        pending.append(executor.submit(replayChunk, chunk))
+        if len(pending) >= window:
+            yield from pending.popleft().result()
+    while len(pending) > 0:
+        yield from pending.popleft().result()
+
+
+# Writes re-abstracted traces to an oracle table, in one commit per batchSize traces, to a JSON lines file, or both.
+# Rows of the table get new ids, lines of the file keep the ids of the source.
+class Target:
+    def __init__(self, table: Optional[OracleTable], stream: Optional[IO[str]], batchSize: int):
+        self.table: Optional[OracleTable] = table
+        self.stream: Optional[IO[str]] = stream
+        self.batchSize: int = batchSize
+        self.batch: list[tuple[AbstractOrderedPair, str]] = []
+
+    def add(self, id: str, abstract: AbstractOrderedPair, concrete: str, previousOutputs: str) -> None:
+        if self.stream is not None:
+            inputs, outputs = words(abstract)
+            row = {"id": id, "inputs": inputs, "outputs": outputs, "previousOutputs": previousOutputs, "abstract": abstract.toDict()}
+            self.stream.write(json.dumps(row) + "\n")
+        if self.table is not None:
+            self.batch.append((abstract, concrete))
+            if len(self.batch) >= self.batchSize:
+                self.flush()
+
+    def flush(self) -> None:
+        if self.table is not None and len(self.batch) > 0:
+            self.table.write(self.table.session, self.batch)
+            self.table.session.commit()
+            self.batch = []
+
+
+def reabstract(source: OracleTable, target: Target, options: argparse.Namespace) -> dict:
+    counts: dict[str, float] = {"traces": 0, "changed": 0, "failed": 0}
+    start = time.perf_counter()
+    initializer = (options.mapper, options.map, options.symbolic)
+    with ProcessPoolExecutor(options.workers, initializer=startWorker, initargs=initializer) as executor:
+        traces = source.storedTraces(options.batch)
+        for id, concrete, previousOutputs, abstract in replayAll(executor, traces, options.chunk, options.workers * 2):
+            counts["traces"] += 1
+            if abstract is None:
+                counts["failed"] += 1
+                continue
+            pair = AbstractOrderedPair.fromJSON(abstract)
+            if words(pair)[1] != previousOutputs:
+                counts["changed"] += 1
+            target.add(id, pair, concrete, previousOutputs)
+    target.flush()
+    elapsed = time.perf_counter() - start
+    counts["seconds"] = elapsed
+    counts["tracesPerSecond"] = counts["traces"] / elapsed if elapsed > 0 else 0
+    return counts
+
+
+def main(arguments: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Re-abstract the stored concrete traces of an oracle table with the current mapper.")
+    parser.add_argument("source", help="Database URL of the oracle table to read.")
+    parser.add_argument("--schema", default="mapping", choices=SCHEMAS)
+    parser.add_argument("--target", help="Database URL of the oracle table to write, best another database than the source.")
+    parser.add_argument("--target-schema", default="mapping", choices=SCHEMAS)
+    parser.add_argument("--encoding", default="json", choices=ENCODINGS)
+    parser.add_argument("--output", help="JSON lines file to write, - for standard output.")
+    parser.add_argument("--mapper", default="python", choices=["python", "java"])
+    parser.add_argument("--map", default=DEFAULT_MAP)
+    parser.add_argument("--symbolic", action="store_true", help="Keep seq and ack of the outputs, as a symbolic adapter does.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, by default one per CPU.")
+    parser.add_argument("--chunk", type=int, default=200, help="Traces per task of a worker.")
+    parser.add_argument("--batch", type=int, default=1000, help="Traces per read from the source and per commit to the target.")
+    options = parser.parse_args(arguments)
+    if options.target is None and options.output is None:
+        parser.error("Give a --target table, an --output file or both.")
+    if options.workers is None:
+        options.workers = os.cpu_count() or 1
+
+    source = OracleTable(options.source, schema=options.schema)
+    table = OracleTable(options.target, schema=options.target_schema, encoding=options.encoding) if options.target is not None else None
+    stream = None
+    if options.output is not None:
+        stream = sys.stdout if options.output == "-" else open(options.output, "w")
+    try:
+        counts = reabstract(source, Target(table, stream, options.batch), options)
+    finally:
+        if stream is not None and stream is not sys.stdout:
+            stream.close()
+    print(json.dumps(counts), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
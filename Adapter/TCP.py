@@ -1,62 +1,87 @@
 import json
+from typing import Optional
 
+# Flags in the order they are spelled, with their bits in the flags byte of the TCP header.
+FLAG_NAMES: list[str] = ["SYN", "ACK", "RST", "FIN", "PSH", "URG", "ECE", "CWR"]
+FLAG_BITS: dict[str, int] = {"SYN": 0x02, "ACK": 0x10, "RST": 0x04, "FIN": 0x01, "PSH": 0x08, "URG": 0x20, "ECE": 0x40, "CWR": 0x80}
 
+# Names, scapy and human spelling of every flags byte.
+NAMES: list[list[str]] = [[name for name in FLAG_NAMES if bits & FLAG_BITS[name]] for bits in range(256)]
+SCAPY: list[str] = ["".join(map(lambda name: name[0], names)) for names in NAMES]
+HUMAN: list[str] = ["+".join(names) for names in NAMES]
+
+
+def flagBits(flags: str) -> int:
+    bits = 0
+    for name in FLAG_NAMES:
+        if name[0] in flags:
+            bits |= FLAG_BITS[name]
+    return bits
+
+
+def flagProperty(name: str) -> property:
+    bit = FLAG_BITS[name]
+    return property(lambda self: self.bits & bit != 0)
+
+
+# The flags of a segment as the bits of the TCP flags byte. Flag sets are immutable and interned: there is one
+# per flags byte, which symbols share.
 class FlagSet:
-    SYN: bool = False
-    ACK: bool = False
-    RST: bool = False
-    FIN: bool = False
-    PSH: bool = False
-    URG: bool = False
-    ECE: bool = False
-    CWR: bool = False
-
-    def __init__(self, flags: str = "") -> None:
-        self.setFlags(flags)
+    __slots__ = ("bits",)
+    bits: int
+
+    SYN = flagProperty("SYN")
+    ACK = flagProperty("ACK")
+    RST = flagProperty("RST")
+    FIN = flagProperty("FIN")
+    PSH = flagProperty("PSH")
+    URG = flagProperty("URG")
+    ECE = flagProperty("ECE")
+    CWR = flagProperty("CWR")
+
+    # Takes the initials of the flags, in any order, e.g. "SA" or "AS".
+    def __new__(cls, flags: str = "") -> "FlagSet":
+        flagSet = PARSED_FLAGS.get(flags)
+        if flagSet is None:
+            flagSet = FlagSet.fromBits(flagBits(flags))
+            if len(PARSED_FLAGS) < 4096:
+                PARSED_FLAGS[flags] = flagSet
+        return flagSet
+
+    @staticmethod
+    def fromBits(bits: int) -> "FlagSet":
+        flagSet = FLAG_SETS[bits & 0xFF]
+        if flagSet is None:
+            flagSet = object.__new__(FlagSet)
+            flagSet.bits = bits & 0xFF
+            FLAG_SETS[bits & 0xFF] = flagSet
+        return flagSet
+
+    def __reduce__(self):
+        return (FlagSet.fromBits, (self.bits,))
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, FlagSet) and other.bits == self.bits
+
+    def __hash__(self) -> int:
+        return self.bits
 
     def getFlags(self) -> list[str]:
-        flags = []
-        if self.SYN:
-            flags.append("SYN")
-        if self.ACK:
-            flags.append("ACK")
-        if self.RST:
-            flags.append("RST")
-        if self.FIN:
-            flags.append("FIN")
-        if self.PSH:
-            flags.append("PSH")
-        if self.URG:
-            flags.append("URG")
-        if self.ECE:
-            flags.append("ECE")
-        if self.CWR:
-            flags.append("CWR")
-        return flags
-
-    def setFlags(self, flags: str):
-        if "S" in flags:
-            self.SYN = True
-        if "A" in flags:
-            self.ACK = True
-        if "R" in flags:
-            self.RST = True
-        if "F" in flags:
-            self.FIN = True
-        if "P" in flags:
-            self.PSH = True
-        if "U" in flags:
-            self.URG = True
-        if "E" in flags:
-            self.ECE = True
-        if "C" in flags:
-            self.CWR = True
+        return list(NAMES[self.bits])
 
     def asScapy(self) -> str:
-        return "".join(map(lambda f: f[0], self.getFlags()))
+        return SCAPY[self.bits]
 
     def asHuman(self) -> str:
-        return "+".join(self.getFlags())
+        return HUMAN[self.bits]
+
+    # Every flag by name, the way symbols have always been serialized.
+    def asDict(self) -> dict[str, bool]:
+        return {name: self.bits & FLAG_BITS[name] != 0 for name in sorted(FLAG_NAMES)}
 
     def toJSON(self) -> str:
         return json.dumps(self.getFlags())
+
+
+FLAG_SETS: list[Optional[FlagSet]] = [None] * 256
+PARSED_FLAGS: dict[str, FlagSet] = dict()
@@ -0,0 +1,131 @@
+import argparse
+import io
+import struct
+import threading
+import time
+from collections import deque
+from typing import IO, TYPE_CHECKING, Iterator, Optional
+
+if TYPE_CHECKING:
+    from ConcreteSymbol import ConcreteSymbol
+
+# Events of a run, recorded as tuples into a bounded ring buffer in place of per-packet prints and log lines. Nothing
+# is formatted until the buffer is dumped, on the TRACE command or when the server crashes. With a file, every event
+# is also appended there in a binary format, which main() below turns back into text.
+
+OFF = 0
+QUERIES = 1
+SEGMENTS = 2
+LEVELS: dict[str, int] = {"off": OFF, "queries": QUERIES, "segments": SEGMENTS}
+
+# Events by code, with their level and the struct of their fields. Text events carry one UTF-8 string instead.
+EVENTS: list[tuple[str, int, Optional[struct.Struct]]] = [
+    ("query", QUERIES, None),
+    ("answer", QUERIES, None),
+    ("reset", QUERIES, struct.Struct("!HH")),
+    ("sent", SEGMENTS, struct.Struct("!HHBIIH")),
+    ("captured", SEGMENTS, struct.Struct("!HHBIIH")),
+    ("retransmission", SEGMENTS, struct.Struct("!HHBIIH")),
+]
+CODES: dict[str, int] = {name: code for code, (name, _, _) in enumerate(EVENTS)}
+EVENT_LEVELS: dict[str, int] = {name: level for name, level, _ in EVENTS}
+
+# Monotonic time, event code and length of the fields.
+HEADER = struct.Struct("!dBH")
+
+Event = tuple[float, str, tuple]
+
+
+def formatEvent(event: Event) -> str:
+    timestamp, name, fields = event
+    _, _, layout = EVENTS[CODES[name]]
+    if layout is None:
+        text = str(fields[0])
+    elif len(fields) == 2:
+        text = str(fields[0]) + ">" + str(fields[1])
+    else:
+        sourcePort, destinationPort, flags, seq, ack, length = fields
+        text = str(sourcePort) + ">" + str(destinationPort) + " flags=0x%02x seq=%d ack=%d len=%d" % (flags, seq, ack, length)
+    return "%.6f %s %s" % (timestamp, name, text)
+
+
+def encodeEvent(event: Event) -> bytes:
+    timestamp, name, fields = event
+    code = CODES[name]
+    layout = EVENTS[code][2]
+    body = str(fields[0]).encode("utf-8")[:65535] if layout is None else layout.pack(*fields)
+    return HEADER.pack(timestamp, code, len(body)) + body
+
+
+def decodeEvents(stream: IO[bytes]) -> Iterator[Event]:
+    while True:
+        header = stream.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return
+        timestamp, code, length = HEADER.unpack(header)
+        body = stream.read(length)
+        name, _, layout = EVENTS[code]
+        yield timestamp, name, (body.decode("utf-8"),) if layout is None else layout.unpack(body)
+
+
+class Tracer:
+    def __init__(self, level: str = "segments", capacity: int = 4096, file: Optional[str] = None):
+        if level not in LEVELS:
+            raise ValueError("Invalid tracing level:", level)
+        self.level: int = LEVELS[level]
+        self.events: deque[Event] = deque(maxlen=capacity)
+        self.file: Optional[io.BufferedWriter] = open(file, "ab") if file is not None else None
+        self.fileLock = threading.Lock()
+
+    # Callers on the hot path check this first, so that a disabled event costs no more than the check.
+    def enabled(self, level: int) -> bool:
+        return level <= self.level
+
+    def record(self, name: str, *fields) -> None:
+        if EVENT_LEVELS[name] > self.level:
+            return
+        event = (time.monotonic(), name, fields)
+        self.events.append(event)
+        if self.file is not None:
+            with self.fileLock:
+                if self.file is not None:
+                    self.file.write(encodeEvent(event))
+
+    def recordSegment(self, name: str, symbol: "ConcreteSymbol") -> None:
+        fields = (symbol.sourcePort, symbol.destinationPort, symbol.flags.bits, symbol.seqNumber, symbol.ackNumber, len(symbol.payload))
+        self.record(name, *fields)
+
+    def lines(self, count: Optional[int] = None) -> list[str]:
+        events = list(self.events)
+        if count is not None:
+            events = events[-count:]
+        return list(map(formatEvent, events))
+
+    def dump(self, stream: IO[str]) -> None:
+        for line in self.lines():
+            print(line, file=stream)
+        self.flush()
+
+    def flush(self) -> None:
+        with self.fileLock:
+            if self.file is not None:
+                self.file.flush()
+
+    def stop(self) -> None:
+        with self.fileLock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def main(arguments: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Print a binary trace file of the adapter.")
+    parser.add_argument("file")
+    options = parser.parse_args(arguments)
+    with open(options.file, "rb") as stream:
+        for event in decodeEvents(stream):
+            print(formatEvent(event))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,162 @@
 # From: https://gitlab.science.ru.nl/pfiteraubrostean/tcp-learner/-/blob/master/Adapter/tracker.py
 
-from typing import Optional
-from pcapy import open_live
+import asyncio
+import ctypes
+import select
+import socket
+import struct
+from typing import Callable, Optional
+from pcapy import DLT_EN10MB, compile, open_live
 from impacket.ImpactDecoder import EthDecoder, Dot11WPA2Decoder, Decoder
 from impacket.ImpactPacket import IP, TCP
-import time
 import threading
+import time
+from collections import OrderedDict
 from ConcreteSymbol import ConcreteSymbol
+from FrameDecoder import decodeFrame
+from Tracing import SEGMENTS, Tracer
+
+
+ETH_P_IP = 0x0800
+SO_ATTACH_FILTER = 26
+
+
+# Captures with libpcap, handing every packet that arrived within the read timeout to the callback in one dispatch.
+# The handle is non-blocking and waited on with select(), as libpcap's own read timeout does not expire while no
+# packets arrive, which would hold up a new filter until the SUT sent something the old one lets through.
+class PcapCapture:
+    def __init__(self, interface: str, snaplen: int, promiscuous: bool, readTimeout: int):
+        self.readTimeout: float = readTimeout / 1000
+        self.pcap = open_live(interface, snaplen, promiscuous, readTimeout)
+        self.pcap.setnonblock(1)
+
+    def setfilter(self, expression: str) -> None:
+        self.pcap.setfilter(expression)
+
+    def dispatch(self, callback: Callable) -> None:
+        readable, _, _ = select.select([self.pcap.getfd()], [], [], self.readTimeout)
+        if len(readable) > 0:
+            self.pcap.dispatch(-1, callback)
+
+    def close(self) -> None:
+        self.pcap.close()
+
+
+# Captures on a packet socket of its own. The kernel queues every packet on the socket as soon as it passed the filter,
+# like pcap's immediate mode, without waiting for a ring buffer block to fill or time out. Every dispatch drains the
+# socket. Only for Ethernet interfaces.
+class SocketCapture:
+    def __init__(self, interface: str, snaplen: int, readTimeout: int):
+        self.snaplen: int = snaplen
+        self.readTimeout: float = readTimeout / 1000
+        self.socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_IP))
+        self.socket.bind((interface, ETH_P_IP))
+        self.socket.setblocking(False)
+
+    # Compiles the expression with libpcap and attaches the program to the socket, so filtered packets never reach Python.
+    def setfilter(self, expression: str) -> None:
+        instructions = compile(DLT_EN10MB, self.snaplen, expression, 1, 0).get_bpf()
+        program = ctypes.create_string_buffer(b"".join(struct.pack("HBBI", *instruction) for instruction in instructions))
+        self.socket.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, struct.pack("HL", len(instructions), ctypes.addressof(program)))
+
+    def dispatch(self, callback: Callable) -> None:
+        readable, _, _ = select.select([self.socket], [], [], self.readTimeout)
+        if len(readable) == 0:
+            return
+        while True:
+            try:
+                data = self.socket.recv(self.snaplen)
+            except BlockingIOError:
+                return
+            callback(None, data)
+
+    def close(self) -> None:
+        self.socket.close()
+
+
+# Flags of the responses that are ignored when seen again with the same seq and ack.
+RETRANSMITTED_FLAGS = ["SA", "AS", "AF", "FA", "S", "P", "PA"]
+
+
+class FlowHistory:
+    def __init__(self):
+        # Seq, ack and flags of every response on the flow.
+        self.responses: set[tuple[int, int, str]] = set()
+        # Seq numbers of the PSH+ACK responses on the flow.
+        self.dataSeqs: set[int] = set()
+        self.lastSeen: float = 0.0
+
+
+# Responses seen so far, by flow, to tell retransmissions from new responses in constant time.
+# A flow is forgotten when its connection is dropped, when it was not seen for ttl seconds, or when it is
+# the least recently seen one of more than maxFlows flows.
+class RetransmissionIndex:
+    def __init__(self, ttl: float = 300.0, maxFlows: int = 1024):
+        self.ttl: float = ttl
+        self.maxFlows: int = maxFlows
+        # Least recently seen first.
+        self.flows: OrderedDict[tuple[int, int], FlowHistory] = OrderedDict()
+        self.retransmissions: int = 0
+        self.dataRetransmissions: int = 0
+        self.evicted: int = 0
+
+    def isRetransmit(self, flow: tuple[int, int], response: ConcreteSymbol) -> bool:
+        history = self.flows.get(flow)
+        if history is None:
+            return False
+        flags = response.flags.asScapy()
+        if (response.seqNumber, response.ackNumber, flags) in history.responses and flags.replace("U", "") in RETRANSMITTED_FLAGS:
+            self.retransmissions += 1
+            return True
+        # Technically, seq numbers don't identify packets but data.
+        # So we could get a packet with a previously seen SEQ number, except that now it actualy carries data.
+        if response.flags.PSH and response.flags.ACK and len(response.payload) > 0 and response.seqNumber in history.dataSeqs:
+            self.dataRetransmissions += 1
+            return True
+        return False
+
+    def add(self, flow: tuple[int, int], response: ConcreteSymbol) -> None:
+        now = time.monotonic()
+        history = self.flows.get(flow)
+        if history is None:
+            history = FlowHistory()
+            self.flows[flow] = history
+        else:
+            self.flows.move_to_end(flow)
+        flags = response.flags.asScapy()
+        history.responses.add((response.seqNumber, response.ackNumber, flags))
+        if "P" in flags and "A" in flags:
+            history.dataSeqs.add(response.seqNumber)
+        history.lastSeen = now
+        self.expire(now)
+
+    def expire(self, now: float) -> None:
+        while len(self.flows) > 0:
+            flow, history = next(iter(self.flows.items()))
+            if len(self.flows) <= self.maxFlows and history.lastSeen >= now - self.ttl:
+                return
+            del self.flows[flow]
+            self.evicted += 1
+
+    def forget(self, flow: Optional[tuple[int, int]] = None) -> None:
+        if flow is None:
+            self.flows.clear()
+        else:
+            self.flows.pop(flow, None)
+
+    def stats(self) -> dict:
+        return {
+            "retransmissions": self.retransmissions,
+            "dataRetransmissions": self.dataRetransmissions,
+            "flows": len(self.flows),
+            "responses": sum(len(history.responses) for history in self.flows.values()),
+            "evictedFlows": self.evicted,
+        }
+
+
+def resolve(future: asyncio.Future, response: Optional[ConcreteSymbol]) -> None:
+    if not future.done():
+        future.set_result(response)
 
 
 class Tracker(threading.Thread):
@@ -16,18 +166,94 @@ class Tracker(threading.Thread):
     max_bytes = 1024
     promiscuous = False
 
-    def __init__(self, interface: str, serverIp, interfaceType: int = 0, readTimeout: int = 1):
+    def __init__(
+        self,
+        interface: str,
+        serverIp,
+        interfaceType: int = 0,
+        readTimeout: int = 1,
+        capture: str = "pcap",
+        retransmissions: Optional[dict] = None,
+        tracer: Optional[Tracer] = None,
+    ):
         super(Tracker, self).__init__()
+        self.tracer: Tracer = tracer if tracer is not None else Tracer()
         self.interface = interface
         self.decoder = self.getDecoder(interfaceType)
+        # Ethernet frames are decoded with FrameDecoder, anything else with impacket.
+        self.decodeFrames: bool = interfaceType == 0
         self._stop = threading.Event()
-        self._received = threading.Event()
         self.daemon = True
         self.readTimeout = readTimeout
         self.serverIp = serverIp
         self.lastResponse: Optional[ConcreteSymbol] = None
         self.lastResponses: dict[tuple[int, int], ConcreteSymbol] = dict()
-        self.responseHistory: set[tuple[tuple[int, int], int, int, str]] = set()
+        self.responseHistory: RetransmissionIndex = RetransmissionIndex(**(retransmissions or {}))
+        # One event per (serverPort, senderPort) flow, set when a new response for that flow is captured.
+        self.flowEvents: dict[tuple[int, int], threading.Event] = dict()
+        # Futures of asyncio sessions waiting for a response, by flow, with the loop each belongs to.
+        self.flowFutures: dict[tuple[int, int], list[tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = dict()
+        self.flowLock = threading.Lock()
+        # When a segment was last captured on each flow, retransmissions included.
+        self.flowActivity: dict[tuple[int, int], float] = dict()
+        if capture not in ["socket", "pcap"]:
+            raise ValueError("Invalid capture backend:", capture)
+        self.captureBackend: str = capture if interfaceType == 0 else "pcap"
+        self.capture: Optional[PcapCapture | SocketCapture] = None
+        # Port pairs of the connections in use. The capture filter only lets responses on these through,
+        # or every TCP packet of the SUT while there are none.
+        self.watchedFlows: set[tuple[int, int]] = set()
+        self.captureLock = threading.Lock()
+        # The filter is only ever set by the tracker thread, between two dispatches. Sessions bump filterVersion
+        # and, to see responses on a new flow, wait for installedVersion to catch up.
+        self.filterInstalled = threading.Condition(self.captureLock)
+        self.filterVersion: int = 0
+        self.installedVersion: int = 0
+        self.historyLock = threading.Lock()
+
+    # Returns once the filter lets the responses on the flow through, so that none is missed after the first segment.
+    def watch(self, flow: tuple[int, int]) -> None:
+        with self.captureLock:
+            self.watchedFlows.add(flow)
+            self.filterVersion += 1
+            version = self.filterVersion
+            # Bounded, in case the tracker thread is gone.
+            self.filterInstalled.wait_for(lambda: self.capture is None or self.installedVersion >= version, timeout=1.0)
+
+    # The connection of the flow is dropped, so its responses are no longer needed either.
+    def unwatch(self, flow: tuple[int, int]) -> None:
+        with self.captureLock:
+            self.watchedFlows.discard(flow)
+            self.filterVersion += 1
+        with self.historyLock:
+            self.responseHistory.forget(flow)
+        with self.flowLock:
+            self.lastResponses.pop(flow, None)
+            self.flowEvents.pop(flow, None)
+            self.flowActivity.pop(flow, None)
+            # Sessions still waiting on the flow get no response.
+            self.resolveFutures(flow, None)
+
+    def captureFilter(self) -> str:
+        expression = "tcp and ip src " + str(self.serverIp)
+        if len(self.watchedFlows) == 0:
+            return expression
+        ports = map(lambda flow: "(src port " + str(flow[0]) + " and dst port " + str(flow[1]) + ")", sorted(self.watchedFlows))
+        return expression + " and (" + " or ".join(ports) + ")"
+
+    # Called by the tracker thread between dispatches, as a pcap handle must not be changed while it is read. Only the
+    # filter expression is built under the capture lock, the capture itself is not shared.
+    def installFilter(self) -> None:
+        with self.captureLock:
+            if self.installedVersion == self.filterVersion:
+                return
+            version = self.filterVersion
+            expression = self.captureFilter()
+        assert self.capture is not None
+        self.capture.setfilter(expression)
+        with self.captureLock:
+            self.installedVersion = version
+            self.filterInstalled.notify_all()
 
     def getDecoder(self, interfaceType) -> EthDecoder | Dot11WPA2Decoder:
         if interfaceType == 0:
@@ -49,6 +275,13 @@ class Tracker(threading.Thread):
         else:
             if data is None:
                 return
+            if self.decodeFrames:
+                segment = decodeFrame(data)
+                # Only segments of awaited flows are turned into symbols.
+                if segment is None or not self.isAwaited(segment.sourcePort, segment.destinationPort):
+                    return
+                self.handleResponse(segment.sourcePort, segment.destinationPort, ConcreteSymbol(segment))
+                return
             packet = self.decoder.decode(data)
             if packet is None:
                 return
@@ -57,79 +290,114 @@ class Tracker(threading.Thread):
             if isinstance(l2, IP):
                 l3 = l2.child()
                 if isinstance(l3, TCP):
-                    tcp_src_port = l3.get_th_sport()
-                    tcp_dst_port = l3.get_th_dport()
-                    response = self.impacketResponseParse(l3)
-                    print("PACKET:", response)
-                    print("HIST:", self.responseHistory)
-                    if self.isRetransmit(tcp_src_port, tcp_dst_port, response):
-                        print("ignoring retransmission: ", response.__str__())
-                    else:
-                        self.responseHistory.add(
-                            (
-                                (tcp_src_port, tcp_dst_port),
-                                response.seqNumber,
-                                response.ackNumber,
-                                response.flags.asScapy(),
-                            )
-                        )
-                        self.lastResponses[(tcp_src_port, tcp_dst_port)] = response
-                        self.lastResponse = response
-                        self._received.set()
+                    self.handleResponse(l3.get_th_sport(), l3.get_th_dport(), self.impacketResponseParse(l3))
 
-    def isRetransmit(self, tcp_src_port: int, tcp_dst_port: int, response: ConcreteSymbol) -> bool:
-        isRet = (
-            (tcp_src_port, tcp_dst_port),
-            response.seqNumber,
-            response.ackNumber,
-            response.flags.asScapy(),
-        ) in self.responseHistory and response.flags.asScapy().replace("U", "") in [
-            "SA",
-            "AS",
-            "AF",
-            "FA",
-            "S",
-            "P",
-            "PA",
-        ]
+    # With no flows watched, every flow is awaited, as with the capture filter.
+    def isAwaited(self, tcp_src_port: int, tcp_dst_port: int) -> bool:
+        return len(self.watchedFlows) == 0 or (tcp_src_port, tcp_dst_port) in self.watchedFlows
 
-        # Technically, seq numbers don't identify packets but data.
-        # So we could get a packet with a previously seen SEQ number, except that now it actualy carries data.
-        if not isRet:
-            if response.flags.PSH and response.flags.ACK and len(response.payload) > 0:
-                for (src_port, dst_port), seq, ack, flags in self.responseHistory:
-                    if (src_port, dst_port) == (tcp_src_port, tcp_dst_port) and (seq == response.seqNumber) and "P" in flags and "A" in flags:
-                        isRet = True
-        return isRet
+    def handleResponse(self, tcp_src_port: int, tcp_dst_port: int, response: ConcreteSymbol) -> None:
+        self.flowActivity[(tcp_src_port, tcp_dst_port)] = time.monotonic()
+        with self.historyLock:
+            retransmit = self.isRetransmit(tcp_src_port, tcp_dst_port, response)
+            if not retransmit:
+                self.responseHistory.add((tcp_src_port, tcp_dst_port), response)
+        if retransmit:
+            if self.tracer.enabled(SEGMENTS):
+                self.tracer.recordSegment("retransmission", response)
+        else:
+            if self.tracer.enabled(SEGMENTS):
+                self.tracer.recordSegment("captured", response)
+            self.recordResponse((tcp_src_port, tcp_dst_port), response)
+
+    def isRetransmit(self, tcp_src_port: int, tcp_dst_port: int, response: ConcreteSymbol) -> bool:
+        return self.responseHistory.isRetransmit((tcp_src_port, tcp_dst_port), response)
 
     def impacketResponseParse(self, tcpPacket: TCP):
         return ConcreteSymbol(tcpPacket)
 
-    # clears all last responses for all ports (keep that in mind if you have responses on several ports)
-    # this is done because when learning, we only care about one port
-    def clearLastResponse(self) -> None:
-        self.lastResponse = None
-        self.lastResponses.clear()
+    # clears the last response of one flow, or of all flows if none is given.
+    # concurrent sessions share the tracker, so each of them only clears the flow it is about to use.
+    def clearLastResponse(self, flow: Optional[tuple[int, int]] = None) -> None:
+        with self.flowLock:
+            self.lastResponse = None
+            if flow is None:
+                self.lastResponses.clear()
+                self.flowEvents.clear()
+            else:
+                self.lastResponses.pop(flow, None)
+                self.flowEvents.pop(flow, None)
 
     def reset(self) -> None:
         self.clearLastResponse()
-        self.responseHistory.clear()
-        self._received.clear()
+        with self.historyLock:
+            self.responseHistory.forget()
+
+    def stats(self) -> dict:
+        with self.historyLock:
+            return self.responseHistory.stats()
+
+    def recordResponse(self, flow: tuple[int, int], response: ConcreteSymbol) -> None:
+        with self.flowLock:
+            self.lastResponses[flow] = response
+            self.lastResponse = response
+            self.flowEvents.setdefault(flow, threading.Event()).set()
+            self.resolveFutures(flow, response)
+
+    # Called with the flow lock held, from any thread.
+    def resolveFutures(self, flow: tuple[int, int], response: Optional[ConcreteSymbol]) -> None:
+        for loop, future in self.flowFutures.pop(flow, []):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(resolve, future, response)
+
+    def getFlowEvent(self, flow: tuple[int, int]) -> threading.Event:
+        with self.flowLock:
+            return self.flowEvents.setdefault(flow, threading.Event())
 
+    # Blocks until the tracker captures a response on the flow, or until waitTime runs out.
+    # A response captured between clearLastResponse() and this call has already set the event, so it is not missed.
     def sniffForResponse(self, serverPort: int, senderPort: int, waitTime) -> Optional[ConcreteSymbol]:
-        div = waitTime / 10
-        response = None
-        # print "sniffing for response ", waitTime
-        for _ in range(10):
-            # print "waiting... ", div
-            time.sleep(div)
-            response = self.getLastResponse(serverPort, senderPort)
+        self.getFlowEvent((serverPort, senderPort)).wait(timeout=waitTime)
+        return self.getLastResponse(serverPort, senderPort)
+
+    # A future of the running loop, resolved by the tracker thread once a response on the flow is captured, or at once
+    # if one already was since clearLastResponse().
+    def responseFuture(self, flow: tuple[int, int]) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.flowLock:
+            response = self.lastResponses.get(flow)
             if response is not None:
-                break
-                # self._received.wait(timeout=waitTime)
-        # response = self.getLastResponse(serverPort, senderPort)
-        # self._received.clear()
-        return response
+                future.set_result(response)
+            else:
+                self.flowFutures.setdefault(flow, []).append((loop, future))
+        return future
+
+    def discardFuture(self, flow: tuple[int, int], future: asyncio.Future) -> None:
+        with self.flowLock:
+            futures = self.flowFutures.get(flow)
+            if futures is None:
+                return
+            futures[:] = [entry for entry in futures if entry[1] is not future]
+            if len(futures) == 0:
+                del self.flowFutures[flow]
+
+    # sniffForResponse() for asyncio sessions, which wait without holding a thread.
+    async def sniffForResponseAsync(self, serverPort: int, senderPort: int, waitTime) -> Optional[ConcreteSymbol]:
+        flow = (serverPort, senderPort)
+        future = self.responseFuture(flow)
+        try:
+            await asyncio.wait_for(future, timeout=waitTime)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.discardFuture(flow, future)
+        return self.getLastResponse(serverPort, senderPort)
+
+    # How much longer the flow has to stay quiet to have been quiet for quiet seconds, counting from since at the earliest.
+    def quietRemaining(self, flow: tuple[int, int], since: float, quiet: float) -> float:
+        last = max(since, self.flowActivity.get(flow, since))
+        return max(0.0, last + quiet - time.monotonic())
 
     # fetches the last response from an active port. If no response was sent, then it returns a null symbol.
     def getLastResponse(self, serverPort: int, senderPort: int) -> Optional[ConcreteSymbol]:
@@ -141,8 +409,17 @@ class Tracker(threading.Thread):
         self.trackPackets()
 
     def trackPackets(self) -> None:
-        self.pcap = open_live(self.interface, self.max_bytes, self.promiscuous, self.readTimeout)
-        self.pcap.setfilter("tcp and ip src " + str(self.serverIp))
-        while True:
-            (header, packet) = self.pcap.next()
-            self.callback(header, packet)
+        if self.captureBackend == "socket":
+            self.capture = SocketCapture(self.interface, self.max_bytes, self.readTimeout)
+        else:
+            self.capture = PcapCapture(self.interface, self.max_bytes, self.promiscuous, self.readTimeout)
+        # The first filter, for the flows watched before the capture was opened.
+        with self.captureLock:
+            self.filterVersion += 1
+        while not self.isStopped():
+            self.installFilter()
+            self.capture.dispatch(self.callback)
+        with self.captureLock:
+            self.capture.close()
+            self.capture = None
+            self.filterInstalled.notify_all()
@@ -0,0 +1,140 @@
+import array
+import socket
+import struct
+import sys
+import threading
+from typing import Optional
+
+from scapy.all import conf, get_if_hwaddr, send
+from scapy.layers.inet import IP, TCP
+from scapy.layers.l2 import getmacbyip
+from scapy.packet import Packet, Raw
+
+
+ETH_P_IP = 0x0800
+IP_HEADER_LENGTH = 20
+TCP_HEADER_LENGTH = 20
+WINDOW = 8192
+TTL = 64
+
+
+# Ones' complement sum of the 16-bit big-endian words of data, not yet folded.
+def wordSum(data: bytes) -> int:
+    if len(data) % 2 == 1:
+        data = data + b"\x00"
+    words = array.array("H", data)
+    if sys.byteorder == "little":
+        words.byteswap()
+    return sum(words)
+
+
+def fold(total: int) -> int:
+    while total > 0xFFFF:
+        total = (total & 0xFFFF) + (total >> 16)
+    return total
+
+
+# Sends the segments of one adapter to its SUT. With engine="scapy", the default, every segment goes through scapy's
+# send(). With engine="raw" one packet socket stays open for the lifetime of the adapter, and the Ethernet, IP and TCP
+# headers of every port pair are built once. Per segment only the lengths, seq, ack, flags and checksums are patched
+# in. The headers are the ones scapy would build: no IP options, DF, TTL 64, IP id 1, no TCP options and a window of
+# 8192. A packet socket, like scapy's, is not subject to iptables, which drops the RSTs of the kernel but must not drop
+# those of the learner. The MAC address of the next hop is resolved on the first segment, and again after a segment
+# failed to go out, as the SUT may not be up yet when the adapter starts, or come back on another address.
+class Transmitter:
+    def __init__(self, localAddress: str, impAddress: str, interface: str, engine: str = "scapy"):
+        self.localAddress: str = localAddress
+        self.impAddress: str = impAddress
+        self.interface: str = interface
+        self.connection: Packet = IP(src=localAddress, dst=impAddress, flags="DF", version=4)
+        self.socket: Optional[socket.socket] = None
+        self.lock = threading.Lock()
+        self.raw: bool = engine == "raw"
+        # Ethernet header of every frame, None until the MAC address of the next hop is resolved.
+        self.ethernet: Optional[bytes] = None
+        # Header templates and their partial TCP checksums, by port pair. Ports change on every reset.
+        self.templates: dict[tuple[int, int], tuple[bytes, int]] = dict()
+        if self.raw:
+            self.open()
+        elif engine != "scapy":
+            raise ValueError("Invalid transmitter engine:", engine)
+
+    def open(self) -> None:
+        self.source: bytes = socket.inet_aton(self.localAddress)
+        self.destination: bytes = socket.inet_aton(self.impAddress)
+        # Total length and checksum are left zero and patched in per segment.
+        self.ipHeader: bytes = struct.pack(
+            "!BBHHHBBH4s4s", 0x45, 0, 0, 1, 0x4000, TTL, socket.IPPROTO_TCP, 0, self.source, self.destination
+        )
+        self.ipSum: int = wordSum(self.ipHeader)
+        self.socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+        self.socket.bind((self.interface, 0))
+
+    def resolve(self) -> bytes:
+        # The next hop is the SUT itself, or the gateway towards it.
+        _, _, gateway = conf.route.route(self.impAddress)
+        destinationMac = getmacbyip(gateway if gateway != "0.0.0.0" else self.impAddress)
+        if destinationMac is None:
+            raise ValueError("Could not resolve the MAC address of", self.impAddress)
+        sourceMac = get_if_hwaddr(self.interface)
+        ethernet = bytes.fromhex(destinationMac.replace(":", "")) + bytes.fromhex(sourceMac.replace(":", ""))
+        return ethernet + struct.pack("!H", ETH_P_IP)
+
+    def template(self, sourcePort: int, destinationPort: int) -> tuple[bytes, int]:
+        key = (sourcePort, destinationPort)
+        template = self.templates.get(key)
+        if template is None:
+            if len(self.templates) >= 64:
+                self.templates.clear()
+            assert self.ethernet is not None
+            header = self.ethernet + self.ipHeader + struct.pack("!HHIIHHHH", sourcePort, destinationPort, 0, 0, 0, WINDOW, 0, 0)
+            # Pseudo header without the TCP length, ports, window and urgent pointer.
+            partial = wordSum(self.source) + wordSum(self.destination) + socket.IPPROTO_TCP + sourcePort + destinationPort + WINDOW
+            template = (header, partial)
+            self.templates[key] = template
+        return template
+
+    def send(self, packet: Packet) -> None:
+        if not self.raw:
+            # A single packet, as newer scapy cannot pick the interface of a list of them.
+            send(self.connection / packet, iface=self.interface, verbose=True)
+            return
+        tcp = packet[TCP]
+        payload = bytes(tcp[Raw].load) if Raw in tcp else b""
+        self.sendSegment(tcp.sport, tcp.dport, tcp.seq, tcp.ack, int(tcp.flags), payload)
+
+    def sendSegment(self, sourcePort: int, destinationPort: int, seq: int, ack: int, flags: int, payload: bytes) -> None:
+        assert self.socket is not None
+        with self.lock:
+            if self.ethernet is None:
+                self.ethernet = self.resolve()
+            frame = self.frame(sourcePort, destinationPort, seq, ack, flags, payload)
+            try:
+                self.socket.send(frame)
+            except OSError:
+                # The templates hold the old next hop, both are built anew for the next segment.
+                self.ethernet = None
+                self.templates.clear()
+                raise
+
+    def frame(self, sourcePort: int, destinationPort: int, seq: int, ack: int, flags: int, payload: bytes) -> bytearray:
+        header, partial = self.template(sourcePort, destinationPort)
+        frame = bytearray(header)
+        tcpLength = TCP_HEADER_LENGTH + len(payload)
+        totalLength = IP_HEADER_LENGTH + tcpLength
+        offsetFlags = (TCP_HEADER_LENGTH // 4) << 12 | flags
+        ipChecksum = 0xFFFF - fold(self.ipSum + totalLength)
+        tcpSum = partial + tcpLength + (seq >> 16) + (seq & 0xFFFF) + (ack >> 16) + (ack & 0xFFFF) + offsetFlags + wordSum(payload)
+        tcpChecksum = 0xFFFF - fold(tcpSum)
+        ip = len(header) - IP_HEADER_LENGTH - TCP_HEADER_LENGTH
+        struct.pack_into("!H", frame, ip + 2, totalLength)
+        struct.pack_into("!H", frame, ip + 10, ipChecksum)
+        struct.pack_into("!IIH", frame, ip + IP_HEADER_LENGTH + 4, seq, ack, offsetFlags)
+        struct.pack_into("!H", frame, ip + IP_HEADER_LENGTH + 16, tcpChecksum)
+        frame += payload
+        return frame
+
+    def stop(self) -> None:
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
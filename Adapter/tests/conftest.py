@@ -0,0 +1,24 @@
+import os
+import shutil
+
+import pytest
+
+from Mapper import JAVA_MAPPER
+
+MAP_FILE = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "Mapper", "resources", "linux.map")
+
+
+@pytest.fixture
+def mapFile() -> str:
+    return MAP_FILE
+
+
+# The command of a built Java mapper, from $JAVA_MAPPER or the Docker image's, as the differential tests need one.
+@pytest.fixture
+def javaMapper() -> str:
+    command = os.environ.get("JAVA_MAPPER")
+    if command is not None:
+        return command
+    if shutil.which("java") is None or not os.path.exists("/code/Mapper/dist/TCPMapper.jar"):
+        pytest.skip("No built Java mapper, set JAVA_MAPPER to the command of one.")
+    return JAVA_MAPPER
@@ -0,0 +1,64 @@
+import pytest
+from scapy.layers.inet import IP, TCP, UDP
+from scapy.layers.l2 import Dot1Q, Ether
+from scapy.packet import Padding
+
+from FrameDecoder import decodeFrame
+
+SEGMENTS = [
+    TCP(sport=20, dport=44344, flags="S", seq=1, window=8192),
+    TCP(sport=44344, dport=20, flags="SA", seq=4294967295, ack=2, window=65535, urgptr=7),
+    TCP(sport=20, dport=44344, flags="PA", seq=2, ack=1, options=[("MSS", 1460), ("NOP", None), ("WScale", 7)]) / b"data",
+    TCP(sport=20, dport=44344, flags="FPUAEN", reserved=5, seq=3, ack=1) / (b"x" * 100),
+]
+
+
+# Field by field as scapy reads the same frame. Scapy counts the NS bit among the flags, the decoder, like impacket,
+# among the four reserved bits.
+def assertDecodes(frame: bytes) -> None:
+    segment = decodeFrame(frame)
+    assert segment is not None
+    tcp = Ether(frame)[TCP]
+    reserved, flags = tcp.reserved << 1 | int(tcp.flags) >> 8, int(tcp.flags) & 0xFF
+    assert (segment.sourcePort, segment.destinationPort) == (tcp.sport, tcp.dport)
+    assert segment.fields() == (tcp.seq, tcp.ack, tcp.dataofs, reserved, flags, tcp.window, tcp.chksum, tcp.urgptr)
+    payload = tcp.payload
+    assert segment.payload() == (bytes(payload) if not isinstance(payload, Padding) else b"")
+
+
+@pytest.mark.parametrize("segment", SEGMENTS)
+def test_decodes_like_scapy(segment):
+    assertDecodes(bytes(Ether() / IP(src="10.0.0.1", dst="10.0.0.2") / segment))
+
+
+@pytest.mark.parametrize("segment", SEGMENTS)
+def test_decodes_vlan_and_ip_options(segment):
+    assertDecodes(bytes(Ether() / Dot1Q(vlan=5) / IP(src="10.0.0.1", dst="10.0.0.2", options=b"\x01\x01\x01\x00") / segment))
+
+
+def test_ethernet_padding_is_not_payload():
+    frame = bytes(Ether() / IP() / TCP(flags="A"))
+    assert len(frame) < 60
+    segment = decodeFrame(frame + b"\x00" * (60 - len(frame)))
+    assert segment is not None and segment.payload() == b""
+
+
+def test_zero_total_length_reaches_the_end_of_the_frame():
+    frame = bytearray(bytes(Ether() / IP() / TCP(flags="PA") / b"data"))
+    frame[16:18] = b"\x00\x00"
+    segment = decodeFrame(bytes(frame))
+    assert segment is not None and segment.payload() == b"data"
+
+
+@pytest.mark.parametrize(
+    "frame",
+    [
+        bytes(Ether() / IP() / UDP()),
+        bytes(Ether(type=0x86DD) / (b"\x60" + b"\x00" * 60)),
+        bytes(Ether() / IP() / TCP())[:40],
+        bytes(Ether() / IP(len=30) / TCP()),
+        b"",
+    ],
+)
+def test_frames_without_a_segment(frame):
+    assert decodeFrame(frame) is None
@@ -0,0 +1,29 @@
+from scapy.layers.inet import TCP
+
+from AbstractSymbol import AbstractSymbol
+from ConcreteSymbol import ConcreteSymbol
+from Mapper import Mapper, MapperPool
+
+
+# A handshake through a Java mapper, as the adapter steps it: a reset with the SYN, the SYN+ACK of the SUT and an ACK.
+def handshake(mapper: Mapper) -> tuple[str, int, int]:
+    mapper.reset()
+    _, syn = mapper.step(None, AbstractSymbol("SYN(?,?,0)"))
+    assert syn is not None and syn.flags == "S"
+    response = ConcreteSymbol(TCP(flags="SA", seq=100, ack=syn.seq + 1))
+    abstract, ack = mapper.step(response, AbstractSymbol("ACK(?,?,0)"))
+    assert abstract is not None and ack is not None
+    return str(abstract), ack.seq - syn.seq, ack.ack
+
+
+def test_framed_matches_line_protocol(javaMapper):
+    answers = {}
+    for protocol in ["line", "framed"]:
+        pool = MapperPool(protocol, size=0, command=javaMapper)
+        mapper = Mapper(0, engine="java", protocol=protocol, pool=pool)
+        try:
+            answers[protocol] = handshake(mapper)
+        finally:
+            mapper.stop()
+            pool.stop()
+    assert answers["framed"] == answers["line"] == ("SYN+ACK(FRESH,NEXT,0)", 1, 101)
@@ -0,0 +1,41 @@
+import pytest
+
+from CheckMapper import check
+from Invlang import ERROR, InvlangMapper
+from Mapper import Mapper, MapperError
+
+
+def test_engine_matches_java_mapper(mapFile, javaMapper):
+    assert check(200, 30, 0, mapFile, javaMapper) == 0
+
+
+def test_concretize_answers_invalid_symbols(mapFile):
+    mapper = InvlangMapper(mapFile)
+    assert mapper.handle("CONCRETIZE 1 2 garbage") == [ERROR]
+    assert mapper.handle("CONCRETIZE 1") == [ERROR]
+    assert mapper.handle("ABSTRACT garbage") == [ERROR]
+
+
+def test_concretize_uses_given_numbers(mapFile):
+    mapper = InvlangMapper(mapFile)
+    assert mapper.handle("CONCRETIZE 5 6 SYN(?,?,0)") == ["SYN(5,6,0)"]
+
+
+def test_mapper_raises_on_error_reply(mapFile):
+    mapper = Mapper(0, engine="python", mapFile=mapFile)
+    with pytest.raises(ValueError):
+        mapper.send("CONCRETIZE 1 2 garbage")
+    mapper.stop()
+
+
+def test_engine_errors_are_mapper_errors(mapFile):
+    mapper = Mapper(0, engine="python", mapFile=mapFile)
+    with pytest.raises(MapperError):
+        mapper.send("BOGUS SYN(1,2,0)")
+    # Replacing the engine starts it over on a new port, like a fresh process.
+    assert mapper.engine is not None
+    mapper.send("ABSTRACT SYN(?,?,0)")
+    port = mapper.sourcePort
+    mapper.replace()
+    assert mapper.sourcePort != port and mapper.engine.state == mapper.engine.program.initial()
+    mapper.stop()
@@ -0,0 +1,21 @@
+from LatencyEstimator import LatencyEstimator
+
+
+def test_estimate_follows_new_samples():
+    estimator = LatencyEstimator(1.0, minSamples=5, minimum=0.0, margin=0.0, factor=1.0, percentile=1.0)
+    assert estimator.timeoutFor("SYN(?,?,0)", "RESET") == 1.0
+    for _ in range(5):
+        estimator.record("SYN(?,?,0)", "RESET", 0.1)
+    assert estimator.timeoutFor("SYN(?,?,0)", "RESET") == 0.1
+    estimator.cooldown = 0
+    estimator.record("SYN(?,?,0)", "RESET", 0.2)
+    assert estimator.timeoutFor("SYN(?,?,0)", "RESET") == 0.2
+
+
+def test_late_response_falls_back_to_ceiling():
+    estimator = LatencyEstimator(1.0, minSamples=1, cooldown=2)
+    estimator.record("ACK(?,?,0)", "RESET", 0.001)
+    assert estimator.timeoutFor("ACK(?,?,0)", "RESET") < 1.0
+    estimator.recordLate("ACK(?,?,0)", "RESET")
+    timeouts = [estimator.timeoutFor("ACK(?,?,0)", "RESET") for _ in range(3)]
+    assert timeouts[:2] == [1.0, 1.0] and timeouts[2] < 1.0
@@ -0,0 +1,185 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import pytest
+from scapy.layers.inet import TCP
+
+from AbstractSymbol import AbstractOrderedPair, AbstractSymbol
+from ConcreteSymbol import ConcreteOrderedPair, ConcreteSymbol
+from OracleTable import OracleTable, OracleWriterError
+
+WORDS = [
+    ("SYN(?,?,0) ACK(?,?,0)", "SYN+ACK(?,?,0) None"),
+    ("SYN(?,?,0) ACK(?,?,0) ACK+FIN(?,?,0)", "SYN+ACK(?,?,0) None ACK(?,?,0)"),
+    ("SYN(?,?,0)", "SYN+ACK(?,?,0)"),
+    ("SYN+ACK(?,?,0)", "RST(?,?,0)"),
+    ("ACK(?,?,0)", "RST(?,?,0)"),
+]
+
+
+def trace(inputs: str, outputs: str) -> tuple[AbstractOrderedPair, ConcreteOrderedPair]:
+    abstractInputs: list[Optional[AbstractSymbol]] = [AbstractSymbol(symbol) for symbol in inputs.split(" ")]
+    abstractOutputs = [AbstractSymbol(symbol) if symbol != "None" else None for symbol in outputs.split(" ")]
+    concreteInputs: list[Optional[ConcreteSymbol]] = [ConcreteSymbol(TCP(flags="S", seq=seq, ack=0)) for seq in range(len(abstractInputs))]
+    concreteOutputs = [ConcreteSymbol(TCP(flags="SA", seq=100, ack=1)) if output is not None else None for output in abstractOutputs]
+    return AbstractOrderedPair(abstractInputs, abstractOutputs), ConcreteOrderedPair(concreteInputs, concreteOutputs)
+
+
+# A file database, as SQLite connections in memory are not shared between threads.
+def filled(path, schema: str, **options) -> OracleTable:
+    table = OracleTable("sqlite:///" + str(path / "oracle.db"), schema=schema, **options)
+    for inputs, outputs in WORDS:
+        table.add(*trace(inputs, outputs))
+    return table
+
+
+@pytest.mark.parametrize("schema", ["mapping", "trace", "unique"])
+def test_words_round_trip(tmp_path, schema):
+    table = filled(tmp_path, schema)
+    assert sorted(table.words(batchSize=2)) == sorted(WORDS)
+    assert len(list(table.abstractPairs(batchSize=2))) == len(WORDS)
+    assert len(list(table.concretePairs(batchSize=2))) == len(WORDS)
+
+
+@pytest.mark.parametrize("schema", ["mapping", "trace", "unique"])
+def test_prefix_is_matched_per_symbol(tmp_path, schema):
+    table = filled(tmp_path, schema)
+    expected = sorted(WORDS[:3])
+    assert sorted(table.wordsWithPrefix("SYN(?,?,0)")) == expected
+    selected = list(table.selectTraces(prefix="SYN(?,?,0)", batchSize=1))
+    assert len(selected) == 3
+    # SYN+ACK starts with the same characters as SYN, but not with the same symbol.
+    assert table.wordsWithPrefix("SYN") == []
+
+
+@pytest.mark.parametrize("schema", ["trace", "unique"])
+def test_select_traces_by_time(tmp_path, schema):
+    table = filled(tmp_path, schema)
+    now = datetime.now(timezone.utc)
+    assert len(list(table.selectTraces(since=now - timedelta(minutes=1)))) == len(WORDS)
+    assert list(table.selectTraces(until=now - timedelta(minutes=1))) == []
+
+
+def test_mapping_has_no_times(tmp_path):
+    table = filled(tmp_path, "mapping")
+    with pytest.raises(ValueError):
+        list(table.selectTraces(since=datetime.now(timezone.utc)))
+
+
+@pytest.mark.parametrize("schema", ["mapping", "trace", "unique"])
+def test_readers_do_not_block_writers(tmp_path, schema):
+    table = filled(tmp_path, schema)
+    # The table lock is free between batches, so adding from inside the loop must not deadlock.
+    for _ in table.storedTraces(batchSize=1):
+        table.add(*trace("ACK+FIN(?,?,0)", "RST(?,?,0)"))
+        break
+    assert ("ACK+FIN(?,?,0)", "RST(?,?,0)") in list(table.words())
+
+
+def test_unique_counts_repeats_and_keeps_samples(tmp_path):
+    table = filled(tmp_path, "unique", maxSamples=2)
+    for _ in range(3):
+        table.add(*trace(*WORDS[0]))
+    assert sorted(table.words()) == sorted(WORDS)
+    # The first trace and one repeat are kept as samples, the other repeats only counted.
+    assert len(list(table.storedTraces())) == len(WORDS) + 1
+
+
+@pytest.mark.parametrize("schema", ["trace", "unique"])
+def test_migrate_copies_the_mapping_table_once(tmp_path, schema):
+    filled(tmp_path, "mapping")
+    table = OracleTable("sqlite:///" + str(tmp_path / "oracle.db"), schema=schema)
+    assert table.migrate(batchSize=2) == len(WORDS)
+    assert table.migrate(batchSize=2) == 0
+    assert sorted(table.words()) == sorted(WORDS)
+
+
+def test_writer_commits_in_the_background(tmp_path):
+    table = filled(tmp_path, "trace", writer={"batchSize": 2, "flushInterval": 10})
+    table.flush()
+    assert sorted(table.words()) == sorted(WORDS)
+    assert table.stats()["rows"] == len(WORDS)
+    table.stop()
+
+
+# Fails the first failures commits, and every commit while the database is down.
+def failing(table: OracleTable, down: list[bool], failures: int = 0) -> None:
+    writer = table.writer
+    assert writer is not None
+    write = writer.write
+    calls = []
+
+    def write_(session, batch):
+        calls.append(len(batch))
+        if down[0] or len(calls) <= failures:
+            raise OSError("database is down")
+        write(session, batch)
+
+    writer.write = write_
+
+
+def waitFor(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_writer_retries_a_failed_commit(tmp_path):
+    table = OracleTable("sqlite:///" + str(tmp_path / "oracle.db"), schema="trace", writer={"flushInterval": 1, "retryDelay": 10})
+    failing(table, [False], failures=1)
+    table.add(*trace(*WORDS[0]))
+    # Retried on its own, without another add() or flush().
+    assert waitFor(lambda: table.stats()["rows"] == 1)
+    assert table.stats()["failedCommits"] == 1 and table.stats()["failedTraces"] == 0
+    assert table.stats()["lastError"] is None
+    table.stop()
+    assert list(table.words()) == [WORDS[0]]
+
+
+def test_writer_keeps_traces_while_the_database_is_down(tmp_path):
+    table = OracleTable("sqlite:///" + str(tmp_path / "oracle.db"), schema="trace", writer={"flushInterval": 1, "retryDelay": 10})
+    down = [True]
+    failing(table, down)
+    for inputs, outputs in WORDS[:3]:
+        table.add(*trace(inputs, outputs))
+    table.flush()
+    assert waitFor(lambda: table.stats()["failedTraces"] == 3)
+    assert table.stats()["lastError"] == "database is down"
+    # The learner goes on adding traces, which are kept along with the others.
+    for inputs, outputs in WORDS[3:]:
+        table.add(*trace(inputs, outputs))
+    assert waitFor(lambda: table.stats()["failedTraces"] == len(WORDS))
+    down[0] = False
+    assert waitFor(lambda: table.stats()["rows"] == len(WORDS))
+    assert table.stats()["failedTraces"] == 0
+    table.stop()
+    assert sorted(table.words()) == sorted(WORDS)
+
+
+def test_writer_blocks_once_max_queue_traces_are_kept(tmp_path):
+    writer = {"batchSize": 2, "flushInterval": 1, "retryDelay": 10, "maxQueue": 2}
+    table = OracleTable("sqlite:///" + str(tmp_path / "oracle.db"), schema="trace", writer=writer)
+    down = [True]
+    failing(table, down)
+    adding = threading.Thread(target=lambda: [table.add(*trace(inputs, outputs)) for inputs, outputs in WORDS * 4])
+    adding.start()
+    adding.join(0.2)
+    # At most a batch past maxQueue is kept, and maxQueue more wait in the queue.
+    assert adding.is_alive() and table.stats()["failedTraces"] <= 2 + 1
+    down[0] = False
+    adding.join(2.0)
+    assert not adding.is_alive()
+    table.stop()
+    assert sorted(table.words()) == sorted(WORDS * 4)
+
+
+def test_writer_stop_reports_lost_traces(tmp_path):
+    table = OracleTable("sqlite:///" + str(tmp_path / "oracle.db"), schema="trace", writer={"flushInterval": 1, "retryDelay": 10})
+    failing(table, [True])
+    table.add(*trace(*WORDS[0]))
+    with pytest.raises(OracleWriterError):
+        table.stop()
+    assert table.stats() == {}
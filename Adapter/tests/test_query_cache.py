@@ -0,0 +1,65 @@
+from QueryCache import QueryCache, QueryTrie, maximalWords, prefixAnswers
+
+
+def test_prefixes_are_answered_from_stored_words():
+    cache = QueryCache()
+    cache.put("SYN ACK ACK+PSH", "SYN+ACK None ACK")
+    assert cache.get("SYN ACK") == "SYN+ACK None"
+    assert cache.get("SYN ACK ACK+PSH") == "SYN+ACK None ACK"
+    assert cache.get("ACK") is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_conflict_drops_the_outputs_below_it():
+    cache = QueryCache()
+    cache.put("SYN ACK ACK+PSH", "SYN+ACK None ACK")
+    assert cache.get("SYN ACK ACK+PSH") is not None
+    cache.put("SYN ACK", "SYN+ACK RST")
+    assert cache.get("SYN ACK") == "SYN+ACK RST"
+    # Followed the old output of ACK, so neither the trie nor the recent answers may still have it.
+    assert cache.get("SYN ACK ACK+PSH") is None
+    assert cache.stats()["conflicts"] == 1
+    assert cache.stats()["trieNodes"] == 2
+
+
+def test_trie_stops_growing_at_its_size():
+    trie = QueryTrie()
+    assert trie.insert(["SYN", "ACK"], ["SYN+ACK", "None"], maxSize=2)
+    assert not trie.insert(["ACK"], ["RST"], maxSize=2)
+    assert trie.lookup(["ACK"]) is None
+
+
+def test_cache_evicts_least_recently_used_answers():
+    cache = QueryCache(maxEntries=2, maxTrieNodes=0)
+    cache.put("SYN", "SYN+ACK")
+    cache.put("ACK", "RST")
+    assert cache.get("SYN") == "SYN+ACK"
+    cache.put("FIN", "RST")
+    assert cache.get("ACK") is None
+    assert cache.get("SYN") == "SYN+ACK"
+
+
+def test_load_warms_the_trie():
+    cache = QueryCache()
+    cache.load([(["SYN", "ACK"], ["SYN+ACK", "None"]), (["ACK"], ["RST"])])
+    assert cache.get("SYN") == "SYN+ACK"
+    assert cache.get("ACK") == "RST"
+
+
+def test_maximal_words_skip_prefixes():
+    queries = ["SYN", "SYN ACK", "SYN ACK FIN", "ACK", "SYN RST"]
+    assert sorted(maximalWords(queries)) == ["ACK", "SYN ACK FIN", "SYN RST"]
+    assert maximalWords(["SYN", "SYN"]) == ["SYN"]
+
+
+def test_prefix_answers_follow_the_queries():
+    queries = ["SYN", "SYN ACK", "ACK", "SYN ACK FIN"]
+    words = maximalWords(queries)
+    answers = {"SYN ACK FIN": "SYN+ACK None ACK", "ACK": "RST"}
+    assert prefixAnswers(queries, words, [answers[word] for word in words]) == ["SYN+ACK", "SYN+ACK None", "RST", "SYN+ACK None ACK"]
+
+
+def test_prefix_answers_come_from_one_word():
+    queries = ["SYN ACK", "SYN RST"]
+    answers = prefixAnswers(queries, queries, ["SYN+ACK None", "None None"])
+    assert answers == ["SYN+ACK None", "None None"]
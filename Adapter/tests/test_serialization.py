@@ -0,0 +1,89 @@
+import json
+from typing import Optional
+
+import pytest
+from scapy.layers.inet import TCP
+
+from AbstractSymbol import AbstractOrderedPair, AbstractSymbol
+from ConcreteSymbol import ConcreteOrderedPair, ConcreteSymbol
+from OracleTable import ENCODINGS, OracleTable
+
+
+def abstractPair() -> AbstractOrderedPair:
+    symbols = ["SYN(?,?,0)", "ACK+PSH(CURRENT,NEXT,10)", "RST(ZERO,4294967295,?)"]
+    inputs: list[Optional[AbstractSymbol]] = [AbstractSymbol(symbol) for symbol in symbols]
+    return AbstractOrderedPair(inputs, [AbstractSymbol("SYN+ACK(FRESH,NEXT,0)"), None, None])
+
+
+def concretePair() -> ConcreteOrderedPair:
+    syn = ConcreteSymbol(TCP(sport=20, dport=44344, flags="S", seq=4294967295, window=8192, chksum=0xBEEF))
+    data = ConcreteSymbol(TCP(sport=20, dport=44344, flags="PA", seq=1, ack=101, urgptr=3) / "dätä".encode("utf-8"))
+    # Symbols built by scapy leave the data offset and checksum to be computed.
+    assert data.dataOffset is None and data.checksum is None
+    return ConcreteOrderedPair([syn, data], [ConcreteSymbol("SYN+ACK(100,0,0)"), None])
+
+
+def assertSameAbstract(pair: AbstractOrderedPair, other: AbstractOrderedPair) -> None:
+    assert str(other) == str(pair)
+    for symbol, otherSymbol in zip(pair.abstractInputs + pair.abstractOutputs, other.abstractInputs + other.abstractOutputs):
+        assert (symbol is None) == (otherSymbol is None)
+        if symbol is not None and otherSymbol is not None:
+            assert symbol.flags is otherSymbol.flags
+            assert symbol.seqNumber == otherSymbol.seqNumber and symbol.ackNumber == otherSymbol.ackNumber
+            assert symbol.payloadLength == otherSymbol.payloadLength
+
+
+def assertSameConcrete(pair: ConcreteOrderedPair, other: ConcreteOrderedPair) -> None:
+    symbols = pair.concreteInputs + pair.concreteOutputs
+    otherSymbols = other.concreteInputs + other.concreteOutputs
+    assert [symbol.toList() if symbol is not None else None for symbol in symbols] == [
+        symbol.toList() if symbol is not None else None for symbol in otherSymbols
+    ]
+
+
+def test_abstract_round_trips():
+    pair = abstractPair()
+    assertSameAbstract(pair, AbstractOrderedPair.fromJSON(pair.toJSON()))
+    assertSameAbstract(pair, AbstractOrderedPair.fromJSON(pair.toCompactJSON()))
+    assertSameAbstract(pair, AbstractOrderedPair.fromBytes(pair.toBytes()))
+
+
+def test_concrete_round_trips():
+    pair = concretePair()
+    assertSameConcrete(pair, ConcreteOrderedPair.fromJSON(pair.toJSON()))
+    assertSameConcrete(pair, ConcreteOrderedPair.fromJSON(pair.toCompactJSON()))
+    assertSameConcrete(pair, ConcreteOrderedPair.fromBytes(pair.toBytes()))
+
+
+def test_symbols_read_at_an_offset():
+    symbol = concretePair().concreteInputs[1]
+    assert symbol is not None
+    data = b"\xff" + symbol.toBytes() + b"\xff"
+    decoded, end = ConcreteSymbol.fromBytes(data, 1)
+    assert decoded.toList() == symbol.toList() and end == len(data) - 1
+    abstract = AbstractSymbol("ACK(NEXT,CURRENT,1)")
+    assert str(AbstractSymbol.fromBytes(b"\xff" + abstract.toBytes(), 1)) == str(abstract)
+
+
+# Traces stored before the explicit encoding, in the form jsons gave them.
+def test_reads_the_stored_json_form():
+    abstract = {
+        "ackNumber": "NEXT",
+        "flags": {"ACK": True, "CWR": False, "ECE": False, "FIN": False, "PSH": False, "RST": False, "SYN": True, "URG": False},
+        "payloadLength": 0,
+        "seqNumber": "FRESH",
+    }
+    assert json.loads(abstractPair().toJSON())["abstractOutputs"][0] == abstract
+    stored = {"abstractInputs": [abstract], "abstractOutputs": [None]}
+    assert str(AbstractOrderedPair.fromJSON(stored)) == "([SYN+ACK(FRESH,NEXT,0)],[None])"
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+@pytest.mark.parametrize("schema", ["mapping", "trace", "unique"])
+def test_oracle_table_round_trips(tmp_path, schema, encoding):
+    table = OracleTable("sqlite:///" + str(tmp_path / "oracle.db"), schema=schema, encoding=encoding)
+    table.add(abstractPair(), concretePair())
+    (abstract,) = table.abstractPairs()
+    (concrete,) = table.concretePairs()
+    assertSameAbstract(abstractPair(), abstract)
+    assertSameConcrete(concretePair(), concrete)
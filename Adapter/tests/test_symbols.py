@@ -0,0 +1,59 @@
+import json
+import pickle
+
+import pytest
+from scapy.layers.inet import TCP
+
+from AbstractSymbol import AbstractSymbol, Value
+from ConcreteSymbol import ConcreteSymbol
+from TCP import FlagSet
+
+
+def test_flag_sets_are_interned():
+    assert FlagSet("SA") is FlagSet("AS") is FlagSet.fromBits(0x12)
+    assert FlagSet("SA") is pickle.loads(pickle.dumps(FlagSet("SA")))
+    # Bits above the flags byte, such as the NS bit, belong to no flag set.
+    assert FlagSet.fromBits(0x110) is FlagSet("A")
+
+
+def test_flag_set_spellings():
+    flags = FlagSet("FA")
+    assert flags.ACK and flags.FIN and not flags.SYN
+    assert flags.asHuman() == "ACK+FIN" and flags.asScapy() == "AF"
+    assert flags.getFlags() == ["ACK", "FIN"]
+    assert flags.asDict() == {"ACK": True, "CWR": False, "ECE": False, "FIN": True, "PSH": False, "RST": False, "SYN": False, "URG": False}
+
+
+@pytest.mark.parametrize("text", ["SYN(?,?,0)", "SYN+ACK(FRESH,NEXT,0)", "ACK+PSH(CURRENT,NEXT,10)", "RST(ZERO,12,?)"])
+def test_abstract_symbol_prints_as_parsed(text):
+    assert str(AbstractSymbol(text)) == text
+
+
+def test_abstract_symbol_fields():
+    symbol = AbstractSymbol("ACK+SYN(FRESH,12,?)")
+    assert symbol.flags is FlagSet("SA")
+    assert (symbol.seqNumber, symbol.ackNumber, symbol.payloadLength) == (Value.FRESH, 12, None)
+    assert str(symbol) == "SYN+ACK(FRESH,12,?)"
+    with pytest.raises(ValueError):
+        AbstractSymbol("SYN")
+
+
+def test_symbols_have_no_dict():
+    with pytest.raises(AttributeError):
+        setattr(AbstractSymbol("SYN(?,?,0)"), "extra", 1)
+    with pytest.raises(AttributeError):
+        setattr(ConcreteSymbol("SYN(1,0,0)"), "extra", 1)
+
+
+def test_concrete_symbol_from_scapy_and_text():
+    symbol = ConcreteSymbol(TCP(sport=20, dport=44344, flags="PA", seq=7, ack=9) / b"data")
+    assert (symbol.sourcePort, symbol.destinationPort, symbol.seqNumber, symbol.ackNumber) == (20, 44344, 7, 9)
+    assert symbol.flags is FlagSet("PA") and symbol.payload == "data"
+    assert str(symbol) == "ACK+PSH(7,9,4)"
+    assert str(ConcreteSymbol("ACK+PSH(7,9,4)")) == "ACK+PSH(7,9,4)"
+
+
+def test_symbols_serialize_their_flags_by_name():
+    flags = json.loads(AbstractSymbol("SYN+ACK(FRESH,NEXT,0)").toJSON())["flags"]
+    assert flags == FlagSet("SA").asDict()
+    assert json.loads(ConcreteSymbol("RST(1,0,0)").toJSON())["flags"] == FlagSet("R").asDict()
@@ -137,6 +137,16 @@ public class InvlangMapper implements MapperInterface {
 	 */
 	@Override
 	public String processIncomingResponse(FlagSet flags, long seqNr, long ackNr, int payloadLength) {
+		EnumValue[] abstractNumbers = abstractIncomingResponse(flags, seqNr, ackNr, payloadLength);
+		return Serializer.abstractMessageToString(flags, abstractNumbers[0].getValue(), abstractNumbers[1].getValue(), payloadLength);
+	}
+
+	/**
+	 * Runs the incoming response through the mapper
+	 * 
+	 * @return the abstract sequence and acknowledgement numbers
+	 */
+	protected EnumValue[] abstractIncomingResponse(FlagSet flags, long seqNr, long ackNr, int payloadLength) {
 		handler.setFlags(Inputs.FLAGS, flags);
 		handler.setInt(Inputs.CONC_DATA, payloadLength);
 		handler.setInt(Inputs.CONC_SEQ, (int) seqNr);
@@ -144,7 +154,7 @@ public class InvlangMapper implements MapperInterface {
 		handler.execute(Mappings.INCOMING_RESPONSE);
 		EnumValue absSeq = handler.getEnumResult(Inputs.ABS_SEQ);
 		EnumValue absAck = handler.getEnumResult(Inputs.ABS_ACK);
-		return Serializer.abstractMessageToString(flags, absSeq.getValue(), absAck.getValue(), payloadLength);
+		return new EnumValue[] { absSeq, absAck };
 	}
 
 	/*
@@ -3,17 +3,29 @@ import invlang.types.FlagSet;
 import util.Calculator;
 import util.exceptions.BugException;
 
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.EOFException;
 import java.io.File;
 import java.io.IOException;
+import java.nio.charset.StandardCharsets;
 import java.util.ArrayList;
 import java.util.Arrays;
 import java.util.List;
 import java.util.Map.Entry;
 import java.util.Scanner;
+import java.util.TreeMap;
 import java.util.regex.Matcher;
 import java.util.regex.Pattern;
 
 public class Mapper extends InvlangMapper {
+    private static final Pattern SYMBOL = Pattern.compile("([A-Z+]+)\\(([0-9?]+),([0-9?]+),([0-9?]+)\\)");
+    /**
+     * The reply to a command without a valid symbol.
+     */
+    private static final String ERROR = "ERROR";
 
     public Mapper() throws IOException {
         super();
@@ -34,16 +46,27 @@ public class Mapper extends InvlangMapper {
 
     public String processOutgoingRequest(FlagSet flags, String absSeq,
             String absAck, int payloadLength) {
-        Integer lastLearnedSeqInt = (Integer) handler.getState().get("lastLearnerSeq");
-        Integer concSeq;
+        Integer concSeq = randomSeq();
+        Integer concAck = (int) Calculator.randWithinRange(1000L, 0xffffL);
+        return processOutgoingRequest(flags, absSeq, absAck, payloadLength, concSeq, concAck);
+    }
 
-        if (lastLearnedSeqInt == null || lastLearnedSeqInt == InvlangMapper.NOT_SET) {
-            concSeq = (int) Calculator.randWithinRange(1000L, 0xffffL);
-        } else {
-            concSeq = (int) Calculator.sum(lastLearnedSeqInt, Calculator.randWithinRange(70000, 100000));
-        }
+    /**
+     * Concretizes starting from the given random draws for the sequence and acknowledgement numbers.
+     */
+    public String processOutgoingRequest(FlagSet flags, String absSeq,
+            String absAck, int payloadLength, Integer concSeq, Integer concAck) {
+        long[] concreteNumbers = concretize(flags, absSeq, absAck, payloadLength, concSeq, concAck);
+        return Serializer.concreteMessageToString(flags, concreteNumbers[0], concreteNumbers[1], payloadLength);
+    }
 
-        Integer concAck = (int) Calculator.randWithinRange(1000L, 0xffffL);
+    /**
+     * Finds and commits to concrete numbers, starting from the given random draws.
+     *
+     * @return the unsigned sequence and acknowledgement numbers
+     */
+    private long[] concretize(FlagSet flags, String absSeq,
+            String absAck, int payloadLength, Integer concSeq, Integer concAck) {
         boolean isChecked = false;
         if (checkIfValidConcretization(flags, absSeq, concSeq, absAck, concAck, payloadLength)) {
             isChecked = true;
@@ -89,8 +112,16 @@ public class Mapper extends InvlangMapper {
                     + "\n" + Arrays.asList(Thread.currentThread().getStackTrace()));
         } else {
             updateMapperWithConcretization(flags, concSeq, concAck, payloadLength);
-            long lConcSeq = getUnsignedInt(concSeq), lConcAck = getUnsignedInt(concAck);
-            return Serializer.concreteMessageToString(flags, lConcSeq, lConcAck, payloadLength);
+            return new long[] { getUnsignedInt(concSeq), getUnsignedInt(concAck) };
+        }
+    }
+
+    private Integer randomSeq() {
+        Integer lastLearnedSeqInt = (Integer) handler.getState().get("lastLearnerSeq");
+        if (lastLearnedSeqInt == null || lastLearnedSeqInt == InvlangMapper.NOT_SET) {
+            return (int) Calculator.randWithinRange(1000L, 0xffffL);
+        } else {
+            return (int) Calculator.sum(lastLearnedSeqInt, Calculator.randWithinRange(70000, 100000));
         }
     }
 
@@ -137,10 +168,100 @@ public class Mapper extends InvlangMapper {
 
     }
 
+    /**
+     * The state as space separated name=value pairs, ordered by name, with signed integers.
+     */
+    public String stateToString() {
+        StringBuilder sb = new StringBuilder();
+        for (Entry<String, Object> entry : new TreeMap<String, Object>(this.handler.getState()).entrySet()) {
+            if (sb.length() > 0) {
+                sb.append(" ");
+            }
+            sb.append(entry.getKey()).append("=").append(entry.getValue());
+        }
+        return sb.toString();
+    }
+
+    /**
+     * Framed protocol: abstracts a response given as "FLAGS,seq,ack,length", or "-" for none,
+     * into "initials,ABSSEQ,ABSACK,length".
+     */
+    private String abstractFramed(String response) {
+        if (response.equals("-")) {
+            return "-";
+        }
+        String[] fields = response.split(",", -1);
+        FlagSet flags = new FlagSet(fields[0]);
+        int payloadLength = Integer.parseInt(fields[3]);
+        EnumValue[] abstractNumbers = abstractIncomingResponse(flags, Long.parseLong(fields[1]), Long.parseLong(fields[2]),
+                payloadLength);
+        return new String(flags.toInitials()) + "," + abstractNumbers[0].getValue() + "," + abstractNumbers[1].getValue() + ","
+                + payloadLength;
+    }
+
+    /**
+     * Framed protocol: concretizes an input given as "FLAGS,length", or "-" for none, into "initials,seq,ack,length".
+     */
+    private String concretizeFramed(String input) {
+        if (input.equals("-")) {
+            return "-";
+        }
+        String[] fields = input.split(",", -1);
+        if (fields[0].equals("RST")) {
+            long learnerSeq = getUnsignedInt((int) this.handler.getState().get("learnerSeq"));
+            return (learnerSeq == NOT_SET) ? "-" : "R," + learnerSeq + ",0,0";
+        }
+        FlagSet flags = new FlagSet(fields[0]);
+        int payloadLength = fields[1].equals("?") ? 0 : Integer.parseInt(fields[1]);
+        long[] concreteNumbers = concretize(flags, "V", "V", payloadLength, randomSeq(),
+                (int) Calculator.randWithinRange(1000L, 0xffffL));
+        return new String(flags.toInitials()) + "," + concreteNumbers[0] + "," + concreteNumbers[1] + "," + payloadLength;
+    }
+
+    /**
+     * Length-prefixed frames in both directions, so that neither side scans for line ends. Requests are
+     * "STEP response input", which abstracts the response to the previous input and concretizes the next one,
+     * "RESET input", which resets and concretizes the first input, and "STOP". Replies are "response input".
+     */
+    private static void runFramed(Mapper mapper) throws IOException {
+        DataInputStream in = new DataInputStream(new BufferedInputStream(System.in));
+        DataOutputStream out = new DataOutputStream(new BufferedOutputStream(System.out));
+        while (true) {
+            byte[] request;
+            try {
+                request = new byte[in.readInt()];
+                in.readFully(request);
+            } catch (EOFException e) {
+                return;
+            }
+            String[] fields = new String(request, StandardCharsets.UTF_8).split(" ");
+            String reply;
+            if (fields[0].equals("STEP")) {
+                String response = mapper.abstractFramed(fields[1]);
+                reply = response + " " + mapper.concretizeFramed(fields[2]);
+            } else if (fields[0].equals("RESET")) {
+                mapper.sendReset();
+                reply = "- " + mapper.concretizeFramed(fields[1]);
+            } else if (fields[0].equals("STOP")) {
+                return;
+            } else {
+                throw new BugException("Got invalid request type: " + fields[0]);
+            }
+            byte[] bytes = reply.getBytes(StandardCharsets.UTF_8);
+            out.writeInt(bytes.length);
+            out.write(bytes);
+            out.flush();
+        }
+    }
+
     public static void main(String[] args) throws IOException {
         Mapper mapper = new Mapper();
+        if (args.length > 0 && args[0].equals("--framed")) {
+            runFramed(mapper);
+            return;
+        }
+        Scanner scanner = new Scanner(System.in);
         while (true) {
-            Scanner scanner = new Scanner(System.in);
             String command = scanner.nextLine();
 
             if (command.equals("RESET")) {
@@ -148,12 +269,34 @@ public class Mapper extends InvlangMapper {
                 mapper.sendReset();
             } else if (command.equals("STOP")) {
                 return;
+            } else if (command.equals("STATE")) {
+                System.out.println(mapper.stateToString());
+            } else if (command.startsWith("CONCRETIZE ")) {
+                // CONCRETIZE <seq> <ack> <symbol>, with the signed random draws to start from,
+                // so that other mapper implementations can be checked against this one.
+                String[] request = command.split(" ");
+                Matcher matcher = request.length == 4 ? SYMBOL.matcher(request[3]) : null;
+                if (matcher == null || !matcher.matches()) {
+                    // Every command gets a line, or a line-mode reader would wait out its deadline.
+                    System.out.println(ERROR);
+                } else {
+                    if (matcher.group(1).equals("RST")) {
+                        System.out.println(mapper.processOutgoingReset());
+                    } else {
+                        int payloadLength = 0;
+                        if (!matcher.group(4).equals("?")) {
+                            payloadLength = Integer.parseInt(matcher.group(4));
+                        }
+                        System.out.println(mapper.processOutgoingRequest(new FlagSet(matcher.group(1)), "V", "V",
+                                payloadLength, Integer.parseInt(request[1]), Integer.parseInt(request[2])));
+                    }
+                }
             } else {
                 String[] request = command.split(" ");
-                String patternString = "([A-Z+]+)\\(([0-9?]+),([0-9?]+),([0-9?]+)\\)";
-                Pattern pattern = Pattern.compile(patternString);
-                Matcher matcher = pattern.matcher(command);
+                Matcher matcher = SYMBOL.matcher(command);
+                boolean answered = false;
                 while (matcher.find()) {
+                    answered = true;
                     if (request[0].equals("ABSTRACT")) {
                         if (matcher.group(1).equals("RST")) {
                             System.out.println(mapper.processOutgoingReset());
@@ -174,6 +317,9 @@ public class Mapper extends InvlangMapper {
                         return;
                     }
                 }
+                if (!answered) {
+                    System.out.println(ERROR);
+                }
             }
         }
     }